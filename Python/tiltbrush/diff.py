@@ -0,0 +1,199 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Structural diffs between two sketches, eg two saves of the same one.
+
+Each stroke is hashed from its record bytes; control points that haven't
+been decoded are hashed raw, so nothing is decoded. The brush is hashed
+by guid rather than index, so strokes match even if BrushIndex changed.
+Strokes are then matched by hash:
+  unchanged  Same hash on both sides
+  moved      Unchanged, but out of order relative to the other
+             unchanged strokes
+  modified   Same control points but different brush, color, size or
+             extensions; or the reverse
+  added, removed  Everything else
+See:
+  diff_sketches()
+  stroke_digest()"""
+
+import bisect
+import hashlib
+import struct
+from collections import defaultdict, deque
+from io import BytesIO
+
+from tiltbrush.tilt import Tilt, binfile
+
+__all__ = ('diff_sketches', 'stroke_digest')
+
+
+class _Digests(object):
+  __slots__ = ('full', 'head', 'points')
+
+  def __init__(self, head, points):
+    self.head = hashlib.sha1(head).digest()
+    self.points = hashlib.sha1(points).digest()
+    self.full = hashlib.sha1(self.head + self.points).digest()
+
+
+def _brush(stroke, brushes):
+  if brushes is not None and 0 <= stroke.brush_idx < len(brushes):
+    return brushes[stroke.brush_idx]
+  return stroke.brush_idx
+
+
+def _digests(stroke, brushes=None):
+  tmpf = BytesIO()
+  b = binfile(tmpf)
+  b.write_length_prefixed(str(_brush(stroke, brushes)))
+  b.pack("<4f", *stroke.brush_color)
+  b.pack("<fII", stroke.brush_size, stroke.stroke_mask, stroke.cp_mask)
+  stroke.stroke_ext_writer(b, stroke.extension)
+  head = tmpf.getvalue()
+
+  if 'controlpoints' in stroke.__dict__:
+    tmpf = BytesIO()
+    b = binfile(tmpf)
+    b.pack("<i", len(stroke.controlpoints))
+    for cp in stroke.controlpoints:
+      cp._write(b, stroke.cp_ext_writer)
+    points = tmpf.getvalue()
+  else:
+    (_, num_cp, raw) = stroke.__dict__['_controlpoints']
+    points = struct.pack("<i", num_cp) + raw
+  return _Digests(head, points)
+
+
+def stroke_digest(stroke, brushes=None):
+  """Returns a hash of *stroke*'s contents, as a hex string. *brushes*
+  is the sketch's metadata['BrushIndex']; pass it so that the brush is
+  hashed by guid."""
+  return _digests(stroke, brushes).full.encode('hex')
+
+
+def _pair(keys_a, indices_a, keys_b, indices_b):
+  """Pairs up indices with equal keys, in order. Returns (pairs,
+  unpaired a indices, unpaired b indices)."""
+  by_key = defaultdict(deque)
+  for j in indices_b:
+    by_key[keys_b[j]].append(j)
+  pairs = []
+  unpaired_a = []
+  for i in indices_a:
+    candidates = by_key.get(keys_a[i])
+    if candidates:
+      pairs.append((i, candidates.popleft()))
+    else:
+      unpaired_a.append(i)
+  paired_b = set(j for (_, j) in pairs)
+  return (pairs, unpaired_a, [j for j in indices_b if j not in paired_b])
+
+
+def _out_of_order(pairs):
+  """Given (i, j) pairs sorted by i, returns those not in a longest run
+  of increasing j."""
+  tails = []      # tails[n] is the smallest j ending an increasing run of n+1
+  tail_pos = []   # position in pairs of tails[n]
+  prev = [None] * len(pairs)
+  for (pos, (_, j)) in enumerate(pairs):
+    n = bisect.bisect_left(tails, j)
+    if n == len(tails):
+      tails.append(j)
+      tail_pos.append(pos)
+    else:
+      tails[n] = j
+      tail_pos[n] = pos
+    prev[pos] = tail_pos[n - 1] if n > 0 else None
+  in_order = set()
+  pos = tail_pos[-1] if tail_pos else None
+  while pos is not None:
+    in_order.add(pos)
+    pos = prev[pos]
+  return [pair for (pos, pair) in enumerate(pairs) if pos not in in_order]
+
+
+def _changed_fields(sa, sb, brushes_a, brushes_b, da, db):
+  changed = []
+  if _brush(sa, brushes_a) != _brush(sb, brushes_b):
+    changed.append('brush')
+  if list(sa.brush_color) != list(sb.brush_color):
+    changed.append('color')
+  if sa.brush_size != sb.brush_size:
+    changed.append('size')
+  if (sa.stroke_mask, list(sa.extension)) != (sb.stroke_mask, list(sb.extension)):
+    changed.append('extension')
+  if sa.cp_mask != sb.cp_mask or da.points != db.points:
+    changed.append('controlpoints')
+  return changed
+
+
+def _diff_metadata(ma, mb):
+  return {
+    'added': sorted(k for k in mb if k not in ma),
+    'removed': sorted(k for k in ma if k not in mb),
+    'changed': sorted(k for k in ma if k in mb and ma[k] != mb[k]),
+  }
+
+
+def diff_sketches(a, b):
+  """Compares two sketches, each a Tilt or a path to a .tilt. Returns
+    { 'identical': bool,
+      'strokes': [ number in a, number in b ],
+      'unchanged': number of strokes in both,
+      'added': [ b index, ... ],
+      'removed': [ a index, ... ],
+      'moved': [ [a index, b index], ... ],
+      'modified': [ { 'a', 'b', 'changed': [ field name, ... ] }, ... ],
+      'metadata': { 'added', 'removed', 'changed': [ key, ... ] } }
+  Field names are brush, color, size, extension and controlpoints."""
+  if not isinstance(a, Tilt):
+    a = Tilt(a)
+  if not isinstance(b, Tilt):
+    b = Tilt(b)
+  (strokes_a, strokes_b) = (a.sketch.strokes, b.sketch.strokes)
+  brushes_a = a.metadata.get('BrushIndex')
+  brushes_b = b.metadata.get('BrushIndex')
+  digests_a = [_digests(s, brushes_a) for s in strokes_a]
+  digests_b = [_digests(s, brushes_b) for s in strokes_b]
+
+  def keys(digests, field):
+    return [getattr(d, field) for d in digests]
+  (unchanged, rest_a, rest_b) = _pair(
+    keys(digests_a, 'full'), range(len(strokes_a)),
+    keys(digests_b, 'full'), range(len(strokes_b)))
+  modified = []
+  for field in ('points', 'head'):
+    (pairs, rest_a, rest_b) = _pair(keys(digests_a, field), rest_a,
+                                    keys(digests_b, field), rest_b)
+    modified.extend(pairs)
+  modified.sort()
+
+  result = {
+    'strokes': [len(strokes_a), len(strokes_b)],
+    'unchanged': len(unchanged),
+    'added': rest_b,
+    'removed': rest_a,
+    'moved': [list(pair) for pair in _out_of_order(unchanged)],
+    'modified': [
+      { 'a': i, 'b': j,
+        'changed': _changed_fields(strokes_a[i], strokes_b[j], brushes_a, brushes_b,
+                                   digests_a[i], digests_b[j]) }
+      for (i, j) in modified ],
+    'metadata': _diff_metadata(a.metadata, b.metadata),
+  }
+  result['identical'] = not (
+    result['added'] or result['removed'] or result['moved'] or
+    result['modified'] or any(result['metadata'].values()))
+  return result
@@ -16,14 +16,30 @@
 Typically you should prefer the .fbx exported straight out of Tilt Brush.
 See:
   iter_strokes()
-  class TiltBrushMesh"""
+  map_brush_groups()
+  class TiltBrushMesh
+
+numpy is optional; it is only needed for array-backed meshes."""
 
 import base64
+import copy
+from functools import wraps
 from itertools import izip_longest
 import json
+import os
+import re
+import shutil
 import struct
+import tempfile
 from uuid import UUID
 
+from tiltbrush import instrument
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
 SINGLE_SIDED_FLAT_BRUSH = set([
   UUID("cb92b597-94ca-4255-b017-0e3f42f12f9e"), # Fire
   UUID("cf019139-d41c-4eb0-a1d0-5cf54b0a42f3"), # Highlighter
@@ -35,20 +51,504 @@ SINGLE_SIDED_FLAT_BRUSH = set([
   UUID("d229d335-c334-495a-a801-660ac8a87360"), # Velvet Ink
 ])
 
+# Arrays at least this big are handed back from map_brush_groups()
+# workers through shared memory, rather than pickled
+HANDOFF_MIN_BYTES = 1 << 16
+# Preferred directory for shared-memory hand-off files
+HANDOFF_DIR = '/dev/shm'
+
+# Open boundary edges are constrained this much more strongly than
+# surfaces during decimation
+BOUNDARY_QUADRIC_WEIGHT = 1000.0
+# Each round of decimation considers this fraction of the cheapest
+# collapses; smaller is slower but closer to one-at-a-time
+DECIMATE_BATCH = 0.25
+
 def _grouper(n, iterable, fillvalue=None):
   """grouper(3, 'ABCDEFG', 'x') --> ABC DEF Gxx"""
   args = [iter(iterable)] * n
   return izip_longest(fillvalue=fillvalue, *args)
 
 
-def iter_meshes(filename):
-  """Given a Tilt Brush .json export, yields TiltBrushMesh instances."""
-  obj = json.load(file(filename, 'rb'))
-  lookup = obj['brushes']
-  for dct in lookup:
-    dct['guid'] = UUID(dct['guid'])
-  for json_stroke in obj['strokes']:
-    yield TiltBrushMesh._from_json(json_stroke, lookup)
+def _require_numpy():
+  if np is None:
+    raise ImportError("Array-backed meshes require numpy")
+
+
+class _JsonStream(object):
+  """Incremental reader for very large json documents.
+  Containers are walked one element at a time with iter_object() and
+  iter_array(); every other value is decoded whole with value(). Only
+  the data needed for the value being decoded is kept in memory."""
+  CHUNK_SIZE = 1 << 20
+  _WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+  def __init__(self, inf):
+    self.inf = inf
+    self.buf = ''
+    self.pos = 0
+    self.discarded = 0  # number of bytes dropped from the front of buf
+    self.eof = False
+    self.decoder = json.JSONDecoder()
+
+  def _fill(self, nbytes):
+    """Append at least nbytes to the buffer, dropping what's been consumed.
+    Returns False if there was nothing left to read."""
+    if self.eof:
+      return False
+    data = self.inf.read(max(nbytes, self.CHUNK_SIZE))
+    if not data:
+      self.eof = True
+      return False
+    self.discarded += self.pos
+    self.buf = self.buf[self.pos:] + data
+    self.pos = 0
+    return True
+
+  def _error(self, msg):
+    return ValueError('%s at offset %d' % (msg, self.discarded + self.pos))
+
+  def peek(self):
+    """Skips whitespace; returns the next character, or '' at eof."""
+    while True:
+      self.pos = self._WHITESPACE.match(self.buf, self.pos).end()
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if not self._fill(self.CHUNK_SIZE):
+        return ''
+
+  def expect(self, chars):
+    """Consumes and returns the next character, which must be in *chars*."""
+    c = self.peek()
+    if c == '' or c not in chars:
+      raise self._error('Expected one of %r, got %r' % (chars, c))
+    self.pos += 1
+    return c
+
+  def value(self):
+    """Decodes and returns the next json value."""
+    self.peek()
+    grow = self.CHUNK_SIZE
+    while True:
+      try:
+        val, end = self.decoder.raw_decode(self.buf, self.pos)
+      except ValueError:
+        # Most likely the value is cut off by the end of the buffer.
+        # Grow geometrically so huge values don't get rescanned too often.
+        if not self._fill(grow):
+          raise self._error('Bad or truncated json value')
+      else:
+        # Numbers can be silently truncated at the end of the buffer
+        if end < len(self.buf) or not self._fill(grow):
+          self.pos = end
+          return val
+      grow *= 2
+
+  def iter_object(self):
+    """Yields the keys of a json object. The caller must consume the
+    corresponding value (with value(), iter_object() or iter_array())
+    before asking for the next key."""
+    self.expect('{')
+    if self.peek() == '}':
+      self.pos += 1
+      return
+    while True:
+      key = self.value()
+      if not isinstance(key, basestring):
+        raise self._error('Expected object key, got %r' % (key,))
+      self.expect(':')
+      yield key
+      if self.expect(',}') == '}':
+        return
+
+  def iter_array(self):
+    """Yields the elements of a json array, decoded one at a time."""
+    self.expect('[')
+    if self.peek() == ']':
+      self.pos += 1
+      return
+    while True:
+      yield self.value()
+      if self.expect(',]') == ']':
+        return
+
+
+def _with_arrays(method):
+  """Decorator for TiltBrushMesh methods that only know how to operate
+  on array-backed meshes. List-backed meshes are converted to arrays for
+  the duration of the call, and back to lists afterwards."""
+  @wraps(method)
+  def wrapper(self, *args, **kwargs):
+    if self.uses_arrays:
+      return method(self, *args, **kwargs)
+    self.to_arrays()
+    try:
+      return method(self, *args, **kwargs)
+    finally:
+      self.to_lists()
+  return wrapper
+
+
+def _row_keys(rows):
+  """Returns a 1-D array with one opaque, comparable key per row of the
+  2-D array *rows*, for use with np.unique and friends."""
+  rows = np.ascontiguousarray(rows)
+  return rows.view(np.dtype((np.void, rows.itemsize * rows.shape[1]))).ravel()
+
+
+def _weld_groups(v, n, match_rows, eps, cos_eps, offset):
+  """Returns an array mapping each vert to the lowest-index vert it
+  should be merged into. Verts are bucketed into a grid of cell size
+  *eps* shifted by *offset* cells, and further split by *match_rows*.
+  Each round, the first unassigned vert in a bucket becomes the leader
+  for all unassigned verts in that bucket that are within tolerance."""
+  num_verts = len(v)
+  cells = np.floor(v / eps + offset).astype(np.int64)
+  rows = [cells.view(np.uint32)]
+  if match_rows is not None:
+    rows.append(match_rows)
+  _, bucket = np.unique(_row_keys(np.hstack(rows)), return_inverse=True)
+
+  leader = np.empty(num_verts, dtype=np.intp)
+  unassigned = np.arange(num_verts)
+  bucket_leader = np.empty(bucket.max() + 1 if num_verts else 0, dtype=np.intp)
+  while len(unassigned):
+    b = bucket[unassigned]
+    # unassigned is sorted, so the first hit is the lowest-index vert
+    _, first = np.unique(b, return_index=True)
+    bucket_leader[b[first]] = unassigned[first]
+    lead = bucket_leader[b]
+    delta = v[unassigned] - v[lead]
+    ok = np.einsum('ij,ij->i', delta, delta) <= eps * eps
+    if n is not None:
+      ok &= np.einsum('ij,ij->i', n[unassigned], n[lead]) >= cos_eps
+    ok[first] = True
+    leader[unassigned[ok]] = lead[ok]
+    unassigned = unassigned[~ok]
+  return leader
+
+
+def _degenerate_mask(tri):
+  """Returns a boolean mask of the degenerate rows of (M,3) array *tri*."""
+  t0, t1, t2 = tri[:, 0], tri[:, 1], tri[:, 2]
+  return (t0 == t1) | (t1 == t2) | (t2 == t0)
+
+
+def _canonical_tris(tri):
+  """Rotates each row of the (M,3) index array *tri* so that the lowest
+  index comes first, preserving winding."""
+  t0, t1, t2 = tri[:, 0], tri[:, 1], tri[:, 2]
+  shift = np.where((t0 <= t1) & (t0 <= t2), 0, np.where(t1 <= t2, 1, 2))
+  cols = (shift[:, np.newaxis] + np.arange(3)) % 3
+  return tri[np.arange(len(tri))[:, np.newaxis], cols]
+
+
+def _vertex_quadrics(v, tri):
+  """Returns (N,4,4) error quadrics for the (N,3) float64 verts *v*: the
+  sum of the planes of each vert's triangles, plus a constraint plane
+  through each open-boundary edge, perpendicular to its triangle."""
+  quadrics = np.zeros((len(v), 4, 4))
+  if len(tri) == 0:
+    return quadrics
+  p0, p1, p2 = v[tri[:, 0]], v[tri[:, 1]], v[tri[:, 2]]
+  normal = np.cross(p1 - p0, p2 - p0)
+  length = np.sqrt(np.einsum('ij,ij->i', normal, normal))
+  normal /= np.where(length > 0, length, 1)[:, np.newaxis]
+
+  def add_planes(verts, n, points, weight=1.0):
+    plane = np.column_stack([n, -np.einsum('ij,ij->i', n, points)])
+    outer = (plane[:, :, np.newaxis] * plane[:, np.newaxis, :]).reshape(-1, 16)
+    for column in verts:
+      _add_grouped(quadrics.reshape(-1, 16), column, weight * outer)
+
+  add_planes(tri.T, normal, p0)
+
+  # Edges used by exactly one triangle, in either direction
+  edges = np.concatenate([tri[:, [0, 1]], tri[:, [1, 2]], tri[:, [2, 0]]])
+  edge_faces = np.tile(np.arange(len(tri)), 3)
+  keys = _row_keys(np.ascontiguousarray(np.sort(edges, axis=1), dtype=np.int64)
+                   .view(np.uint32))
+  _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+  boundary = counts[inverse] == 1
+  if boundary.any():
+    (a, b) = edges[boundary].T
+    along = v[b] - v[a]
+    n = np.cross(along, normal[edge_faces[boundary]])
+    length = np.sqrt(np.einsum('ij,ij->i', n, n))
+    n /= np.where(length > 0, length, 1)[:, np.newaxis]
+    add_planes((a, b), n, v[a], BOUNDARY_QUADRIC_WEIGHT)
+  return quadrics
+
+
+def _quadric_terms(h):
+  """Returns (N,10) monomials of the homogeneous verts *h*, such that
+  the error of quadric Q at vert i is terms[i] . _quadric_coefficients(Q)."""
+  (rows, cols) = np.triu_indices(4)
+  return h[:, rows] * h[:, cols] * np.where(rows == cols, 1.0, 2.0)
+
+
+def _quadric_coefficients(quadrics):
+  """Returns the (N,10) upper-triangle coefficients of (N,4,4) quadrics."""
+  (rows, cols) = np.triu_indices(4)
+  return quadrics[:, rows, cols]
+
+
+def _add_grouped(dest, index, values):
+  """dest[index] += values, for (N,K) arrays, where index may repeat."""
+  for column in xrange(dest.shape[1]):
+    dest[:, column] += np.bincount(index, weights=values[:, column],
+                                   minlength=len(dest))
+
+
+def _collapse_effects(v, tri, vert_tris, remove, keep):
+  """For the half-edge collapses of *remove* onto *keep*, returns
+  (whether each would flip a triangle, triangles each would delete).
+  *vert_tris* is (offsets, triangles) listing each vert's triangles."""
+  (offsets, tris) = vert_tris
+  degree = offsets[remove + 1] - offsets[remove]
+  collapse = np.repeat(np.arange(len(remove)), degree)
+  within = np.arange(len(collapse)) - np.repeat(np.cumsum(degree) - degree, degree)
+  face = tri[tris[offsets[remove][collapse] + within]]
+  (r, k) = (remove[collapse, np.newaxis], keep[collapse, np.newaxis])
+  deleted = (face == k).any(axis=1)
+  moved = np.where(face == r, k, face)
+  def normals(f):
+    (p0, p1, p2) = (v[f[:, 0]], v[f[:, 1]], v[f[:, 2]])
+    return np.cross(p1 - p0, p2 - p0)
+  flipped = ~deleted & (np.einsum('ij,ij->i', normals(face), normals(moved)) <= 0)
+  return (np.bincount(collapse[flipped], minlength=len(remove)) > 0,
+          np.bincount(collapse[deleted], minlength=len(remove)))
+
+
+def _decimate_tris(v, tri, quadrics, locked, target_tris, max_error):
+  """Collapses edges of the (M,3) triangles *tri* in order of quadric
+  error, until there are at most *target_tris* triangles or every
+  remaining collapse would cost more than *max_error* (if not None).
+  Each collapse moves one vert onto the other (a half-edge collapse);
+  verts flagged in *locked* never move, and collapses that would flip a
+  triangle are skipped.
+
+  Collapses are done in rounds, with numpy rather than a heap. Each
+  round finds every vert's cheapest collapse and, of the cheapest
+  DECIMATE_BATCH of those, performs the ones that are cheaper than any
+  other in the vert's triangles, cheapest first.
+  No two of them move verts of the same triangle, so they can be
+  checked and applied together.
+  Returns (surviving triangles, largest error of any collapse)."""
+  num_verts = len(v)
+  terms = _quadric_terms(np.column_stack([v, np.ones(num_verts)]))
+  coefficients = _quadric_coefficients(quadrics)
+  error = 0.0
+  while len(tri) > target_tris:
+    pairs = np.sort(np.concatenate([tri[:, [0, 1]], tri[:, [1, 2]], tri[:, [2, 0]]]),
+                    axis=1).astype(np.int64)
+    keys = np.unique(pairs[:, 0] * num_verts + pairs[:, 1])
+    (a, b) = (keys // num_verts, keys % num_verts)
+    # Both directions of each edge, as (vert to remove, vert to keep)
+    remove = np.concatenate([a, b])
+    keep = np.concatenate([b, a])
+    movable = ~locked[remove]
+    (remove, keep) = (remove[movable], keep[movable])
+    own = np.einsum('ij,ij->i', terms, coefficients)
+    cost = own[keep] + np.einsum('ij,ij->i', terms[keep], coefficients[remove])
+    if max_error is not None:
+      cheap = cost <= max_error
+      (remove, keep, cost) = (remove[cheap], keep[cheap], cost[cheap])
+    if len(cost) == 0:
+      break
+    # Keep each vert's cheapest collapse. Ranks are unique, so ties are
+    # broken consistently
+    by_cost = np.argsort(cost, kind='mergesort')
+    rank = np.empty(len(cost), dtype=np.int64)
+    rank[by_cost] = np.arange(len(cost))
+    key = np.sort(remove * len(cost) + rank)
+    first = np.ones(len(key), dtype=bool)
+    first[1:] = key[1:] // len(cost) != key[:-1] // len(cost)
+    rank = key[first] % len(cost)
+    (remove, keep, cost) = (remove[by_cost[rank]], keep[by_cost[rank]],
+                            cost[by_cost[rank]])
+    rank = rank.astype(np.intp)
+
+    tri_verts = tri.ravel()
+    degree = np.bincount(tri_verts, minlength=num_verts)
+    offsets = np.zeros(num_verts + 1, dtype=np.intp)
+    np.cumsum(degree, out=offsets[1:])
+    vert_tris = (offsets, np.argsort(tri_verts, kind='mergesort') // 3)
+    used = degree > 0
+
+    none = len(by_cost)
+    active = rank <= np.sort(rank)[int(len(rank) * DECIMATE_BATCH)]
+    while True:
+      vert_rank = np.full(num_verts, none, dtype=np.intp)
+      vert_rank[remove[active]] = rank[active]
+      tri_rank = vert_rank[tri].min(axis=1)
+      ring_rank = np.full(num_verts, none, dtype=np.intp)
+      ring_rank[used] = np.minimum.reduceat(tri_rank[vert_tris[1]],
+                                            offsets[:-1][used])
+      chosen = np.flatnonzero(active & (ring_rank[remove] == rank))
+      (flipped, deleted) = _collapse_effects(v, tri, vert_tris,
+                                             remove[chosen], keep[chosen])
+      if not flipped.any():
+        break
+      active[chosen[flipped]] = False
+    if len(chosen) == 0:
+      break
+
+    # Cheapest first, stopping at the target
+    by_cost = np.argsort(rank[chosen], kind='mergesort')
+    (chosen, deleted) = (chosen[by_cost], deleted[by_cost])
+    count = np.searchsorted(np.cumsum(deleted), len(tri) - target_tris) + 1
+    chosen = chosen[:count]
+    error = max(error, float(cost[chosen].max()))
+    (remove, keep) = (remove[chosen], keep[chosen])
+    # Several verts may collapse onto the same one
+    _add_grouped(coefficients, keep, coefficients[remove])
+    remap = np.arange(num_verts)
+    remap[remove] = keep
+    tri = remap[tri]
+    tri = tri[~_degenerate_mask(tri)]
+
+  return (tri, error)
+
+
+def iter_meshes(filename, arrays=False):
+  """Given a Tilt Brush .json export, yields TiltBrushMesh instances.
+  The export is parsed incrementally: meshes are yielded as their
+  strokes are read from disk, and only one stroke's json is in memory
+  at a time (unless the file lists strokes before brushes).
+  If *arrays*, the meshes are array-backed; this requires numpy."""
+  if arrays:
+    _require_numpy()
+  json_strokes = _iter_json_strokes(filename)
+  while True:
+    with instrument.phase('json_export_parse', objects=1) as phase:
+      item = next(json_strokes, None)
+      if item is None:
+        phase.objects = 0
+    if item is None:
+      return
+    (json_stroke, lookup) = item
+    with instrument.phase('mesh_decode', objects=1) as phase:
+      phase.nbytes = sum(len(value) for value in json_stroke.itervalues()
+                         if isinstance(value, basestring))
+      mesh = TiltBrushMesh._from_json(json_stroke, lookup, arrays)
+    yield mesh
+
+
+def _iter_json_strokes(filename):
+  """Yields (json stroke, brush lookup) for each stroke of an export,
+  without decoding the stroke's geometry."""
+  with file(filename, 'rb') as inf:
+    stream = _JsonStream(inf)
+    lookup = None
+    pending = []   # strokes seen before the brush table
+    seen_strokes = False
+    for key in stream.iter_object():
+      if key == 'brushes':
+        lookup = stream.value()
+        for dct in lookup:
+          dct['guid'] = UUID(dct['guid'])
+        for json_stroke in pending:
+          yield (json_stroke, lookup)
+        pending = None
+      elif key == 'strokes':
+        seen_strokes = True
+        for json_stroke in stream.iter_array():
+          if lookup is None:
+            pending.append(json_stroke)
+          else:
+            yield (json_stroke, lookup)
+      else:
+        stream.value()
+  if lookup is None:
+    raise KeyError('brushes')
+  if not seen_strokes:
+    raise KeyError('strokes')
+
+
+class _Handoff(object):
+  """Stands in for an array that was saved to a file by a worker."""
+  def __init__(self, filename):
+    self.filename = filename
+
+
+def _handoff_arrays(meshes, handoff_dir):
+  """Replaces each large array attribute of the array-backed *meshes*
+  with a _Handoff, so that only small objects are pickled."""
+  for mesh in meshes:
+    for attr_name in [a for (a, _, _) in TiltBrushMesh.VERTEX_ATTRIBUTES] + ['tri']:
+      arr = getattr(mesh, attr_name)
+      if arr is None or arr.nbytes < HANDOFF_MIN_BYTES:
+        continue
+      (fd, filename) = tempfile.mkstemp(suffix='.npy', dir=handoff_dir)
+      with os.fdopen(fd, 'wb') as outf:
+        np.save(outf, np.ascontiguousarray(arr))
+      setattr(mesh, attr_name, _Handoff(filename))
+  return meshes
+
+
+def _take_handoff_arrays(meshes):
+  """Undoes _handoff_arrays. The arrays are read-only memory maps of
+  the files, which are unlinked right away."""
+  for mesh in meshes:
+    for (attr_name, value) in mesh.__dict__.items():
+      if isinstance(value, _Handoff):
+        setattr(mesh, attr_name,
+                np.asarray(np.load(value.filename, mmap_mode='r')))
+        os.unlink(value.filename)
+  return meshes
+
+
+def _brush_group_job((process, json_strokes, lookup, handoff_dir)):
+  """Top-level so that it can be run in a process pool."""
+  meshes = [TiltBrushMesh._from_json(s, lookup, True) for s in json_strokes]
+  meshes = process(meshes)
+  if handoff_dir is not None:
+    meshes = _handoff_arrays(meshes, handoff_dir)
+  return meshes
+
+
+def map_brush_groups(filename, process, jobs=1):
+  """Given a Tilt Brush .json export, groups its strokes by brush guid
+  and calls process(meshes) on each group's array-backed meshes, in
+  stroke order. process returns a list of meshes. Returns all of those,
+  with groups in order of first appearance in the export.
+  If jobs > 1, groups are decoded and processed in that many processes;
+  *process* must then be picklable (eg a top-level function, or a
+  functools.partial of one). Large result arrays come back through
+  memory-mapped files rather than pipes. Results do not depend on jobs."""
+  _require_numpy()
+  groups = {}
+  order = []
+  lookup = None
+  for (json_stroke, lookup) in _iter_json_strokes(filename):
+    guid = lookup[json_stroke['brush']]['guid']
+    if guid not in groups:
+      groups[guid] = []
+      order.append(guid)
+    groups[guid].append(json_stroke)
+  if jobs <= 1:
+    return [mesh for guid in order
+            for mesh in _brush_group_job((process, groups.pop(guid), lookup, None))]
+
+  import multiprocessing
+  handoff_dir = tempfile.mkdtemp(
+    prefix='tiltbrush', dir=HANDOFF_DIR if os.path.isdir(HANDOFF_DIR) else None)
+  pool = multiprocessing.Pool(jobs)
+  try:
+    # Start the biggest groups first, so they don't finish last
+    sizes = dict((guid, sum(len(s.get('v', '')) for s in groups[guid]))
+                 for guid in order)
+    pending = {}
+    for guid in sorted(order, key=lambda g: -sizes[g]):
+      pending[guid] = pool.apply_async(
+        _brush_group_job, ((process, groups.pop(guid), lookup, handoff_dir),))
+    return [mesh for guid in order
+            for mesh in _take_handoff_arrays(pending[guid].get())]
+  finally:
+    pool.close()
+    pool.join()
+    shutil.rmtree(handoff_dir, ignore_errors=True)
 
 
 class TiltBrushMesh(object):
@@ -65,6 +565,12 @@ class TiltBrushMesh(object):
     .t          list of tangents (4-tuples, or None if missing)
 
     .tri        list of triangles (3-tuples of ints)
+
+  Meshes may instead be array-backed (see iter_meshes, to_arrays).
+  Each vertex attribute is then a numpy array with one row per vertex,
+  or None if missing: float32 (N,k) for v, n, uv0, uv1 and t, and uint32
+  (N,) for c. tri is a uint32 (M,3) array. Use to_lists() to get back
+  the list representation.
   """
   VERTEX_ATTRIBUTES = [
     # Attribute name, type code
@@ -75,10 +581,14 @@ class TiltBrushMesh(object):
     ('c',  'I', 1),
     ('t',  'f', 4),
   ]
+  # Type code -> numpy dtype for array-backed meshes
+  ARRAY_DTYPES = { 'f': '<f4', 'I': '<u4' }
 
   @classmethod
-  def _from_json(cls, obj, brush_lookup):
+  def _from_json(cls, obj, brush_lookup, arrays=False):
     """Factory method: For use by iter_meshes."""
+    if arrays:
+      return cls._from_json_arrays(obj, brush_lookup)
     empty = None
 
     stroke = TiltBrushMesh()
@@ -124,12 +634,57 @@ class TiltBrushMesh(object):
 
     return stroke
 
+  @classmethod
+  def _from_json_arrays(cls, obj, brush_lookup):
+    """Like _from_json, but creates an array-backed mesh. The arrays are
+    read-only views of the base64-decoded data."""
+    stroke = TiltBrushMesh()
+    brush = brush_lookup[obj['brush']]
+    stroke.brush_name = brush['name']
+    stroke.brush_guid = UUID(str(brush['guid']))
+
+    # If stroke is non-empty, 'v' is always present, and always comes first
+    num_verts = 0
+    for attr, typechar, expected_stride in cls.VERTEX_ATTRIBUTES:
+      if attr not in obj:
+        data = None
+      else:
+        data = np.frombuffer(base64.b64decode(obj[attr]),
+                             dtype=cls.ARRAY_DTYPES[typechar])
+        if attr == 'v':
+          num_verts = len(data) // 3
+        if num_verts == 0:
+          stride_words = expected_stride or 3
+        else:
+          assert (len(data) % num_verts) == 0
+          stride_words = len(data) // num_verts
+          assert (expected_stride is None) or (stride_words == expected_stride)
+        if stride_words > 1:
+          data = data.reshape(-1, stride_words)
+      setattr(stroke, attr, data)
+    if stroke.v is None:
+      stroke.v = np.zeros((0, 3), dtype=cls.ARRAY_DTYPES['f'])
+
+    # Triangle indices. 'tri' might not exist, if empty
+    if 'tri' in obj:
+      data = np.frombuffer(base64.b64decode(obj['tri']),
+                           dtype=cls.ARRAY_DTYPES['I'])
+      assert len(data) % 3 == 0
+      stroke.tri = data.reshape(-1, 3)
+    else:
+      stroke.tri = np.zeros((0, 3), dtype=cls.ARRAY_DTYPES['I'])
+
+    return stroke
+
   @classmethod
   def from_meshes(cls, strokes, name=None):
     """Collapses multiple TiltBrushMesh instances into one.
     Pass an iterable of at least 1 stroke.
-    Uses the brush from the first stroke."""
+    Uses the brush from the first stroke.
+    The result is array-backed if all the inputs are."""
     stroke_list = list(strokes)
+    if all(stroke.uses_arrays for stroke in stroke_list):
+      return cls._from_meshes_arrays(stroke_list, name)
     dest = TiltBrushMesh()
     dest.name = name
     dest.brush_name = stroke_list[0].brush_name
@@ -142,6 +697,8 @@ class TiltBrushMesh(object):
     dest.t = []
     dest.tri = []
     for stroke in stroke_list:
+      if stroke.uses_arrays:
+        stroke = copy.copy(stroke).to_lists()
       offset = len(dest.v)
       dest.v.extend(stroke.v)
       dest.n.extend(stroke.n)
@@ -153,22 +710,126 @@ class TiltBrushMesh(object):
                         for t in stroke.tri ])
     return dest
 
+  @classmethod
+  def _from_meshes_arrays(cls, stroke_list, name):
+    """Array implementation of from_meshes. The first pass sizes the
+    destination arrays; the second fills them in place.
+    An attribute that is missing from some inputs (or narrower in some
+    inputs) is zero-filled there; it is None only if missing from all."""
+    dest = TiltBrushMesh()
+    dest.name = name
+    dest.brush_name = stroke_list[0].brush_name
+    dest.brush_guid = stroke_list[0].brush_guid
+
+    vert_counts = [len(stroke.v) for stroke in stroke_list]
+    num_verts = sum(vert_counts)
+    num_tris = sum(len(stroke.tri) for stroke in stroke_list)
+
+    for attr, typechar, _ in cls.VERTEX_ATTRIBUTES:
+      sources = [(getattr(stroke, attr), count)
+                 for (stroke, count) in zip(stroke_list, vert_counts) if count]
+      present = [arr for (arr, _) in sources if arr is not None]
+      if attr != 'v' and len(present) == 0:
+        setattr(dest, attr, None)
+        continue
+      if present:
+        shape = (num_verts,) + max(arr.shape[1:] for arr in present)
+      else:
+        shape = (0, 3)  # Only possible for 'v', when all inputs are empty
+      if all(arr is not None and arr.shape[1:] == shape[1:]
+             for (arr, _) in sources):
+        out = np.empty(shape, dtype=cls.ARRAY_DTYPES[typechar])
+      else:
+        out = np.zeros(shape, dtype=cls.ARRAY_DTYPES[typechar])
+      offset = 0
+      for (arr, count) in sources:
+        if arr is None:
+          pass
+        elif arr.ndim == 1:
+          out[offset : offset + count] = arr
+        else:
+          out[offset : offset + count, :arr.shape[1]] = arr
+        offset += count
+      setattr(dest, attr, out)
+
+    dest.tri = np.empty((num_tris, 3), dtype=cls.ARRAY_DTYPES['I'])
+    vert_offset = tri_offset = 0
+    for (stroke, count) in zip(stroke_list, vert_counts):
+      tri_count = len(stroke.tri)
+      np.add(stroke.tri.astype(cls.ARRAY_DTYPES['I'], copy=False),
+             np.uint32(vert_offset),
+             out=dest.tri[tri_offset : tri_offset + tri_count])
+      vert_offset += count
+      tri_offset += tri_count
+    return dest
+
   def __init__(self):
     self.name = None
     self.brush_name = self.brush_guid = None
     self.v = self.n = self.uv0 = self.uv1 = self.c = self.t = None
     self.tri = None
 
+  @property
+  def uses_arrays(self):
+    """True if the mesh is array-backed."""
+    return np is not None and isinstance(self.v, np.ndarray)
+
+  def to_arrays(self):
+    """Convert the mesh to array-backed, in place. Returns self.
+    Missing entries in a partially-missing attribute are zero-filled."""
+    _require_numpy()
+    if self.uses_arrays:
+      return self
+    num_verts = len(self.v)
+    for attr, typechar, _ in self.VERTEX_ATTRIBUTES:
+      values = getattr(self, attr)
+      present = [val for val in values if val is not None]
+      if attr != 'v' and len(present) == 0:
+        setattr(self, attr, None)
+        continue
+      dtype = self.ARRAY_DTYPES[typechar]
+      if len(present) < num_verts:
+        zero = tuple(0 for _ in present[0]) if isinstance(present[0], tuple) else 0
+        values = [zero if val is None else val for val in values]
+      arr = np.array(values, dtype=dtype)
+      if attr == 'v':
+        arr = arr.reshape(-1, 3)
+      setattr(self, attr, arr)
+    self.tri = np.array(self.tri, dtype=self.ARRAY_DTYPES['I']).reshape(-1, 3)
+    return self
+
+  def to_lists(self):
+    """Convert the mesh to list-backed, in place. Returns self.
+    This gives the same representation that iter_meshes() produces
+    when it is not asked for arrays."""
+    if not self.uses_arrays:
+      return self
+    num_verts = len(self.v)
+    for attr, _, _ in self.VERTEX_ATTRIBUTES:
+      arr = getattr(self, attr)
+      if arr is None:
+        values = [None] * num_verts
+      elif arr.ndim > 1:
+        values = map(tuple, arr.tolist())
+      else:
+        values = arr.tolist()
+      setattr(self, attr, values)
+    self.tri = map(tuple, self.tri.tolist())
+    return self
+
   def collapse_verts(self, ignore=None):
     """Collapse verts with identical data.
     Put triangle indices into a canonical order, with lowest index first.
     *ignore* is a list of attribute names to ignore when comparing."""
-    # Convert from SOA to AOS
     compare = set(('n', 'uv0', 'uv1', 'c', 't'))
     if ignore is not None:
       compare -= set(ignore)
     compare = sorted(compare)
     compare.insert(0, 'v')
+    if self.uses_arrays:
+      return self._collapse_verts_arrays(compare)
+
+    # Convert from SOA to AOS
 
     struct_of_arrays = []
     for attr_name in sorted(compare):
@@ -213,10 +874,157 @@ class TiltBrushMesh(object):
 
     self.tri = map(remap_tri, self.tri)
 
+  def _collapse_verts_arrays(self, compare):
+    """Array implementation of collapse_verts. Gives the same results:
+    new verts are numbered in order of first appearance."""
+    num_verts = len(self.v)
+    if num_verts == 0:
+      return
+    # Pack the compared attributes into fixed-width rows of raw words
+    columns = []
+    for attr_name in compare:
+      arr = getattr(self, attr_name)
+      if arr is None:
+        continue   # Missing data always compares equal
+      if arr.dtype.kind == 'f':
+        arr = arr + arr.dtype.type(0)   # -0.0 -> 0.0, as tuples compare
+      columns.append(np.ascontiguousarray(arr).reshape(num_verts, -1)
+                     .view(np.uint32))
+    keys = _row_keys(np.hstack(columns))
+
+    # np.unique orders by key; renumber in order of first appearance
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='mergesort')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    old_index_to_new_index = rank[inverse]
+    new_index_to_old_index = first[order]
+
+    for attr_name, _, _ in self.VERTEX_ATTRIBUTES:
+      arr = getattr(self, attr_name)
+      if arr is not None:
+        setattr(self, attr_name, arr[new_index_to_old_index])
+    self.tri = _canonical_tris(old_index_to_new_index[self.tri]).astype(
+      self.ARRAY_DTYPES['I'])
+
+  @_with_arrays
+  def weld(self, position_eps, normal_angle_eps=None, match=()):
+    """Merge verts that are nearly coincident, then remove degenerate
+    triangles. Put triangle indices into a canonical order, as for
+    collapse_verts. The merged vert keeps the data of the lowest-index
+    vert it replaces.
+    *position_eps* is the distance within which verts are merged.
+    *normal_angle_eps*, if not None, is the largest angle (in radians)
+      between the normals of verts that are merged.
+    *match* is a list of attribute names that must be identical.
+
+    Verts are bucketed with a quantized spatial hash grid, and a second
+    pass with the grid shifted by half a cell catches most pairs that
+    straddle a cell boundary. A vert never moves by more than
+    2 * position_eps."""
+    if len(self.v) == 0:
+      return
+    v = self.v.astype(np.float64)
+    n = None
+    cos_eps = None
+    if normal_angle_eps is not None and self.n is not None:
+      n = self.n.astype(np.float64)
+      length = np.sqrt(np.einsum('ij,ij->i', n, n))
+      n /= np.where(length > 0, length, 1)[:, np.newaxis]
+      cos_eps = np.cos(normal_angle_eps)
+    match_rows = []
+    for attr_name in sorted(match):
+      arr = getattr(self, attr_name)
+      if arr is not None:
+        if arr.dtype.kind == 'f':
+          arr = arr + arr.dtype.type(0)
+        match_rows.append(np.ascontiguousarray(arr).reshape(len(v), -1)
+                          .view(np.uint32))
+    match_rows = np.hstack(match_rows) if match_rows else None
+
+    rep = _weld_groups(v, n, match_rows, position_eps, cos_eps, 0)
+    survivors = np.unique(rep)
+    rep2 = _weld_groups(v[survivors], None if n is None else n[survivors],
+                        None if match_rows is None else match_rows[survivors],
+                        position_eps, cos_eps, 0.5)
+    rep = survivors[rep2][np.searchsorted(survivors, rep)]
+
+    new_index_to_old_index = np.unique(rep)
+    old_index_to_new_index = np.searchsorted(new_index_to_old_index, rep)
+    for attr_name, _, _ in self.VERTEX_ATTRIBUTES:
+      arr = getattr(self, attr_name)
+      if arr is not None:
+        setattr(self, attr_name, arr[new_index_to_old_index])
+    tri = _canonical_tris(old_index_to_new_index[self.tri])
+    self.tri = tri[~_degenerate_mask(tri)].astype(self.ARRAY_DTYPES['I'])
+
+  @_with_arrays
+  def decimate(self, target_ratio=None, max_error=None):
+    """Reduce the triangle count with quadric-error edge collapses, then
+    drop unused verts. Returns the largest quadric error (roughly, a sum
+    of squared distances) of any collapse performed.
+    *target_ratio* is the fraction of triangles to keep.
+    *max_error*, if not None, stops decimation before any collapse that
+      would cost more; at least one of the two must be given.
+
+    A collapse moves one vert onto a neighbor, so surviving verts keep
+    their exact attributes. Attribute seams (eg uv or color), where verts
+    are split, are kept intact: verts that share a position with another
+    vert are never moved. Other open boundaries are heavily constrained
+    (see BOUNDARY_QUADRIC_WEIGHT) and keep their shape."""
+    if target_ratio is None and max_error is None:
+      raise ValueError("Need target_ratio or max_error")
+    num_tris = len(self.tri)
+    target_tris = 0 if target_ratio is None else int(round(target_ratio * num_tris))
+    if num_tris == 0 or target_tris >= num_tris:
+      return 0.0
+    v = self.v.astype(np.float64)
+    tri = self.tri.astype(np.intp)
+    _, inverse, counts = np.unique(_row_keys(self.v), return_inverse=True,
+                                   return_counts=True)
+    locked = counts[inverse] > 1
+    (faces, error) = _decimate_tris(v, tri, _vertex_quadrics(v, tri), locked,
+                                    target_tris, max_error)
+    tri = np.array(faces, dtype=np.intp).reshape(-1, 3)
+    new_index_to_old_index = np.unique(tri)
+    for attr_name, _, _ in self.VERTEX_ATTRIBUTES:
+      arr = getattr(self, attr_name)
+      if arr is not None:
+        setattr(self, attr_name, arr[new_index_to_old_index])
+    self.tri = np.searchsorted(new_index_to_old_index, tri) \
+                 .astype(self.ARRAY_DTYPES['I'])
+    return error
+
+  def build_lods(self, levels):
+    """Returns a list of decimated copies of the mesh, one per fraction
+    of this mesh's triangles in *levels*, eg (1, 0.5, 0.25). Each level
+    is decimated from the one before it. Copies are named <name>_LOD<i>,
+    as Unity's LODGroup import expects."""
+    base_name = self.name or self.brush_name or 'TiltBrush'
+    lods = []
+    current = self
+    for (i, ratio) in enumerate(levels):
+      lod = copy.copy(current)
+      if len(current.tri):
+        lod.decimate(target_ratio=ratio * len(self.tri) / float(len(current.tri)))
+      lod.name = '%s_LOD%d' % (base_name, i)
+      lods.append(lod)
+      current = lod
+    return lods
+
   def add_backfaces(self):
     """Double the number of triangles by adding an oppositely-wound
     triangle for every existing triangle."""
     num_verts = len(self.v)
+    if self.uses_arrays:
+      for attr_name, _, _ in self.VERTEX_ATTRIBUTES:
+        arr = getattr(self, attr_name)
+        if arr is not None:
+          flipped = -arr if attr_name == 'n' else arr
+          setattr(self, attr_name, np.concatenate([arr, flipped]))
+      self.tri = np.concatenate([self.tri, self.tri[:, [0, 2, 1]] + num_verts]) \
+                   .astype(self.ARRAY_DTYPES['I'])
+      return
 
     def flip_vec3(val):
       if val is None: return None
@@ -243,6 +1051,14 @@ class TiltBrushMesh(object):
     an oppositely-wound triangle using the same indices.
     Assumes triangle indices are in canonical order."""
     # (also removes duplicates, if any exist)
+    if self.uses_arrays:
+      # For canonical triangles, a triangle and its backface are the only
+      # two triangles with a given set of indices.
+      _, first = np.unique(_row_keys(np.sort(self.tri, axis=1)),
+                           return_index=True)
+      self.tri = self.tri[np.sort(first)]
+      return
+
     seen = set()
     new_tri = []
     for tri in self.tri:
@@ -257,14 +1073,43 @@ class TiltBrushMesh(object):
 
   def remove_degenerate(self):
     """Removes degenerate triangles."""
+    if self.uses_arrays:
+      self.tri = self.tri[~_degenerate_mask(self.tri)]
+      return
+
     def is_degenerate((t0, t1, t2)):
       return t0==t1 or t1==t2 or t2==t0
     self.tri = [t for t in self.tri if not is_degenerate(t)]
 
-  def add_backfaces_if_necessary(self):
-    """Try to detect geometry that is missing backface geometry"""
+  @_with_arrays
+  def add_backfaces_if_necessary(self, threshold=0.5):
+    """Try to detect geometry that is missing backface geometry, and add
+    backfaces if it is. A triangle has a backface if some triangle covers
+    the same positions with the opposite winding; backfaces are added if
+    fewer than *threshold* of the triangles have one.
+    Returns True if backfaces were added."""
+    # Match verts by position, since backfaces usually have their own verts
+    _, position_ids = np.unique(_row_keys(self.v + np.float32(0)),
+                                return_inverse=True)
+    tri = _canonical_tris(position_ids[self.tri])
+    tri = tri[~_degenerate_mask(tri)]
+    if len(tri) == 0:
+      return False
+    # Since tri is canonical, the reverse winding is t[0], t[2], t[1]
+    _, ids = np.unique(np.concatenate([_row_keys(tri),
+                                       _row_keys(tri[:, [0, 2, 1]])]),
+                       return_inverse=True)
+    has_backface = np.in1d(ids[:len(tri)], ids[len(tri):])
+    if np.mean(has_backface) >= threshold:
+      return False
+    self.add_backfaces()
+    return True
 
   def recenter(self):
+    if self.uses_arrays:
+      center = self.v.mean(axis=0, dtype=np.float64)
+      self.v = (self.v - center).astype(self.v.dtype)
+      return
     a0 = sum(v[0] for v in self.v) / len(self.v)
     a1 = sum(v[1] for v in self.v) / len(self.v)
     a2 = sum(v[2] for v in self.v) / len(self.v)
@@ -0,0 +1,656 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reads and writes TiltBrushMesh instances as binary .fbx files, without
+the Autodesk FBX SDK. Requires numpy.
+See:
+  read_fbx()
+  write_fbx()
+  FbxReader"""
+
+import copy
+import itertools
+import re
+import struct
+from uuid import UUID
+import zlib
+
+import numpy as np
+
+from tiltbrush.export import TiltBrushMesh
+
+__all__ = ('FbxReader', 'read_fbx', 'write_fbx')
+
+FBX_MAGIC = 'Kaydara FBX Binary  \x00\x1a\x00'
+FBX_VERSION = 7400
+# endOffset, numProperties, propertyListLen, nameLen
+NODE_HEADER_FMT = '<IIIB'
+# Version 7500 and later use 64-bit offsets
+NODE_HEADER_FMT_7500 = '<QQQB'
+NULL_RECORD = '\0' * struct.calcsize(NODE_HEADER_FMT)
+
+# The FBX SDK checks that FILE_ID, CREATION_TIME and FOOTER_ID agree;
+# these are the values Blender uses.
+FILE_ID = '\x28\xb3\x2a\xeb\xb6\x24\xcc\xc2\xbf\xc8\xb0\x2a\xa9\x2b\xfc\xf1'
+CREATION_TIME = '1970-01-01 10:00:00:000'
+FOOTER_ID = '\xfa\xbc\xab\x09\xd0\xc8\xd4\x66\xb1\x76\xfb\x83\x1c\xf7\x26\x7e'
+FOOTER_MAGIC = '\xf8\x5a\x8c\x6a\xde\xf5\xd9\x7e\xec\xe9\x0c\xe3\x75\x8f\x29\x0b'
+
+CREATOR = 'Tilt Brush Toolkit'
+
+# numpy dtype -> array property type code
+ARRAY_TYPES = {
+  np.dtype('<f4'): 'f',
+  np.dtype('<f8'): 'd',
+  np.dtype('<i4'): 'i',
+  np.dtype('<i8'): 'l',
+  np.dtype('bool'): 'b',
+}
+# array property type code -> numpy dtype
+ARRAY_DTYPES = dict((code, dtype) for (dtype, code) in ARRAY_TYPES.items())
+# scalar property type code -> struct format
+SCALAR_FORMATS = {
+  'Y': '<h', 'C': '<B', 'I': '<i', 'F': '<f', 'D': '<d', 'L': '<q',
+}
+
+# The legacy SDK-based exporter scaled Tilt Brush units to centimeters
+SCALE = 100.0
+
+
+# ----------------------------------------------------------------------
+# Node serialization
+# ----------------------------------------------------------------------
+
+def _node(name, props=(), children=()):
+  """Returns a node as a (name, props, children) tuple."""
+  return (name, props, children)
+
+
+def _encode_prop(value):
+  """Returns the binary encoding of a single property value.
+  Python types map to FBX types: bool -> C, int -> I, long -> L,
+  float -> D, str/unicode -> S, bytearray -> R, ndarray -> f/d/i/l/b.
+  Arrays are always zlib-compressed."""
+  if isinstance(value, bool):
+    return struct.pack('<cB', 'C', value)
+  elif isinstance(value, long):
+    return struct.pack('<cq', 'L', value)
+  elif isinstance(value, int):
+    return struct.pack('<ci', 'I', value)
+  elif isinstance(value, float):
+    return struct.pack('<cd', 'D', value)
+  elif isinstance(value, bytearray):
+    return struct.pack('<cI', 'R', len(value)) + str(value)
+  elif isinstance(value, basestring):
+    if isinstance(value, unicode):
+      value = value.encode('utf-8')
+    return struct.pack('<cI', 'S', len(value)) + value
+  elif isinstance(value, np.ndarray):
+    value = np.ascontiguousarray(value.ravel())
+    value = value.astype(value.dtype.newbyteorder('<'), copy=False)
+    data = zlib.compress(value.data)
+    return struct.pack('<cIII', ARRAY_TYPES[value.dtype], len(value),
+                       1, len(data)) + data
+  raise TypeError("Can't encode %r as an FBX property" % (value,))
+
+
+def _write_node(outf, node):
+  (name, props, children) = node
+  start = outf.tell()
+  prop_data = ''.join(_encode_prop(p) for p in props)
+  outf.write(struct.pack(NODE_HEADER_FMT, 0, len(props), len(prop_data),
+                         len(name)))
+  outf.write(name)
+  outf.write(prop_data)
+  for child in children:
+    _write_node(outf, child)
+  # Nodes with children, or with nothing at all, end with a null record
+  if children or not props:
+    outf.write(NULL_RECORD)
+  end = outf.tell()
+  outf.seek(start)
+  outf.write(struct.pack('<I', end))
+  outf.seek(end)
+
+
+def _write_footer(outf):
+  outf.write(FOOTER_ID)
+  outf.write('\0' * 4)
+  # Pad so that the file ends on a 16-byte boundary, as the SDK does
+  pad = (4 - outf.tell()) % 16
+  outf.write('\0' * (pad or 16))
+  outf.write(struct.pack('<I', FBX_VERSION))
+  outf.write('\0' * 120)
+  outf.write(FOOTER_MAGIC)
+
+
+# ----------------------------------------------------------------------
+# Scene
+# ----------------------------------------------------------------------
+
+def _object_name(name, cls):
+  """Binary .fbx object names are stored as name\\x00\\x01class."""
+  if isinstance(name, unicode):
+    name = name.encode('utf-8')
+  return '%s\x00\x01%s' % (name, cls)
+
+
+def _prop70(name, type_name, label, flags, *values):
+  return _node('P', (name, type_name, label, flags) + values)
+
+
+def _header_nodes():
+  timestamp = [_node('Version', (1000,))] + [
+    _node(k, (v,)) for (k, v) in zip(
+      ('Year', 'Month', 'Day', 'Hour', 'Minute', 'Second', 'Millisecond'),
+      (1970, 1, 1, 10, 0, 0, 0))]
+  return [
+    _node('FBXHeaderExtension', children=[
+      _node('FBXHeaderVersion', (1003,)),
+      _node('FBXVersion', (FBX_VERSION,)),
+      _node('EncryptionType', (0,)),
+      _node('CreationTimeStamp', children=timestamp),
+      _node('Creator', (CREATOR,)),
+    ]),
+    _node('FileId', (bytearray(FILE_ID),)),
+    _node('CreationTime', (CREATION_TIME,)),
+    _node('Creator', (CREATOR,)),
+    _node('GlobalSettings', children=[
+      _node('Version', (1000,)),
+      _node('Properties70', children=[
+        _prop70('UpAxis', 'int', 'Integer', '', 1),
+        _prop70('UpAxisSign', 'int', 'Integer', '', 1),
+        _prop70('FrontAxis', 'int', 'Integer', '', 2),
+        _prop70('FrontAxisSign', 'int', 'Integer', '', 1),
+        _prop70('CoordAxis', 'int', 'Integer', '', 0),
+        _prop70('CoordAxisSign', 'int', 'Integer', '', 1),
+        _prop70('UnitScaleFactor', 'double', 'Number', '', 1.0),
+      ]),
+    ]),
+    _node('Documents', children=[
+      _node('Count', (1,)),
+      _node('Document', (long(1), 'Scene', 'Scene'), children=[
+        _node('RootNode', (long(0),)),
+      ]),
+    ]),
+    _node('References'),
+  ]
+
+
+def _layer_element(kind, name, version, mapping, data_nodes):
+  return _node('LayerElement' + kind, (0,), children=[
+    _node('Version', (version,)),
+    _node('Name', (name,)),
+    _node('MappingInformationType', (mapping,)),
+    _node('ReferenceInformationType',
+          ('IndexToDirect' if kind == 'Material' else 'Direct',)),
+  ] + data_nodes)
+
+
+def _geometry_children(mesh):
+  """Returns the child nodes of a mesh's Geometry object."""
+  polygon_index = mesh.tri.astype(np.int32)
+  # The last index of each polygon is stored as -(index + 1)
+  polygon_index[:, 2] = ~polygon_index[:, 2]
+  children = [
+    _node('Vertices', (mesh.v.astype(np.float64) * SCALE,)),
+    _node('PolygonVertexIndex', (polygon_index,)),
+    _node('GeometryVersion', (124,)),
+  ]
+  layer = []
+  if mesh.n is not None:
+    children.append(_layer_element('Normal', 'normals', 102, 'ByVertice', [
+      _node('Normals', (mesh.n.astype(np.float64),))]))
+    layer.append('Normal')
+  if mesh.t is not None:
+    # Unity's FBX import requires Binormals to be present in order to
+    # import the tangents, but doesn't use them.
+    children.append(_layer_element('Binormal', 'binormals', 102, 'AllSame', [
+      _node('Binormals', (np.zeros(3),))]))
+    tangents = [_node('Tangents', (mesh.t[:, :3].astype(np.float64),))]
+    if mesh.t.shape[1] > 3:
+      tangents.append(_node('TangentsW', (mesh.t[:, 3].astype(np.float64),)))
+    children.append(_layer_element('Tangent', 'tangents', 102, 'ByVertice',
+                                   tangents))
+    layer += ['Binormal', 'Tangent']
+  children.append(_layer_element('Material', 'materials', 101, 'AllSame', [
+    _node('Materials', (np.zeros(1, dtype=np.int32),))]))
+  layer.append('Material')
+  if mesh.c is not None:
+    # abgr little-endian uint32 is rgba in memory
+    rgba = np.ascontiguousarray(mesh.c).view(np.uint8).reshape(-1, 4) / 255.0
+    children.append(_layer_element('Color', 'color', 101, 'ByVertice', [
+      _node('Colors', (rgba,))]))
+    layer.append('Color')
+  if mesh.uv0 is not None:
+    # Only the standard 2-component case is handled
+    children.append(_layer_element('UV', 'uv0', 101, 'ByVertice', [
+      _node('UV', (mesh.uv0[:, :2].astype(np.float64),))]))
+    layer.append('UV')
+  children.append(_node('Layer', (0,), children=[
+    _node('Version', (100,)),
+  ] + [
+    _node('LayerElement', children=[
+      _node('Type', ('LayerElement' + kind,)),
+      _node('TypedIndex', (0,)),
+    ]) for kind in layer
+  ]))
+  return children
+
+
+def _material_name(mesh):
+  """Like Tilt Brush, names materials <brush name>-<brush guid>, so that
+  read_fbx() can recover both."""
+  name = mesh.brush_name or 'TiltBrush'
+  if mesh.brush_guid is not None:
+    name = '%s-%s' % (name, mesh.brush_guid)
+  return name
+
+
+def write_fbx(meshes, outf_name):
+  """Emits TiltBrushMesh instances as a binary .fbx file, with one Model
+  and Geometry per mesh, and one lambert Material per brush, named with
+  the brush name and guid. Vertex
+  data is written as zlib-compressed array properties, built directly
+  from the mesh arrays."""
+  ids = itertools.count(2).next  # 1 is the Document
+  objects = []
+  connections = []
+  materials = {}
+  num_models = 0
+  for mesh in meshes:
+    if not mesh.uses_arrays:
+      mesh = copy.copy(mesh).to_arrays()
+    if len(mesh.v) == 0:
+      continue
+    name = mesh.name or 'Tilt Brush'
+    geometry_id, model_id = long(ids()), long(ids())
+    objects.append(_node(
+      'Geometry', (geometry_id, _object_name(name, 'Geometry'), 'Mesh'),
+      children=_geometry_children(mesh)))
+    objects.append(_node(
+      'Model', (model_id, _object_name(name, 'Model'), 'Mesh'), children=[
+        _node('Version', (232,)),
+        _node('Shading', (True,)),
+        _node('Culling', ('CullingOff',)),
+      ]))
+    num_models += 1
+    connections += [(model_id, long(0)), (geometry_id, model_id)]
+
+    brush = (mesh.brush_name, mesh.brush_guid)
+    if brush not in materials:
+      materials[brush] = material_id = long(ids())
+      objects.append(_node(
+        'Material', (material_id, _object_name(_material_name(mesh), 'Material'),
+                     ''), children=[
+          _node('Version', (102,)),
+          _node('ShadingModel', ('lambert',)),
+          _node('MultiLayer', (0,)),
+        ]))
+    connections.append((materials[brush], model_id))
+
+  definitions = [('GlobalSettings', 1), ('Model', num_models),
+                 ('Geometry', num_models), ('Material', len(materials))]
+  nodes = _header_nodes() + [
+    _node('Definitions', children=[
+      _node('Version', (100,)),
+      _node('Count', (len(definitions),)),
+    ] + [
+      _node('ObjectType', (kind,), children=[_node('Count', (count,))])
+      for (kind, count) in definitions
+    ]),
+    _node('Objects', children=objects),
+    _node('Connections', children=[
+      _node('C', ('OO', child, parent)) for (child, parent) in connections]),
+    _node('Takes', children=[_node('Current', ('',))]),
+  ]
+
+  with file(outf_name, 'wb') as outf:
+    outf.write(FBX_MAGIC)
+    outf.write(struct.pack('<I', FBX_VERSION))
+    for node in nodes:
+      _write_node(outf, node)
+    outf.write(NULL_RECORD)
+    _write_footer(outf)
+
+
+# ----------------------------------------------------------------------
+# Reading
+# ----------------------------------------------------------------------
+
+class _ArrayProperty(object):
+  """An array property whose data hasn't been read yet."""
+  __slots__ = ('code', 'count', 'encoding', 'offset', 'length')
+  def __init__(self, code, count, encoding, offset, length):
+    self.code = code
+    self.count = count
+    self.encoding = encoding
+    self.offset = offset
+    self.length = length
+
+
+class FbxNode(object):
+  """A node record read by FbxReader.
+  Public attributes:
+    .name
+    .props    list of property values. Array properties are numpy arrays;
+              they are read and decompressed the first time .props is
+              accessed.
+  Children are read on demand by iter_children(); a subtree that is
+  never iterated is skipped without being read."""
+  def __init__(self, reader, name, props, children_pos, end):
+    self.name = name
+    self.end = end
+    self._reader = reader
+    self._props = props
+    self._children_pos = children_pos
+
+  def __repr__(self):
+    return '<FbxNode %s>' % self.name
+
+  @property
+  def props(self):
+    props = self._props
+    for (i, prop) in enumerate(props):
+      if isinstance(prop, _ArrayProperty):
+        props[i] = self._reader._read_array(prop)
+    return props
+
+  def iter_children(self):
+    return self._reader._iter_nodes(self._children_pos, self.end)
+
+  def find(self, name):
+    """Returns the first child with the given name, or None."""
+    for child in self.iter_children():
+      if child.name == name:
+        return child
+    return None
+
+
+class FbxReader(object):
+  """Streaming reader for binary .fbx files. Nodes are parsed one at a
+  time as they are iterated, and only the parts of the file that are
+  visited are read. Use as a context manager, or call close().
+  Public attributes:
+    .version  FBX version, eg 7400"""
+  def __init__(self, filename):
+    self._file = file(filename, 'rb')
+    try:
+      header = self._file.read(len(FBX_MAGIC) + 4)
+      if header[:len(FBX_MAGIC)] != FBX_MAGIC:
+        raise ValueError("%s is not a binary .fbx file" % filename)
+      (self.version,) = struct.unpack_from('<I', header, len(FBX_MAGIC))
+      self._header_fmt = NODE_HEADER_FMT_7500 if self.version >= 7500 \
+                         else NODE_HEADER_FMT
+      self._header_size = struct.calcsize(self._header_fmt)
+      self._file.seek(0, 2)
+      self._size = self._file.tell()
+    except:
+      self._file.close()
+      raise
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self._file.close()
+
+  def iter_nodes(self):
+    """Yields the top-level nodes."""
+    return self._iter_nodes(len(FBX_MAGIC) + 4, self._size)
+
+  def _iter_nodes(self, pos, end):
+    # Seeks before every read, so that iterators can be interleaved
+    while pos < end:
+      node = self._read_node(pos)
+      if node is None:
+        return
+      yield node
+      pos = node.end
+
+  def _read(self, nbytes):
+    data = self._file.read(nbytes)
+    if len(data) != nbytes:
+      raise ValueError("Unexpected end of .fbx file")
+    return data
+
+  def _read_node(self, pos):
+    """Returns the node at pos, or None for a null record."""
+    self._file.seek(pos)
+    (end, num_props, props_len, name_len) = struct.unpack(
+      self._header_fmt, self._read(self._header_size))
+    if end == 0:
+      return None
+    name = self._read(name_len)
+    props_pos = pos + self._header_size + name_len
+    props = self._read_props(num_props)
+    if self._file.tell() != props_pos + props_len:
+      raise ValueError("Bad property list in .fbx node %s" % name)
+    return FbxNode(self, name, props, props_pos + props_len, end)
+
+  def _read_props(self, count):
+    props = []
+    for _ in xrange(count):
+      code = self._read(1)
+      if code in SCALAR_FORMATS:
+        fmt = SCALAR_FORMATS[code]
+        (value,) = struct.unpack(fmt, self._read(struct.calcsize(fmt)))
+        props.append(bool(value) if code == 'C' else value)
+      elif code in ARRAY_DTYPES:
+        (num, encoding, length) = struct.unpack('<III', self._read(12))
+        props.append(_ArrayProperty(code, num, encoding,
+                                    self._file.tell(), length))
+        self._file.seek(length, 1)
+      elif code in 'SR':
+        (length,) = struct.unpack('<I', self._read(4))
+        data = self._read(length)
+        props.append(data if code == 'S' else bytearray(data))
+      else:
+        raise ValueError("Unknown .fbx property type %r" % code)
+    return props
+
+  def _read_array(self, prop):
+    self._file.seek(prop.offset)
+    data = self._read(prop.length)
+    if prop.encoding == 1:
+      data = zlib.decompress(data)
+    elif prop.encoding != 0:
+      raise ValueError("Unknown .fbx array encoding %d" % prop.encoding)
+    arr = np.frombuffer(data, dtype=ARRAY_DTYPES[prop.code])
+    if len(arr) != prop.count:
+      raise ValueError("Bad .fbx array length")
+    return arr
+
+
+# Layer element kind -> (data node, index node, components, mesh attribute)
+LAYER_ELEMENTS = {
+  'Normal':  ('Normals',  'NormalsIndex',  3, 'n'),
+  'Tangent': ('Tangents', 'TangentsIndex', 3, 't'),
+  'Color':   ('Colors',   'ColorIndex',    4, 'c'),
+  'UV':      ('UV',       'UVIndex',       2, 'uv0'),
+}
+PER_VERTEX_MAPPINGS = ('ByVertice', 'ByVertex', 'ByControlPoint')
+
+# Matches names like Light-2241cd32-8ba2-48a5-9ee7-2caef7e9ed62
+GUID_SUFFIX_RE = re.compile(r'^(.*)-([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-'
+                            r'[0-9a-f]{4}-[0-9a-f]{12})$', re.I)
+
+
+def _split_object_name(value):
+  """Returns the name part of a name\\x00\\x01class object name."""
+  return value.split('\x00\x01')[0].decode('utf-8')
+
+
+def _triangulate(index):
+  """Returns (corners, tri), where corners is the vertex of each polygon
+  corner and tri indexes into corners. Polygons are triangulated as fans."""
+  index = index.astype(np.int64)
+  ends = index < 0
+  corners = np.where(ends, ~index, index)
+  end_pos = np.flatnonzero(ends)
+  starts = np.concatenate([[0], end_pos[:-1] + 1])
+  sizes = end_pos - starts + 1
+  if len(end_pos) and (sizes == 3).all() and end_pos[-1] == len(index) - 1:
+    return (corners, np.arange(len(index)).reshape(-1, 3))
+  num_tris = np.maximum(sizes - 2, 0)
+  first = np.repeat(starts, num_tris)
+  k = np.arange(num_tris.sum()) - np.repeat(np.cumsum(num_tris) - num_tris,
+                                            num_tris)
+  return (corners, np.column_stack([first, first + k + 1, first + k + 2]))
+
+
+def _read_layer_element(node, kind):
+  """Returns (mapping, rows) for a layer element, or None if its mapping
+  isn't supported. Reference indices are resolved."""
+  (data_name, index_name, width, _) = LAYER_ELEMENTS[kind]
+  mapping = reference = data = index = w = None
+  for child in node.iter_children():
+    if child.name == 'MappingInformationType':
+      mapping = child.props[0]
+    elif child.name == 'ReferenceInformationType':
+      reference = child.props[0]
+    elif child.name == data_name:
+      data = child.props[0]
+    elif child.name == index_name:
+      index = child.props[0]
+    elif child.name == 'TangentsW':
+      w = child.props[0]
+  if data is None or mapping not in PER_VERTEX_MAPPINGS + \
+     ('ByPolygonVertex', 'AllSame'):
+    return None
+  rows = data.reshape(-1, width)
+  if w is not None and len(w) == len(rows):
+    rows = np.column_stack([rows, w])
+  elif kind == 'Tangent':
+    rows = np.column_stack([rows, np.ones(len(rows))])
+  if reference == 'IndexToDirect' and index is not None:
+    rows = rows[index]
+  return (mapping, rows)
+
+
+def _read_geometry(node, scale):
+  """Returns an array-backed TiltBrushMesh for a Geometry node."""
+  verts = index = None
+  layers = {}
+  for child in node.iter_children():
+    if child.name == 'Vertices':
+      verts = child.props[0].reshape(-1, 3)
+    elif child.name == 'PolygonVertexIndex':
+      index = child.props[0]
+    elif child.name.startswith('LayerElement'):
+      kind = child.name[len('LayerElement'):]
+      if kind in LAYER_ELEMENTS and child.props[0] in (0, 1):
+        if kind != 'UV' and child.props[0] != 0:
+          continue
+        attr = 'uv%d' % child.props[0] if kind == 'UV' \
+               else LAYER_ELEMENTS[kind][3]
+        element = _read_layer_element(child, kind)
+        if element is not None:
+          layers[attr] = element
+    # Binormals, materials, and everything else are skipped
+  if verts is None or index is None:
+    return None
+
+  (corners, tri) = _triangulate(index)
+  # Per-corner data means splitting vertices, one per polygon corner
+  per_corner = any(mapping == 'ByPolygonVertex'
+                   for (mapping, _) in layers.values())
+  mesh = TiltBrushMesh()
+  if per_corner:
+    mesh.v = verts[corners]
+    mesh.tri = tri
+  else:
+    mesh.v = verts
+    mesh.tri = corners[tri]
+  mesh.v = (mesh.v * scale).astype(np.float32)
+  mesh.tri = mesh.tri.astype(np.uint32)
+  for (attr, (mapping, rows)) in layers.items():
+    if mapping == 'AllSame':
+      rows = np.repeat(rows[:1], len(mesh.v), axis=0)
+    elif per_corner and mapping in PER_VERTEX_MAPPINGS:
+      rows = rows[corners]
+    if attr == 'c':
+      # rgba in memory is abgr little-endian uint32
+      rgba = np.clip(np.round(rows * 255), 0, 255).astype(np.uint8)
+      rows = np.ascontiguousarray(rgba).view('<u4').reshape(-1)
+    else:
+      rows = rows.astype(np.float32)
+    if len(rows) == len(mesh.v):
+      setattr(mesh, attr, rows)
+  return mesh
+
+
+def read_fbx(filename):
+  """Returns a list of array-backed TiltBrushMesh, one per mesh Model in
+  the file, in file order. Meshes are named after their Model, and
+  brush_name is the name of the Model's first Material; brush_guid is
+  set if that name is of the form <brush name>-<guid>, and is otherwise
+  None.
+  Positions are converted to the units used by write_fbx. Polygons are
+  triangulated. Only the Objects, Connections and GlobalSettings
+  sections are read, and only the array data that's needed is
+  decompressed."""
+  scale = 1.0 / SCALE
+  geometries = {}
+  models = []
+  materials = {}
+  parents = {}
+  with FbxReader(filename) as reader:
+    for node in reader.iter_nodes():
+      if node.name == 'GlobalSettings':
+        props70 = node.find('Properties70')
+        for prop in (props70.iter_children() if props70 is not None else ()):
+          if prop.props[0] == 'UnitScaleFactor':
+            scale = prop.props[4] / SCALE
+      elif node.name == 'Objects':
+        for obj in node.iter_children():
+          if obj.name == 'Geometry' and obj.props[2] == 'Mesh':
+            geometries[obj.props[0]] = obj
+          elif obj.name == 'Model' and obj.props[2] == 'Mesh':
+            models.append((obj.props[0], _split_object_name(obj.props[1])))
+          elif obj.name == 'Material':
+            materials[obj.props[0]] = _split_object_name(obj.props[1])
+      elif node.name == 'Connections':
+        for conn in node.iter_children():
+          if conn.name == 'C' and conn.props[0] == 'OO':
+            parents.setdefault(conn.props[2], []).append(conn.props[1])
+
+    # Geometry is read once all the (small) scene nodes have been seen,
+    # so that unused geometry is never decompressed.
+    meshes = []
+    loaded = {}
+    for (model_id, name) in models:
+      children = parents.get(model_id, [])
+      geometry_ids = [c for c in children if c in geometries]
+      if not geometry_ids:
+        continue
+      geometry_id = geometry_ids[0]
+      if geometry_id not in loaded:
+        loaded[geometry_id] = _read_geometry(geometries[geometry_id], scale)
+      if loaded[geometry_id] is None:
+        continue
+      mesh = copy.copy(loaded[geometry_id])
+      mesh.name = name
+      material_names = [materials[c] for c in children if c in materials]
+      if material_names:
+        mesh.brush_name = material_names[0]
+        match = GUID_SUFFIX_RE.match(mesh.brush_name)
+        if match is not None:
+          mesh.brush_name = match.group(1)
+          mesh.brush_guid = UUID(match.group(2))
+      meshes.append(mesh)
+  return meshes
@@ -0,0 +1,265 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Integrity checks for .tilt files, packed or unpacked, that are much
+cheaper than loading them: control points are skipped over, never
+decoded. Each file gets a report like:
+  { 'path': ..., 'format': 'zip' or 'dir', 'ok': bool,
+    'strokes': int, 'controlpoints': int,
+    'problems': [ { 'check': ..., 'message': ... }, ... ] }
+where check is one of:
+  header        header.bin, as checked when unpacking
+  zip           Unreadable zip, or a member with a bad CRC
+  metadata      metadata.json missing, not json, or fails validate_metadata()
+  sketch        data.sketch missing, or its stroke structure is inconsistent
+  brush_index   A stroke's brush index is outside metadata's BrushIndex
+See:
+  check_tilt()
+  check_tilts()
+  find_tilts()"""
+
+import json
+import multiprocessing
+import os
+import struct
+import zipfile
+import zlib
+
+from tiltbrush.tilt import (BadMetadata, STROKE_EXTENSION_BITS,
+                            validate_metadata)
+from tiltbrush.unpack import ConversionError, _read_and_check_header
+
+__all__ = ('check_tilt', 'check_tilts', 'find_tilts')
+
+SKETCH_COOKIE = 0xc576a5cd
+# Same limits as tilt.Sketch and tilt.Stroke
+MAX_STROKES = 300000
+MAX_CONTROLPOINTS = 10000
+
+READ_CHUNK = 1 << 20
+
+
+class _Problem(Exception):
+  def __init__(self, check, message):
+    super(_Problem, self).__init__(message)
+    self.check = check
+
+
+def _stroke_ext_sizes(stroke_mask, memo={}):
+  """Returns a list with, for each stroke extension in stroke_mask, its
+  size in bytes or None for a length-prefixed blob."""
+  try:
+    return memo[stroke_mask]
+  except KeyError:
+    sizes = []
+    mask = stroke_mask
+    while mask:
+      bit = mask & ~(mask - 1)
+      mask ^= bit
+      try: info = STROKE_EXTENSION_BITS[bit]
+      except KeyError: info = STROKE_EXTENSION_BITS['unknown'](bit)
+      sizes.append(None if info[1] == '@' else struct.calcsize('<' + info[1]))
+    memo[stroke_mask] = sizes
+    return sizes
+
+
+def _bit_count(mask):
+  return bin(mask).count('1')
+
+
+def _check_sketch(data, num_brushes):
+  """Walks the stroke records of data.sketch. Returns
+  (num strokes, num control points, problems)."""
+  problems = []
+  def fail(message):
+    raise _Problem('sketch', message)
+  def unpack(fmt, offset, what):
+    try:
+      return struct.unpack_from(fmt, data, offset)
+    except struct.error:
+      fail("Truncated at %s (offset %d of %d)" % (what, offset, len(data)))
+
+  (cookie, version, unused) = unpack('<3I', 0, 'header')
+  if cookie != SKETCH_COOKIE:
+    fail("Bad cookie %#x" % cookie)
+  (additional,) = unpack('<I', 12, 'header')
+  offset = 16 + additional
+  (num_strokes,) = unpack('<i', offset, 'stroke count')
+  offset += 4
+  if not 0 <= num_strokes < MAX_STROKES:
+    fail("Bad stroke count %d" % num_strokes)
+
+  num_cp_total = 0
+  bad_brushes = set()
+  for i in xrange(num_strokes):
+    what = 'stroke %d' % i
+    (brush_idx,) = unpack('<i', offset, what)
+    (stroke_mask, cp_mask) = unpack('<II', offset + 24, what)
+    offset += 32
+    for size in _stroke_ext_sizes(stroke_mask):
+      if size is None:
+        (size,) = unpack('<I', offset, what + ' extension')
+        offset += 4
+      offset += size
+    (num_cp,) = unpack('<i', offset, what + ' control point count')
+    offset += 4
+    if not 0 <= num_cp < MAX_CONTROLPOINTS:
+      fail("Bad control point count %d in %s" % (num_cp, what))
+    offset += num_cp * 4 * (7 + _bit_count(cp_mask))
+    if offset > len(data):
+      fail("Truncated in %s control points (need %d bytes, have %d)" % (
+        what, offset, len(data)))
+    num_cp_total += num_cp
+    if num_brushes is not None and not 0 <= brush_idx < num_brushes:
+      bad_brushes.add(brush_idx)
+  if offset != len(data):
+    fail("%d unexpected bytes after the last stroke" % (len(data) - offset))
+  if bad_brushes:
+    problems.append({
+      'check': 'brush_index',
+      'message': "Brush indices %s are outside BrushIndex (%d entries)" % (
+        sorted(bad_brushes), num_brushes)})
+  return (num_strokes, num_cp_total, problems)
+
+
+def _read_zip_members(filename):
+  """Reads every member of a packed .tilt, which checks their CRCs.
+  Returns { name: data } for metadata.json and data.sketch."""
+  wanted = {}
+  try:
+    with zipfile.ZipFile(filename) as zf:
+      for info in zf.infolist():
+        with zf.open(info) as inf:
+          if info.filename in ('metadata.json', 'data.sketch'):
+            wanted[info.filename] = inf.read()
+          else:
+            while inf.read(READ_CHUNK):
+              pass
+  except (zipfile.BadZipfile, zlib.error, EOFError, IOError) as e:
+    raise _Problem('zip', str(e))
+  return wanted
+
+
+def _read_dir_members(dirname):
+  wanted = {}
+  for name in ('metadata.json', 'data.sketch'):
+    try:
+      with file(os.path.join(dirname, name), 'rb') as inf:
+        wanted[name] = inf.read()
+    except IOError:
+      pass
+  return wanted
+
+
+def check_tilt(filename):
+  """Checks one packed or unpacked .tilt. Returns its report; see the
+  module docstring. Never raises for bad data."""
+  report = {
+    'path': filename,
+    'format': 'dir' if os.path.isdir(filename) else 'zip',
+    'strokes': None,
+    'controlpoints': None,
+    'problems': [],
+  }
+  problems = report['problems']
+  def add(check, message):
+    problems.append({ 'check': check, 'message': message })
+
+  try:
+    if report['format'] == 'dir':
+      header_name = os.path.join(filename, 'header.bin')
+      if os.path.exists(header_name):
+        with file(header_name, 'rb') as inf:
+          _read_and_check_header(inf)
+    else:
+      with file(filename, 'rb') as inf:
+        _read_and_check_header(inf)
+  except ConversionError as e:
+    add('header', str(e))
+  except IOError as e:
+    add('header', str(e))
+
+  members = {}
+  try:
+    if report['format'] == 'dir':
+      members = _read_dir_members(filename)
+    elif not problems:
+      members = _read_zip_members(filename)
+  except _Problem as e:
+    add(e.check, str(e))
+
+  num_brushes = None
+  if 'metadata.json' not in members:
+    if report['format'] == 'dir' or not problems:
+      add('metadata', "Missing metadata.json")
+  else:
+    try:
+      metadata = json.loads(members['metadata.json'])
+      validate_metadata(metadata)
+      num_brushes = len(metadata['BrushIndex'])
+    except ValueError as e:
+      add('metadata', "Not valid json: %s" % e)
+    except BadMetadata as e:
+      add('metadata', str(e))
+    except (KeyError, TypeError) as e:
+      add('metadata', "Bad BrushIndex: %s" % e)
+
+  if 'data.sketch' not in members:
+    if report['format'] == 'dir' or not problems:
+      add('sketch', "Missing data.sketch")
+  else:
+    try:
+      (report['strokes'], report['controlpoints'], more) = \
+          _check_sketch(members['data.sketch'], num_brushes)
+      problems.extend(more)
+    except _Problem as e:
+      add(e.check, str(e))
+
+  report['ok'] = not problems
+  return report
+
+
+def find_tilts(paths):
+  """Yields the .tilt files and unpacked .tilt directories in *paths*,
+  which may be .tilt files or directories to search."""
+  for path in paths:
+    if path.endswith('.tilt') or not os.path.isdir(path):
+      yield path
+      continue
+    for (r, ds, fs) in os.walk(path):
+      ds.sort()
+      for f in sorted(fs):
+        if f.endswith('.tilt'):
+          yield os.path.join(r, f)
+      # Unpacked .tilts are directories; don't descend into them
+      for d in [d for d in ds if d.endswith('.tilt')]:
+        ds.remove(d)
+        yield os.path.join(r, d)
+
+
+def check_tilts(filenames, jobs=1):
+  """Yields check_tilt() reports for *filenames*, in order. With jobs > 1,
+  files are checked in a pool of that many processes."""
+  if jobs <= 1:
+    for filename in filenames:
+      yield check_tilt(filename)
+    return
+  pool = multiprocessing.Pool(jobs)
+  try:
+    for report in pool.imap(check_tilt, filenames, chunksize=4):
+      yield report
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
@@ -0,0 +1,221 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Generates geometry for .tilt strokes from their control points.
+Requires numpy.
+
+This is an approximation of what Tilt Brush does: flat brushes become
+ribbons (quad strips) and tube brushes become open tubes, sized by the
+brush size, stroke scale and pressure. Per-brush details like textures,
+tapering and particles are not reproduced.
+See:
+  iter_meshes()
+  stroke_to_mesh()"""
+
+from uuid import UUID
+
+import numpy as np
+
+from tiltbrush.export import TiltBrushMesh
+
+__all__ = ('iter_meshes', 'stroke_to_mesh')
+
+TUBE_BRUSH = set([
+  UUID("1caa6d7d-f015-3f54-3a4b-8b5354d39f81"), # Comet
+  UUID("4391aaaa-df73-4396-9e33-31e4e4930b27"), # Disco
+  UUID("2f212815-f4d3-c1a4-681a-feeaf9c6dc37"), # Icing
+  UUID("4391aaaa-df81-4396-9e33-31e4e4930b27"), # LightWire
+  UUID("d381e0f5-3def-4a0d-8853-31e9200bcbda"), # Lofted
+  UUID("b2ffef01-eaaa-4ab5-aa64-95a2c4f5dbc6"), # NeonPulse
+  UUID("4391385a-df73-4396-9e33-31e4e4930b27"), # Toon
+  UUID("4391385a-cf83-4396-9e33-31e4e4930b27"), # Wire
+])
+
+# Number of sides around a tube
+TUBE_SIDES = 8
+# Pressure in [0, 1] maps linearly to this fraction of the brush size
+PRESSURE_SIZE_RANGE = (0.1, 1.0)
+# Strokes are handed to worker processes in batches of this size
+STROKES_PER_JOB = 16
+
+
+def _rotate(q, v):
+  """Rotates v by each of the (N,4) xyzw quaternions in q."""
+  u = q[:, :3]
+  t = 2 * np.cross(u, v)
+  return v + q[:, 3:] * t + np.cross(u, t)
+
+
+def _normalize(v, fallback):
+  """Normalizes the rows of v, using rows of fallback where v is ~0."""
+  length = np.sqrt((v * v).sum(axis=1))
+  ok = length > 1e-12
+  out = np.array(fallback, dtype=np.float64)
+  out[ok] = v[ok] / length[ok, None]
+  return out
+
+
+def _pack_color(rgba):
+  """Returns a float rgba color as abgr little-endian uint32."""
+  rgba = np.clip(np.round(np.asarray(rgba, dtype=np.float64) * 255), 0, 255)
+  return np.array(rgba, dtype=np.uint8).view('<u4')[0]
+
+
+def stroke_to_mesh(positions, orientations, size, pressure=None,
+                   color=(1, 1, 1, 1), tube=False, tube_sides=TUBE_SIDES):
+  """Returns an array-backed TiltBrushMesh for a single stroke, or None
+  if the stroke has fewer than 2 distinct positions.
+  positions     (N,3) control point positions
+  orientations  (N,4) control point orientations, as xyzw quaternions
+  size          brush size; already multiplied by the stroke's scale
+  pressure      (N,) pressure in [0, 1], or None for full pressure
+  color         rgba, as 4 floats in [0, 1]
+  tube          If true, make a tube rather than a ribbon"""
+  positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+  orientations = np.asarray(orientations, dtype=np.float64).reshape(-1, 4)
+  if pressure is None:
+    pressure = np.ones(len(positions))
+  pressure = np.asarray(pressure, dtype=np.float64)
+
+  # Tilt Brush doesn't make geometry for zero-length segments
+  keep = np.ones(len(positions), dtype=bool)
+  keep[1:] = (np.diff(positions, axis=0) != 0).any(axis=1)
+  (positions, orientations, pressure) = \
+      (positions[keep], orientations[keep], pressure[keep])
+  num_cp = len(positions)
+  if num_cp < 2:
+    return None
+
+  # Per-control-point frame: tangent along the stroke, and the
+  # controller's right vector made perpendicular to it
+  forward = _rotate(orientations, np.array([0.0, 0.0, 1.0]))
+  tangent = _normalize(np.gradient(positions, axis=0), forward)
+  right = _rotate(orientations, np.array([1.0, 0.0, 0.0]))
+  right -= tangent * (right * tangent).sum(axis=1)[:, None]
+  right = _normalize(right, _rotate(orientations, np.array([0.0, 1.0, 0.0])))
+  (lo, hi) = PRESSURE_SIZE_RANGE
+  radius = 0.5 * size * (lo + (hi - lo) * np.clip(pressure, 0, 1))
+
+  arc_length = np.concatenate(
+    [[0], np.cumsum(np.sqrt((np.diff(positions, axis=0) ** 2).sum(axis=1)))])
+  u = arc_length / arc_length[-1]
+
+  if tube:
+    # One ring of tube_sides + 1 verts per control point; the seam is
+    # duplicated so that uvs don't wrap
+    ring = tube_sides + 1
+    angle = np.linspace(0, 2 * np.pi, ring)
+    binormal = np.cross(tangent, right)
+    normals = (np.cos(angle)[None, :, None] * right[:, None, :] +
+               np.sin(angle)[None, :, None] * binormal[:, None, :])
+    verts = positions[:, None, :] + radius[:, None, None] * normals
+    uv = np.empty((num_cp, ring, 2))
+    uv[:, :, 0] = u[:, None]
+    uv[:, :, 1] = angle[None, :] / (2 * np.pi)
+    a = (np.arange(num_cp - 1)[:, None] * ring +
+         np.arange(tube_sides)[None, :]).ravel()
+    c = a + ring
+    tri = np.column_stack([a, a + 1, c, a + 1, c + 1, c]).reshape(-1, 3)
+  else:
+    # Left and right verts per control point
+    ring = 2
+    face_normal = _normalize(np.cross(right, tangent), forward)
+    offsets = radius[:, None] * right
+    verts = np.stack([positions - offsets, positions + offsets], axis=1)
+    normals = np.repeat(face_normal[:, None, :], 2, axis=1)
+    uv = np.empty((num_cp, 2, 2))
+    uv[:, :, 0] = u[:, None]
+    uv[:, :, 1] = [0, 1]
+    a = 2 * np.arange(num_cp - 1)
+    tri = np.column_stack([a, a + 1, a + 2, a + 1, a + 3, a + 2]).reshape(-1, 3)
+
+  num_verts = num_cp * ring
+  mesh = TiltBrushMesh()
+  mesh.v = verts.reshape(num_verts, 3).astype(np.float32)
+  mesh.n = normals.reshape(num_verts, 3).astype(np.float32)
+  mesh.uv0 = uv.reshape(num_verts, 2).astype(np.float32)
+  mesh.c = np.empty(num_verts, dtype=np.uint32)
+  mesh.c[:] = _pack_color(color)
+  mesh.t = np.ones((num_verts, 4), dtype=np.float32)
+  mesh.t[:, :3] = np.repeat(tangent, ring, axis=0)
+  mesh.tri = tri.astype(np.uint32)
+  return mesh
+
+
+def _stroke_rows(stroke):
+  """Returns an (N, 8) array of position, orientation and pressure for
+  each of the stroke's control points. Pressure is NaN if missing.
+  Unparsed control point data is converted directly, without creating
+  ControlPoint instances."""
+  pressure_idx = stroke.cp_ext_lookup.get('pressure')
+  raw = stroke.__dict__.get('_controlpoints')
+  if raw is not None and 'controlpoints' not in stroke.__dict__:
+    (_, num_cp, data) = raw
+    if num_cp == 0:
+      return np.empty((0, 8))
+    # 7 floats, then one 4-byte word per extension
+    words = np.frombuffer(data, dtype='<f4').reshape(num_cp, -1)
+    rows = np.empty((num_cp, 8))
+    rows[:, :7] = words[:, :7]
+    rows[:, 7] = words[:, 7 + pressure_idx] if pressure_idx is not None \
+                 else np.nan
+    return rows
+  return np.array([
+    list(cp.position) + list(cp.orientation) +
+    [cp.extension[pressure_idx] if pressure_idx is not None else np.nan]
+    for cp in stroke.controlpoints ], dtype=np.float64).reshape(-1, 8)
+
+
+def _stroke_job(args):
+  """Top-level so that it can be run in a process pool."""
+  (rows, size, color, guid, tube_sides) = args
+  pressure = None if np.isnan(rows[:, 7]).any() else rows[:, 7]
+  mesh = stroke_to_mesh(rows[:, :3], rows[:, 3:7], size, pressure, color,
+                        tube=(guid in TUBE_BRUSH), tube_sides=tube_sides)
+  if mesh is not None:
+    mesh.brush_guid = guid
+  return mesh
+
+
+def iter_meshes(tilt, jobs=1, tube_sides=TUBE_SIDES):
+  """Yields an array-backed TiltBrushMesh for each stroke of a tilt.Tilt
+  that has geometry, in stroke order. brush_guid is set from the tilt's
+  BrushIndex; brush_name is None.
+  If jobs > 1, geometry is generated in that many processes."""
+  brush_index = [UUID(guid) for guid in tilt.metadata['BrushIndex']]
+
+  def iter_args():
+    for stroke in tilt.sketch.strokes:
+      scale = stroke.scale if stroke.has_stroke_extension('scale') else 1.0
+      yield (_stroke_rows(stroke), stroke.brush_size * scale,
+             tuple(stroke.brush_color), brush_index[stroke.brush_idx],
+             tube_sides)
+
+  if jobs > 1:
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    try:
+      for mesh in pool.imap(_stroke_job, iter_args(), STROKES_PER_JOB):
+        if mesh is not None:
+          yield mesh
+      pool.close()
+    finally:
+      # Stops any queued strokes if the caller stopped early
+      pool.terminate()
+      pool.join()
+  else:
+    for args in iter_args():
+      mesh = _stroke_job(args)
+      if mesh is not None:
+        yield mesh
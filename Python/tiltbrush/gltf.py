@@ -0,0 +1,402 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reads and writes TiltBrushMesh instances as binary glTF 2.0 (.glb).
+Requires numpy.
+See:
+  read_glb()
+  write_glb()
+  GlbFile"""
+
+import copy
+import json
+import mmap
+import os
+import re
+import struct
+from uuid import UUID
+
+import numpy as np
+
+from tiltbrush.export import TiltBrushMesh
+
+__all__ = ('GlbError', 'GlbFile', 'read_glb', 'write_glb')
+
+GLB_MAGIC = 'glTF'
+GLB_VERSION = 2
+GLB_HEADER_FMT = '<4sII'
+GLB_CHUNK_FMT = '<II'
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+# Accessor componentType values
+BYTE = 5120
+UNSIGNED_BYTE = 5121
+SHORT = 5122
+UNSIGNED_SHORT = 5123
+UNSIGNED_INT = 5125
+FLOAT = 5126
+# componentType -> numpy dtype
+COMPONENT_DTYPES = {
+  BYTE: 'i1', UNSIGNED_BYTE: 'u1', SHORT: '<i2', UNSIGNED_SHORT: '<u2',
+  UNSIGNED_INT: '<u4', FLOAT: '<f4',
+}
+# (dtype kind, itemsize) -> componentType
+COMPONENT_TYPES = {
+  ('u', 1): UNSIGNED_BYTE,
+  ('u', 4): UNSIGNED_INT,
+  ('f', 4): FLOAT,
+}
+ACCESSOR_TYPES = { 1: 'SCALAR', 2: 'VEC2', 3: 'VEC3', 4: 'VEC4' }
+NUM_COMPONENTS = dict((v, k) for (k, v) in ACCESSOR_TYPES.items())
+
+# bufferView target values
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+# Prefix used by the Unity SDK for attributes that don't fit gltf's
+# semantics, eg 3- or 4-component texcoords.
+TOOLKIT_ATTRIBUTE_PREFIX = '_TB_UNITY_'
+
+GENERATOR = 'Tilt Brush Toolkit'
+
+# Tilt Brush names its gltf materials like
+#   material_Light-2241cd32-8ba2-48a5-9ee7-2caef7e9ed62
+MATERIAL_NAME_RE = re.compile(
+  r'^(?:material_)?(.*?)-?([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-'
+  r'[0-9a-f]{4}-[0-9a-f]{12})$', re.I)
+
+# Primitive attribute -> TiltBrushMesh attribute
+MESH_ATTRIBUTES = [
+  ('POSITION', 'v'),
+  ('NORMAL', 'n'),
+  ('TANGENT', 't'),
+  ('TEXCOORD_0', 'uv0'),
+  ('TEXCOORD_1', 'uv1'),
+  ('COLOR_0', 'c'),
+]
+
+
+class GlbError(ValueError):
+  pass
+
+
+def _material_name(mesh):
+  """Tilt Brush names its gltf materials like
+  material_Light-2241cd32-8ba2-48a5-9ee7-2caef7e9ed62"""
+  return 'material_%s-%s' % (mesh.brush_name or 'TiltBrush', mesh.brush_guid)
+
+
+def _iter_brush_meshes(meshes):
+  """Yields one array-backed mesh per brush, in order of first appearance."""
+  by_guid = {}
+  order = []
+  for mesh in meshes:
+    if mesh.brush_guid not in by_guid:
+      by_guid[mesh.brush_guid] = []
+      order.append(mesh.brush_guid)
+    if not mesh.uses_arrays:
+      mesh = copy.copy(mesh).to_arrays()
+    by_guid[mesh.brush_guid].append(mesh)
+  for guid in order:
+    group = by_guid.pop(guid)
+    yield group[0] if len(group) == 1 else TiltBrushMesh.from_meshes(group)
+
+
+def _primitive_arrays(mesh):
+  """Returns a list of (attribute name, array) for the vertex data."""
+  attributes = [('POSITION', mesh.v)]
+  if mesh.n is not None:
+    attributes.append(('NORMAL', mesh.n))
+  if mesh.t is not None:
+    attributes.append(('TANGENT', mesh.t))
+  for (i, uv) in enumerate((mesh.uv0, mesh.uv1)):
+    if uv is None:
+      continue
+    name = 'TEXCOORD_%d' % i
+    attributes.append((name, uv[:, :2]))
+    if uv.shape[1] > 2:
+      # Keep the extra data where the Unity SDK knows to look for it
+      attributes.append((TOOLKIT_ATTRIBUTE_PREFIX + name, uv))
+  if mesh.c is not None:
+    # abgr little-endian uint32 is rgba in memory
+    attributes.append(('COLOR_0', mesh.c.view(np.uint8).reshape(-1, 4)))
+  return attributes
+
+
+class _BufferBuilder(object):
+  """Lays out arrays in a single binary buffer, with one 4-byte aligned
+  bufferView and one accessor per array."""
+  def __init__(self):
+    self.arrays = []
+    self.buffer_views = []
+    self.accessors = []
+    self.nbytes = 0
+
+  def add(self, arr, target, normalized=False):
+    arr = np.ascontiguousarray(arr)
+    arr = arr.astype(arr.dtype.newbyteorder('<'), copy=False)
+    self.nbytes += (-self.nbytes) % 4
+    self.buffer_views.append({
+      'buffer': 0,
+      'byteOffset': self.nbytes,
+      'byteLength': arr.nbytes,
+      'target': target,
+    })
+    self.arrays.append((self.nbytes, arr))
+    self.nbytes += arr.nbytes
+
+    num_components = 1 if arr.ndim == 1 else arr.shape[1]
+    accessor = {
+      'bufferView': len(self.buffer_views) - 1,
+      'componentType': COMPONENT_TYPES[arr.dtype.kind, arr.dtype.itemsize],
+      'count': len(arr),
+      'type': ACCESSOR_TYPES[num_components],
+    }
+    if normalized:
+      accessor['normalized'] = True
+    if len(arr):
+      flat = arr.reshape(len(arr), num_components)
+      accessor['min'] = flat.min(axis=0).tolist()
+      accessor['max'] = flat.max(axis=0).tolist()
+    self.accessors.append(accessor)
+    return len(self.accessors) - 1
+
+  def write(self, outf):
+    """Writes the buffer contents, without copying the arrays."""
+    pos = 0
+    for (offset, arr) in self.arrays:
+      outf.write('\0' * (offset - pos))
+      outf.write(arr.data)
+      pos = offset + arr.nbytes
+    outf.write('\0' * ((-pos) % 4))
+
+
+def write_glb(meshes, outf_name):
+  """Emits TiltBrushMesh instances as a single-mesh .glb file, with one
+  primitive per brush. Each primitive's material is named the way Tilt
+  Brush names its gltf materials, and carries the brush name and guid
+  in its extras. All vertex data is packed into one binary buffer."""
+  builder = _BufferBuilder()
+  materials = []
+  primitives = []
+  for mesh in _iter_brush_meshes(meshes):
+    if len(mesh.v) == 0 or len(mesh.tri) == 0:
+      continue
+    attributes = {}
+    for (name, arr) in _primitive_arrays(mesh):
+      attributes[name] = builder.add(arr, ARRAY_BUFFER,
+                                     normalized=(name == 'COLOR_0'))
+    indices = builder.add(mesh.tri.ravel(), ELEMENT_ARRAY_BUFFER)
+    materials.append({
+      'name': _material_name(mesh),
+      'extras': { 'brush_name': mesh.brush_name,
+                  'brush_guid': str(mesh.brush_guid) },
+    })
+    primitives.append({
+      'attributes': attributes,
+      'indices': indices,
+      'material': len(materials) - 1,
+      'mode': 4,  # TRIANGLES
+    })
+
+  root = {
+    'asset': { 'version': '2.0', 'generator': GENERATOR },
+    'scene': 0,
+    'scenes': [ { 'nodes': [0] } ],
+    'nodes': [ { 'name': 'Tilt Brush', 'mesh': 0 } ],
+    'meshes': [ { 'name': 'Tilt Brush', 'primitives': primitives } ],
+    'materials': materials,
+    'accessors': builder.accessors,
+    'bufferViews': builder.buffer_views,
+    'buffers': [ { 'byteLength': builder.nbytes } ],
+  }
+  if not primitives:
+    del root['meshes'], root['nodes'][0]['mesh']
+  if builder.nbytes == 0:
+    del root['buffers'], root['bufferViews'], root['accessors']
+
+  json_bytes = json.dumps(root, separators=(',', ':'), sort_keys=True)
+  json_bytes += ' ' * ((-len(json_bytes)) % 4)
+  bin_length = builder.nbytes + (-builder.nbytes) % 4
+  total = struct.calcsize(GLB_HEADER_FMT) + \
+          struct.calcsize(GLB_CHUNK_FMT) + len(json_bytes)
+  if bin_length:
+    total += struct.calcsize(GLB_CHUNK_FMT) + bin_length
+
+  with file(outf_name, 'wb') as outf:
+    outf.write(struct.pack(GLB_HEADER_FMT, GLB_MAGIC, GLB_VERSION, total))
+    outf.write(struct.pack(GLB_CHUNK_FMT, len(json_bytes), CHUNK_JSON))
+    outf.write(json_bytes)
+    if bin_length:
+      outf.write(struct.pack(GLB_CHUNK_FMT, bin_length, CHUNK_BIN))
+      builder.write(outf)
+
+
+# ----------------------------------------------------------------------
+# Reading
+# ----------------------------------------------------------------------
+
+class GlbFile(object):
+  """A parsed .glb (glTF 2.0) file.
+  The file is memory-mapped copy-on-write, and accessor() returns numpy
+  views of the mapping: data isn't copied, or even read, until it's
+  used, and writing to a view doesn't modify the file.
+  Public attributes:
+    .gltf   the parsed JSON chunk"""
+  def __init__(self, filename):
+    header_size = struct.calcsize(GLB_HEADER_FMT)
+    chunk_size = struct.calcsize(GLB_CHUNK_FMT)
+    if os.path.getsize(filename) < header_size + chunk_size:
+      raise GlbError("%s is too short to be a .glb file" % filename)
+    with file(filename, 'rb') as inf:
+      # The mapping outlives the file handle
+      self._map = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    (magic, version, length) = struct.unpack_from(GLB_HEADER_FMT, self._map, 0)
+    if magic != GLB_MAGIC:
+      raise GlbError("%s is not a .glb file" % filename)
+    if version != GLB_VERSION:
+      raise GlbError("Unsupported glb version %d" % version)
+    if length > len(self._map):
+      raise GlbError("glb length")
+
+    (json_length, json_type) = struct.unpack_from(
+      GLB_CHUNK_FMT, self._map, header_size)
+    json_start = header_size + chunk_size
+    if json_type != CHUNK_JSON or json_start + json_length > length:
+      raise GlbError("no 'JSON' chunk")
+    self.gltf = json.loads(self._map[json_start : json_start + json_length])
+
+    # The BIN chunk is optional
+    self._bin_start = self._bin_length = 0
+    bin_header = json_start + json_length
+    if bin_header + chunk_size <= length:
+      (bin_length, bin_type) = struct.unpack_from(
+        GLB_CHUNK_FMT, self._map, bin_header)
+      if bin_type != CHUNK_BIN:
+        raise GlbError("no 'BIN' chunk")
+      self._bin_start = bin_header + chunk_size
+      self._bin_length = bin_length
+      if self._bin_start + bin_length > length:
+        raise GlbError("bin length overflow")
+
+  def _buffer_range(self, index):
+    buf = self.gltf['buffers'][index]
+    if index != 0 or 'uri' in buf:
+      raise GlbError("Only the .glb BIN chunk is supported as a buffer")
+    return (self._bin_start, self._bin_length)
+
+  def accessor(self, index):
+    """Returns accessor *index* as a numpy view, with shape (count,) for
+    scalars and (count, k) for vectors. Strided and unaligned data are
+    also returned as views. Normalized integers are not converted."""
+    acc = self.gltf['accessors'][index]
+    if 'sparse' in acc:
+      raise GlbError("Sparse accessors are not supported")
+    dtype = np.dtype(COMPONENT_DTYPES[acc['componentType']])
+    width = NUM_COMPONENTS[acc['type']]
+    count = acc['count']
+    shape = (count,) if width == 1 else (count, width)
+    if 'bufferView' not in acc:
+      return np.zeros(shape, dtype=dtype)
+
+    view = self.gltf['bufferViews'][acc['bufferView']]
+    (buf_start, buf_length) = self._buffer_range(view['buffer'])
+    view_start = view.get('byteOffset', 0)
+    view_end = view_start + view['byteLength']
+    item_size = dtype.itemsize * width
+    stride = view.get('byteStride') or item_size
+    start = view_start + acc.get('byteOffset', 0)
+    end = start + (stride * (count - 1) + item_size if count else 0)
+    if end > view_end or view_end > buf_length:
+      raise GlbError("Accessor %d overflows its buffer" % index)
+    strides = (stride,) if width == 1 else (stride, dtype.itemsize)
+    return np.ndarray(shape, dtype=dtype, buffer=self._map,
+                      offset=buf_start + start, strides=strides)
+
+
+def _brush_from_material(material):
+  """Returns (brush_name, brush_guid) for a gltf material dict.
+  Either may be None."""
+  name = material.get('name')
+  guid = material.get('extensions', {}).get(
+    'GOOGLE_tilt_brush_material', {}).get('guid')
+  brush_name = material.get('extras', {}).get('brush_name')
+  match = MATERIAL_NAME_RE.match(name or '')
+  if match is not None:
+    brush_name = brush_name or match.group(1) or None
+    guid = guid or match.group(2)
+  return (brush_name or name, UUID(guid) if guid else None)
+
+
+def _as_colors(arr, normalized):
+  """Converts COLOR_0 data to abgr little-endian uint32, without copying
+  if it's already stored that way."""
+  if arr.dtype == np.uint8 and arr.shape[1] == 4 and \
+     arr.strides == (4, 1) and normalized:
+    return arr.view('<u4').reshape(-1)
+  if arr.dtype.kind == 'f':
+    arr = np.round(np.clip(arr, 0, 1) * 255)
+  elif arr.dtype == np.uint16:
+    arr = np.round(arr / 257.0)
+  rgba = np.empty((len(arr), 4), dtype=np.uint8)
+  rgba[:, 3] = 255
+  rgba[:, :arr.shape[1]] = arr
+  return rgba.view('<u4').reshape(-1)
+
+
+def read_glb(filename):
+  """Returns a list of array-backed TiltBrushMesh, one per triangle
+  primitive, in file order. Vertex attributes are zero-copy views of the
+  file where the stored layout allows it (see GlbFile). Meshes are named
+  after their gltf mesh; the brush name and guid come from the
+  primitive's material, as Tilt Brush names them (see write_glb).
+  Node transforms are not applied."""
+  glb = GlbFile(filename)
+  gltf = glb.gltf
+  materials = gltf.get('materials', [])
+  meshes = []
+  for gltf_mesh in gltf.get('meshes', []):
+    for prim in gltf_mesh['primitives']:
+      if prim.get('mode', 4) != 4:  # TRIANGLES
+        continue
+      attributes = prim['attributes']
+      mesh = TiltBrushMesh()
+      mesh.name = gltf_mesh.get('name')
+      if 'material' in prim:
+        (mesh.brush_name, mesh.brush_guid) = _brush_from_material(
+          materials[prim['material']])
+      for (name, attr) in MESH_ATTRIBUTES:
+        # Prefer the full-width data the Unity SDK stashes separately
+        index = attributes.get(TOOLKIT_ATTRIBUTE_PREFIX + name,
+                               attributes.get(name))
+        if index is None:
+          continue
+        arr = glb.accessor(index)
+        if attr == 'c':
+          normalized = gltf['accessors'][index].get('normalized', False)
+          arr = _as_colors(arr, normalized)
+        elif arr.dtype != np.float32:
+          arr = arr.astype(np.float32)
+        setattr(mesh, attr, arr)
+      if 'indices' in prim:
+        tri = glb.accessor(prim['indices'])
+        if tri.dtype != np.uint32:
+          tri = tri.astype(np.uint32)
+      else:
+        tri = np.arange(len(mesh.v), dtype=np.uint32)
+      mesh.tri = tri.reshape(-1, 3)
+      meshes.append(mesh)
+  return meshes
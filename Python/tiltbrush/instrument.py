@@ -0,0 +1,215 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in timers and counters for the hot paths of tilt, unpack and export.
+Nothing is recorded unless either:
+
+- The TILTBRUSH_INSTRUMENT environment variable is set. Everything done
+  by the process is recorded, and reported to stderr at exit: as JSON if
+  the variable is 'json', written to a file if it ends with '.json',
+  and as a log line otherwise.
+
+- Code runs inside a recording() block:
+    with instrument.recording() as rec:
+      tilt = Tilt(filename)
+      tilt.sketch
+    print rec.log_line()
+
+Each phase records the number of calls, wall time, and bytes and objects
+processed. Phases may nest (eg, control points are decoded during
+sketch_encode), in which case both include the inner time.
+
+The phases are:
+  zip_open          Opening a .tilt zip
+  member_read       Reading and decompressing a zip member; bytes read
+  metadata_parse    json parse of metadata.json
+  metadata_validate validate_metadata()
+  stroke_headers    Parsing data.sketch stroke headers; objects are strokes
+  cp_decode         Creating ControlPoints from raw data; objects are points
+  sketch_encode     Encoding data.sketch; bytes written
+  zip_extract       Unpacking a .tilt into a directory; bytes extracted
+  zip_write         Packing a directory into a .tilt; bytes written
+  json_export_parse Reading a .json export's stroke json; objects are strokes
+  mesh_decode       Decoding TiltBrushMesh data from stroke json; bytes of
+                    base64
+Memory held by objects can be estimated with deep_sizeof().
+See:
+  recording()
+  Recorder
+  deep_sizeof()"""
+
+import atexit
+import contextlib
+import json
+import os
+import sys
+import timeit
+import types
+
+__all__ = ('Recorder', 'recording', 'phase', 'deep_sizeof')
+
+ENVIRONMENT_VARIABLE = 'TILTBRUSH_INSTRUMENT'
+
+_timer = timeit.default_timer
+
+# Active recorders. When empty, phase() is nearly free.
+_recorders = []
+
+
+class Recorder(object):
+  """Accumulates per-phase totals."""
+  def __init__(self):
+    self.phases = {}
+
+  def add(self, name, seconds, nbytes, objects):
+    try:
+      totals = self.phases[name]
+    except KeyError:
+      totals = self.phases[name] = [0, 0.0, 0, 0]
+    totals[0] += 1
+    totals[1] += seconds
+    totals[2] += nbytes
+    totals[3] += objects
+
+  def report(self):
+    """Returns { phase: { 'calls', 'seconds', 'bytes', 'objects' } }."""
+    return dict((name, { 'calls': calls, 'seconds': seconds,
+                         'bytes': nbytes, 'objects': objects })
+                for (name, (calls, seconds, nbytes, objects))
+                in self.phases.items())
+
+  def to_json(self):
+    return json.dumps(self.report(), indent=2, sort_keys=True)
+
+  def log_line(self):
+    """Returns the report as a single line, slowest phase first."""
+    items = sorted(self.phases.items(), key=lambda item: -item[1][1])
+    parts = []
+    for (name, (calls, seconds, nbytes, objects)) in items:
+      part = '%s %dx %.1fms' % (name, calls, seconds * 1000)
+      if nbytes:
+        part += ' %dB' % nbytes
+      if objects:
+        part += ' %d obj' % objects
+      parts.append(part)
+    return 'tiltbrush: ' + '; '.join(parts)
+
+
+class _Phase(object):
+  __slots__ = ('name', 'nbytes', 'objects', 'start')
+
+  def __init__(self, name, nbytes, objects):
+    self.name = name
+    self.nbytes = nbytes
+    self.objects = objects
+
+  def __enter__(self):
+    self.start = _timer()
+    return self
+
+  def __exit__(self, *args):
+    elapsed = _timer() - self.start
+    for recorder in _recorders:
+      recorder.add(self.name, elapsed, self.nbytes, self.objects)
+
+
+class _NullPhase(object):
+  """Returned by phase() when nothing is recording. Setting nbytes and
+  objects on it is harmless."""
+  nbytes = objects = 0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    pass
+
+_NULL_PHASE = _NullPhase()
+
+
+def phase(name, nbytes=0, objects=0):
+  """Returns a context manager that times one call of the phase *name*.
+  Counts can be passed in, or set on the returned object before the
+  block exits."""
+  if not _recorders:
+    return _NULL_PHASE
+  return _Phase(name, nbytes, objects)
+
+
+@contextlib.contextmanager
+def recording():
+  """Records phases for the duration of the block; yields a Recorder."""
+  recorder = Recorder()
+  _recorders.append(recorder)
+  try:
+    yield recorder
+  finally:
+    _recorders.remove(recorder)
+
+
+# Code, not data; never counted by deep_sizeof()
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType)
+
+
+def deep_sizeof(obj, seen=None):
+  """Returns an estimate of the bytes held by obj and everything it
+  refers to: containers, instance attributes, and numpy array data
+  (including the buffer an array is a view of). Objects whose ids are
+  in the set *seen* are skipped, and counted objects are added to it,
+  so passing the same set to several calls counts shared objects once.
+  Classes, modules and functions are not counted."""
+  if seen is None:
+    seen = set()
+  if id(obj) in seen or isinstance(obj, _SHARED_TYPES):
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if isinstance(obj, (str, unicode, int, long, float, bool)) or obj is None:
+    return size
+  if isinstance(obj, dict):
+    for (k, v) in obj.iteritems():
+      size += deep_sizeof(k, seen) + deep_sizeof(v, seen)
+  elif isinstance(obj, (list, tuple, set, frozenset)):
+    for item in obj:
+      size += deep_sizeof(item, seen)
+  elif hasattr(obj, '__array_interface__'):
+    # ndarray.__sizeof__ includes data only if the array owns it
+    size += deep_sizeof(obj.base, seen)
+  else:
+    if hasattr(obj, '__dict__'):
+      size += deep_sizeof(obj.__dict__, seen)
+    for name in getattr(type(obj), '__slots__', ()):
+      size += deep_sizeof(getattr(obj, name, None), seen)
+  return size
+
+
+def _report_at_exit(recorder, destination):
+  if destination == 'json':
+    print >>sys.stderr, recorder.to_json()
+  elif destination.endswith('.json'):
+    with file(destination, 'wb') as outf:
+      outf.write(recorder.to_json())
+  else:
+    print >>sys.stderr, recorder.log_line()
+
+
+def _init_from_environment():
+  destination = os.environ.get(ENVIRONMENT_VARIABLE, '')
+  if destination not in ('', '0'):
+    recorder = Recorder()
+    _recorders.append(recorder)
+    atexit.register(_report_at_exit, recorder, destination)
+
+_init_from_environment()
@@ -0,0 +1,245 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Loads sketches on a bounded pool of threads, so that a server or UI
+thread isn't blocked while zip members are read and strokes parsed.
+
+  result = open_async('a.tilt')           # returns at once
+  tilt = result.result()                  # blocks until loaded
+
+  for stroke in iter_strokes('a.tilt'):   # strokes as they are parsed
+    ...
+
+  for result in load_many(paths, concurrency=8):  # in completion order
+    tilt = result.result()                # raises if that load failed
+
+LoadResults work like concurrent.futures.Future: an event loop can
+add_done_callback() a function that hands the result to the loop's
+thread-safe scheduling call. Callbacks run on a pool thread.
+
+File reads and zip inflation release the GIL; stroke parsing does not,
+so threads overlap I/O rather than parsing.
+See:
+  Loader
+  open_async()
+  iter_strokes()
+  load_many()"""
+
+import itertools
+import Queue
+import sys
+import threading
+import traceback
+from io import BytesIO
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+from tiltbrush.tilt import Stroke, Tilt, _read_sketch_header, binfile
+
+__all__ = ('LoadResult', 'Loader', 'open_async', 'iter_strokes', 'load_many',
+           'TimeoutError')
+
+DEFAULT_CONCURRENCY = 4
+# Strokes iter_strokes() parses ahead of the caller
+PREFETCH = 256
+# load_many() keeps at most this many loads per thread in flight
+WINDOW_PER_THREAD = 2
+
+
+def _load(path, decode):
+  tilt = Tilt(path)
+  strokes = tilt.sketch.strokes
+  if decode:
+    for stroke in strokes:
+      stroke.controlpoints
+  return tilt
+
+
+class LoadResult(object):
+  """The pending result of loading the .tilt at .path."""
+  def __init__(self, path):
+    self.path = path
+    self._lock = threading.Lock()
+    self._done = threading.Event()
+    self._callbacks = []
+    self._value = None
+    self._exc_info = None
+
+  def done(self):
+    return self._done.is_set()
+
+  def result(self, timeout=None):
+    """Returns the loaded Tilt, or raises what the load raised. Raises
+    TimeoutError if it isn't done within *timeout* seconds."""
+    if not self._done.wait(timeout):
+      raise TimeoutError(self.path)
+    if self._exc_info is not None:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._value
+
+  def exception(self, timeout=None):
+    """Returns what the load raised, or None."""
+    if not self._done.wait(timeout):
+      raise TimeoutError(self.path)
+    return self._exc_info and self._exc_info[1]
+
+  def add_done_callback(self, fn):
+    """Calls fn(self) once done; at once, on this thread, if already done."""
+    with self._lock:
+      if not self._done.is_set():
+        self._callbacks.append(fn)
+        return
+    fn(self)
+
+  def _finish(self, value, exc_info):
+    with self._lock:
+      (self._value, self._exc_info) = (value, exc_info)
+      self._done.set()
+      callbacks, self._callbacks = self._callbacks, []
+    for fn in callbacks:
+      try:
+        fn(self)
+      except Exception:
+        traceback.print_exc()
+
+
+class _Failure(object):
+  def __init__(self, exc_info):
+    self.exc_info = exc_info
+
+_END = object()
+
+
+class Loader(object):
+  """Loads sketches on *concurrency* threads. Call close() when done, or
+  use as a context manager."""
+  def __init__(self, concurrency=DEFAULT_CONCURRENCY):
+    if concurrency < 1:
+      raise ValueError("concurrency must be at least 1")
+    self.concurrency = concurrency
+    self._pool = ThreadPool(concurrency)
+
+  def open(self, path, decode=False, callback=None):
+    """Starts loading the .tilt at *path* and its stroke headers, and
+    returns a LoadResult. With decode, control points are decoded too.
+    callback, if given, is added with add_done_callback()."""
+    result = LoadResult(path)
+    if callback is not None:
+      result.add_done_callback(callback)
+    def run():
+      try:
+        value = _load(path, decode)
+      except Exception:
+        return result._finish(None, sys.exc_info())
+      result._finish(value, None)
+    self._pool.apply_async(run)
+    return result
+
+  def iter_strokes(self, path, prefetch=PREFETCH):
+    """Yields the strokes of the .tilt at *path* while a pool thread reads
+    and parses them, up to *prefetch* strokes ahead. Errors are raised
+    when reached. Abandoning the iterator stops the parse. Until then it
+    holds one of the threads."""
+    out = Queue.Queue(prefetch)
+    stop = threading.Event()
+    def put(item):
+      while not stop.is_set():
+        try:
+          out.put(item, True, 0.1)
+          return True
+        except Queue.Full:
+          pass
+      return False
+    def produce():
+      try:
+        with Tilt(path).subfile_reader('data.sketch') as inf:
+          b = binfile(BytesIO(inf.read()))
+        (_, _, num_strokes) = _read_sketch_header(b)
+        for i in xrange(num_strokes):
+          if not put(Stroke.from_file(b)):
+            return
+      except Exception:
+        put(_Failure(sys.exc_info()))
+      put(_END)
+    self._pool.apply_async(produce)
+    try:
+      while True:
+        item = out.get()
+        if item is _END:
+          return
+        if isinstance(item, _Failure):
+          raise item.exc_info[0], item.exc_info[1], item.exc_info[2]
+        yield item
+    finally:
+      stop.set()
+
+  def load_many(self, paths, decode=False):
+    """Loads the .tilts at *paths* (any iterable) and yields a finished
+    LoadResult for each, in the order they finish. A failed load doesn't
+    stop the others. Only a few loads per thread run ahead of the caller,
+    so loaded sketches don't pile up."""
+    paths = iter(paths)
+    finished = Queue.Queue()
+    pending = 0
+    for path in itertools.islice(paths, self.concurrency * WINDOW_PER_THREAD):
+      self.open(path, decode, finished.put)
+      pending += 1
+    while pending:
+      result = finished.get()
+      pending -= 1
+      for path in itertools.islice(paths, 1):
+        self.open(path, decode, finished.put)
+        pending += 1
+      yield result
+
+  def close(self):
+    """Waits for running loads to finish, then stops the threads."""
+    self._pool.close()
+    self._pool.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+_default_loader = None
+_default_lock = threading.Lock()
+
+
+def _get_default_loader():
+  global _default_loader
+  with _default_lock:
+    if _default_loader is None:
+      _default_loader = Loader()
+    return _default_loader
+
+
+def open_async(path, decode=False, callback=None):
+  """Loader.open() on a shared Loader of DEFAULT_CONCURRENCY threads."""
+  return _get_default_loader().open(path, decode, callback)
+
+
+def iter_strokes(path, prefetch=PREFETCH):
+  """Loader.iter_strokes() on the shared Loader."""
+  return _get_default_loader().iter_strokes(path, prefetch)
+
+
+def load_many(paths, concurrency=DEFAULT_CONCURRENCY, decode=False):
+  """Loader.load_many() on a Loader of *concurrency* threads, closed when
+  the iteration ends."""
+  with Loader(concurrency) as loader:
+    for result in loader.load_many(paths, decode):
+      yield result
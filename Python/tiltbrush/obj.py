@@ -0,0 +1,158 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Writes TiltBrushMesh instances as Wavefront .obj files. Requires numpy.
+See:
+  write_obj()"""
+
+import copy
+import os
+
+import numpy as np
+
+__all__ = ('write_obj',)
+
+# Rows of attribute data formatted per chunk
+CHUNK_ROWS = 1 << 16
+
+
+def _format_rows((line_fmt, rows)):
+  """Formats every row of the 2-D array *rows* with *line_fmt*.
+  Top-level so that it can be run in a process pool."""
+  return (line_fmt * len(rows)) % tuple(rows.ravel().tolist())
+
+
+def _material_name(mesh):
+  return (mesh.brush_name or 'TiltBrush').replace(' ', '_').encode('utf-8')
+
+
+def _iter_mesh_chunks(mesh, use_color, offsets, group):
+  """Yields (line_fmt, rows) pairs and literal strings for one mesh.
+  *offsets* is the list of [v, vt, vn] counts written so far; it is
+  updated in place."""
+  if not mesh.uses_arrays:
+    mesh = copy.copy(mesh).to_arrays()
+  num_verts = len(mesh.v)
+  if group:
+    name = mesh.name.replace(' ', '_').encode('utf-8') if mesh.name \
+           else _material_name(mesh)
+    yield 'g %s\nusemtl %s\n' % (name, _material_name(mesh))
+
+  if use_color and mesh.c is not None:
+    c32 = mesh.c
+    rgb = np.column_stack([(c32 >> shift) & 0xff for shift in (0, 8, 16)]) / 255.0
+    rows = np.column_stack([mesh.v, rgb, rgb])
+    line_fmt = "v %f %f %f %f %f %f\nvc %f %f %f\n"
+  else:
+    rows = mesh.v
+    line_fmt = "v %f %f %f\n"
+  for i in xrange(0, num_verts, CHUNK_ROWS):
+    yield (line_fmt, rows[i : i + CHUNK_ROWS])
+
+  has_uv = mesh.uv0 is not None
+  if has_uv:
+    for i in xrange(0, num_verts, CHUNK_ROWS):
+      yield ("vt %f %f\n", mesh.uv0[i : i + CHUNK_ROWS, :2])
+
+  has_n = mesh.n is not None
+  if has_n:
+    for i in xrange(0, num_verts, CHUNK_ROWS):
+      yield ("vn %f %f %f\n", mesh.n[i : i + CHUNK_ROWS])
+
+  # Columns of per-corner indices, eg v/vt/vn for each of the 3 corners
+  attr_offsets = [offsets[0]]
+  if has_n and has_uv:
+    line_fmt = "f %d/%d/%d %d/%d/%d %d/%d/%d\n"
+    attr_offsets += [offsets[1], offsets[2]]
+  elif has_n:
+    line_fmt = "f %d//%d %d//%d %d//%d\n"
+    attr_offsets += [offsets[2]]
+  elif has_uv:
+    line_fmt = "f %d/%d %d/%d %d/%d\n"
+    attr_offsets += [offsets[1]]
+  else:
+    line_fmt = "f %d %d %d\n"
+  columns = np.repeat(np.arange(3), len(attr_offsets))
+  attr_offsets = np.tile(np.array(attr_offsets, dtype=np.int64) + 1, 3)
+  for i in xrange(0, len(mesh.tri), CHUNK_ROWS):
+    tri = mesh.tri[i : i + CHUNK_ROWS].astype(np.int64)
+    yield (line_fmt, tri[:, columns] + attr_offsets)
+
+  offsets[0] += num_verts
+  offsets[1] += num_verts if has_uv else 0
+  offsets[2] += num_verts if has_n else 0
+
+
+def _write_mtl(meshes, mtl_name):
+  with file(mtl_name, 'wb') as outf:
+    seen = set()
+    for mesh in meshes:
+      name = _material_name(mesh)
+      if name in seen:
+        continue
+      seen.add(name)
+      outf.write("newmtl %s\n" % name)
+      if mesh.brush_guid is not None:
+        outf.write("# brush_guid %s\n" % mesh.brush_guid)
+      outf.write("Kd 1.000000 1.000000 1.000000\n\n")
+
+
+def write_obj(meshes, outf_name, use_color=False, groups=False, jobs=1):
+  """Emits TiltBrushMesh instances as a .obj file.
+  If use_color, emit vertex color as a non-standard .obj extension.
+  If groups, emit each mesh as a 'g' group that uses a material named
+    after its brush, and write those materials to a .mtl file next to
+    the .obj.
+  Attribute data is formatted in chunks that are streamed to the file
+  as they are ready. If jobs > 1, chunks are formatted in that many
+  processes; output order is preserved."""
+  meshes = list(meshes)
+  pool = None
+  if jobs > 1:
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+  try:
+    with file(outf_name, 'wb') as outf:
+      if groups:
+        mtl_name = os.path.splitext(outf_name)[0] + '.mtl'
+        _write_mtl(meshes, mtl_name)
+        outf.write("mtllib %s\n" % os.path.basename(mtl_name))
+      offsets = [0, 0, 0]
+      for mesh in meshes:
+        pending = []
+        for item in _iter_mesh_chunks(mesh, use_color, offsets, groups):
+          if isinstance(item, str):
+            _write_chunks(outf, pending, pool)
+            pending = []
+            outf.write(item)
+          else:
+            pending.append(item)
+            # Bound the amount of formatted text in flight
+            if len(pending) >= 4 * max(jobs, 1):
+              _write_chunks(outf, pending, pool)
+              pending = []
+        _write_chunks(outf, pending, pool)
+  finally:
+    if pool is not None:
+      pool.close()
+      pool.join()
+
+
+def _write_chunks(outf, chunks, pool):
+  if pool is None:
+    for chunk in chunks:
+      outf.write(_format_rows(chunk))
+  else:
+    for text in pool.imap(_format_rows, chunks):
+      outf.write(text)
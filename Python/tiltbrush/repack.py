@@ -0,0 +1,206 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Recompresses packed .tilt files, choosing stored or deflate (and the
+deflate level) separately for each member. Policies:
+  hot       Store everything: fastest to read, and can be mmapped
+  balanced  Deflate a member only if that saves at least min_saving of
+            its size, at the lowest level within 1% of the best size
+  cold      Smallest size, whatever it costs to compress
+Members whose current encoding is already as good as the choice are
+copied raw, and files where nothing changes are not rewritten.
+
+Only stored and deflate are considered: that is all that Tilt Brush
+and Python 2's zipfile can read.
+
+Decode time is never measured. It is approximated by "stored vs
+deflate": stored members are read without inflating, and inflate runs
+at much the same speed whatever the level, so the level only trades
+compression time for size. min_saving is the price put on inflating.
+See:
+  repack_tilt()
+  repack_tilts()"""
+
+import multiprocessing
+import os
+import zipfile
+import zlib
+
+from tiltbrush import unpack
+
+__all__ = ('POLICIES', 'choose_encoding', 'repack_tilt', 'repack_tilts')
+
+POLICIES = ('hot', 'balanced', 'cold')
+DEFLATE_LEVELS = (1, 6, 9)
+# For the balanced policy
+MIN_SAVING = 0.1
+# Deflate levels whose output is this close to the best are equivalent
+LEVEL_TOLERANCE = 0.01
+
+STORED = zipfile.ZIP_STORED
+DEFLATED = zipfile.ZIP_DEFLATED
+
+
+def _deflate(data, level):
+  co = zlib.compressobj(level, zlib.DEFLATED, -15)
+  return co.compress(data) + co.flush()
+
+
+def choose_encoding(data, policy, min_saving=MIN_SAVING):
+  """Returns (compress_type, level, raw data) for a member holding *data*.
+  level is None when stored. Only sizes are compared; see the module
+  docstring for how decode speed is accounted for."""
+  if policy not in POLICIES:
+    raise ValueError("Unknown policy %r" % (policy,))
+  if policy == 'hot' or not data:
+    return (STORED, None, data)
+  candidates = [(level, _deflate(data, level)) for level in DEFLATE_LEVELS]
+  best = min(len(raw) for (_, raw) in candidates)
+  if policy == 'cold':
+    (level, raw) = min(candidates, key=lambda c: (len(c[1]), c[0]))
+    if len(raw) >= len(data):
+      return (STORED, None, data)
+    return (DEFLATED, level, raw)
+  # balanced
+  if best > len(data) * (1 - min_saving):
+    return (STORED, None, data)
+  for (level, raw) in candidates:
+    if len(raw) <= best * (1 + LEVEL_TOLERANCE):
+      return (DEFLATED, level, raw)
+
+
+def _describe(compress_type, level=None):
+  if compress_type == STORED:
+    return 'stored'
+  if compress_type == DEFLATED:
+    return 'deflate' if level is None else 'deflate-%d' % level
+  return 'type-%d' % compress_type
+
+
+def repack_tilt(filename, policy='balanced', out_name=None,
+                min_saving=MIN_SAVING, dry_run=False):
+  """Recompresses the packed .tilt *filename* according to *policy*.
+  The result replaces filename, unless out_name is given. With dry_run,
+  nothing is written. Returns a report:
+    { 'path', 'before', 'after', 'rewritten',
+      'members': [ { 'name', 'size', 'before', 'after', 'old', 'new',
+                     'copied' }, ... ] }
+  where before and after are compressed sizes in bytes (of the whole
+  file, or of the member's data) and old and new describe encodings.
+  Raises unpack.ConversionError if filename is not a packed .tilt."""
+  if os.path.isdir(filename):
+    raise unpack.ConversionError("%s is not packed" % filename)
+  with file(filename, 'rb') as inf:
+    header_bytes = unpack._read_and_check_header(inf)
+
+  members = []  # (zinfo, compress_type, raw data)
+  report_members = []
+  changed = False
+  with file(filename, 'rb') as inf:
+    try:
+      with zipfile.ZipFile(inf) as zf:
+        infos = zf.infolist()
+        for info in infos:
+          data = zf.read(info)
+          (compress_type, level, raw) = choose_encoding(data, policy, min_saving)
+          # Keep what's there if it is at least as good
+          copied = (info.compress_type == compress_type and
+                    (compress_type == STORED or info.compress_size <= len(raw)))
+          if copied:
+            raw = unpack._read_raw(inf, info)
+            new = _describe(info.compress_type)
+          else:
+            changed = True
+            new = _describe(compress_type, level)
+          members.append((info, info.compress_type if copied else compress_type, raw))
+          report_members.append({
+            'name': info.filename,
+            'size': info.file_size,
+            'before': info.compress_size,
+            'after': len(raw),
+            'old': _describe(info.compress_type),
+            'new': new,
+            'copied': copied,
+          })
+    except (zipfile.BadZipfile, zlib.error) as e:
+      raise unpack.ConversionError("%s: %s" % (filename, e))
+
+  before = os.path.getsize(filename)
+  report = {
+    'path': filename,
+    'before': before,
+    'after': before,
+    'rewritten': False,
+    'members': report_members,
+  }
+  if dry_run or not (changed or out_name):
+    if changed:
+      # Estimate; the zip's own overhead doesn't change
+      report['after'] = before + sum(m['after'] - m['before'] for m in report_members)
+    return report
+
+  in_place = out_name is None
+  if in_place:
+    out_name = filename + '.part'
+  if os.path.exists(out_name):
+    raise unpack.ConversionError("Remove %s first" % out_name)
+  try:
+    with file(out_name, 'wb') as outf:
+      outf.write(header_bytes)
+      with zipfile.ZipFile(outf, 'w', allowZip64=False) as zf:
+        for (info, compress_type, raw) in members:
+          zinfo = zipfile.ZipInfo(info.filename, info.date_time)
+          zinfo.external_attr = info.external_attr
+          zinfo.compress_type = compress_type
+          zinfo.file_size = info.file_size
+          zinfo.CRC = info.CRC
+          unpack._write_raw(zf, zinfo, raw)
+      report['after'] = outf.tell()
+    report['rewritten'] = True
+    if in_place:
+      tmp = filename + '._prev'
+      os.rename(filename, tmp)
+      os.rename(out_name, filename)
+      unpack._destroy(tmp)
+    out_name = None
+  finally:
+    if out_name is not None and os.path.exists(out_name):
+      os.unlink(out_name)
+  return report
+
+
+def _repack_job((filename, kwargs)):
+  try:
+    return repack_tilt(filename, **kwargs)
+  except unpack.ConversionError as e:
+    return { 'path': filename, 'error': str(e) }
+
+
+def repack_tilts(filenames, jobs=1, **kwargs):
+  """Yields repack_tilt() reports for *filenames*, in order, running
+  *jobs* files at once. A file that can't be repacked gets a report of
+  { 'path', 'error' } instead. kwargs are passed to repack_tilt()."""
+  args = [(filename, kwargs) for filename in filenames]
+  if jobs <= 1:
+    for arg in args:
+      yield _repack_job(arg)
+    return
+  pool = multiprocessing.Pool(jobs)
+  try:
+    for report in pool.imap(_repack_job, args):
+      yield report
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
@@ -0,0 +1,355 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local HTTP conversion service, built on the standard library.
+POST a .tilt or a geometry .json export to /<conversion>, eg:
+  curl --data-binary @sketch.tilt http://localhost:8000/tilt/json
+
+Conversions run in a pool of worker processes that is started once, so
+modules stay imported between requests. Up to *workers* conversions run
+at once, and up to *max_queue* more wait for a worker; beyond that,
+requests get 503. Every response has a Server-Timing header with the
+time spent queued, converting, and in total.
+
+GET / lists the conversions; GET /health reports the load.
+The obj, glb and geometry conversions require numpy.
+See:
+  CONVERSIONS
+  ConversionServer
+  serve()"""
+
+import BaseHTTPServer
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from tiltbrush.tilt import BadTilt, Tilt
+
+__all__ = ('CONVERSIONS', 'ConversionServer', 'serve')
+
+DEFAULT_PORT = 8000
+MAX_QUEUE = 16
+# Seconds a request may wait for, and spend in, a worker
+REQUEST_TIMEOUT = 300
+# A job still unfinished this many seconds after its request timed out
+# is assumed lost (eg, its worker was killed), and its slot is reused
+RECLAIM_GRACE = 60
+MAX_BODY_BYTES = 1 << 28
+# Preferred directory for the workers' scratch files
+SCRATCH_DIR = '/dev/shm'
+
+
+#
+# Conversions. These run in the worker processes.
+#
+
+def _scratch_name(suffix):
+  """Returns a path in this worker's scratch directory."""
+  return os.path.join(_worker_scratch, 'out' + suffix)
+
+
+def _tilt_stats(tilt):
+  brushes = {}
+  num_cp = 0
+  for stroke in tilt.sketch.strokes:
+    guid = tilt.metadata['BrushIndex'][stroke.brush_idx]
+    brushes[guid] = brushes.get(guid, 0) + 1
+    if 'controlpoints' in stroke.__dict__:
+      num_cp += len(stroke.controlpoints)
+    else:
+      num_cp += stroke.__dict__['_controlpoints'][1]
+  return json.dumps({
+    'strokes': len(tilt.sketch.strokes),
+    'controlpoints': num_cp,
+    'brushes': brushes,
+    'metadata_keys': sorted(tilt.metadata),
+  }, indent=2, sort_keys=True)
+
+
+def _tilt_json(tilt):
+  strokes = []
+  for stroke in tilt.sketch.strokes:
+    strokes.append({
+      'brush_index': stroke.brush_idx,
+      'brush_color': list(stroke.brush_color),
+      'brush_size': stroke.brush_size,
+      'stroke_mask': stroke.stroke_mask,
+      'cp_mask': stroke.cp_mask,
+      'stroke_extension': dict((name, stroke.extension[idx])
+                               for (name, idx) in stroke.stroke_ext_lookup.items()
+                               if isinstance(stroke.extension[idx], (int, long, float))),
+      'control_points': [
+        { 'position': cp.position, 'rotation': cp.orientation,
+          'extension': dict((name, cp.extension[idx])
+                            for (name, idx) in stroke.cp_ext_lookup.items()) }
+        for cp in stroke.controlpoints ],
+    })
+  (cookie, version, unused) = tilt.sketch.header[0:3]
+  return json.dumps({
+    'metadata': tilt.metadata,
+    'cookie': cookie,
+    'version': version,
+    'strokes': strokes,
+  }, sort_keys=True)
+
+
+def _tilt_normalized(tilt):
+  from tiltbrush.normalize import normalize_tilt_file
+  normalize_tilt_file(tilt)
+  tilt.write_sketch()
+  return tilt.to_bytes()
+
+
+def _write_meshes(meshes, suffix):
+  if suffix == '.obj':
+    from tiltbrush.obj import write_obj
+    write_obj(meshes, _scratch_name(suffix))
+  else:
+    from tiltbrush.gltf import write_glb
+    write_glb(meshes, _scratch_name(suffix))
+  with file(_scratch_name(suffix), 'rb') as inf:
+    return inf.read()
+
+
+def _tilt_meshes(tilt, suffix):
+  from tiltbrush import geometry
+  return _write_meshes(list(geometry.iter_meshes(tilt)), suffix)
+
+
+def _export_meshes(body, suffix):
+  from tiltbrush.export import iter_meshes
+  export_name = _scratch_name('.json')
+  with file(export_name, 'wb') as outf:
+    outf.write(body)
+  return _write_meshes(list(iter_meshes(export_name, arrays=True)), suffix)
+
+
+# { name: (content type, input, function) }. Input is 'tilt', in which
+# case the function is passed a tilt.Tilt, or 'json', when it is passed
+# the body. Functions return the response body.
+CONVERSIONS = {
+  'tilt/stats': ('application/json', 'tilt', _tilt_stats),
+  'tilt/json': ('application/json', 'tilt', _tilt_json),
+  'tilt/normalized': ('application/octet-stream', 'tilt', _tilt_normalized),
+  'tilt/obj': ('text/plain', 'tilt', lambda tilt: _tilt_meshes(tilt, '.obj')),
+  'tilt/glb': ('model/gltf-binary', 'tilt', lambda tilt: _tilt_meshes(tilt, '.glb')),
+  'json/obj': ('text/plain', 'json', lambda body: _export_meshes(body, '.obj')),
+  'json/glb': ('model/gltf-binary', 'json', lambda body: _export_meshes(body, '.glb')),
+}
+
+_worker_scratch = None
+
+
+def _init_worker(scratch_root):
+  """Warms up a worker process: imports the conversion modules, and
+  makes a scratch directory in *scratch_root*. Workers exit without
+  cleaning up, so the server removes scratch_root."""
+  global _worker_scratch
+  import tiltbrush.export, tiltbrush.normalize
+  try:
+    import tiltbrush.geometry, tiltbrush.gltf, tiltbrush.obj
+  except ImportError:
+    pass  # No numpy; those conversions will fail individually
+  _worker_scratch = tempfile.mkdtemp(dir=scratch_root)
+
+
+def _convert((name, body, submitted)):
+  """Runs one conversion. Returns (status, body, queued secs, convert secs);
+  status is 200, or 400 if the body could not be converted."""
+  start = time.time()
+  (_, kind, func) = CONVERSIONS[name]
+  try:
+    if kind == 'tilt':
+      result = func(Tilt.from_bytes(body))
+    else:
+      result = func(body)
+    status = 200
+  except (BadTilt, ValueError, KeyError, IndexError,
+          EOFError, IOError) as e:
+    (status, result) = (400, '%s: %s\n' % (type(e).__name__, e))
+  except Exception as e:
+    # Not the request's fault, probably
+    (status, result) = (500, traceback.format_exc())
+  try:
+    for f in os.listdir(_worker_scratch):
+      os.unlink(os.path.join(_worker_scratch, f))
+  except OSError:
+    pass
+  return (status, result, start - submitted, time.time() - start)
+
+
+#
+# The server. This runs in the main process.
+#
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  server_version = 'tiltbrush/1'
+
+  def _send(self, status, body, content_type='text/plain', timings=()):
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    if timings:
+      self.send_header('Server-Timing', ', '.join(
+        '%s;dur=%.1f' % (name, 1000 * secs) for (name, secs) in timings))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def _send_json(self, status, obj):
+    self._send(status, json.dumps(obj, indent=2, sort_keys=True) + '\n',
+               'application/json')
+
+  def do_GET(self):
+    if self.path == '/':
+      self._send_json(200, { 'conversions': sorted(CONVERSIONS) })
+    elif self.path == '/health':
+      self._send_json(200, self.server.load())
+    else:
+      self._send(404, 'Not found\n')
+
+  def do_POST(self):
+    start = time.time()
+    name = self.path.strip('/')
+    if name not in CONVERSIONS:
+      return self._send(404, 'Unknown conversion %s\n' % name)
+    try:
+      length = int(self.headers.get('Content-Length'))
+    except (TypeError, ValueError):
+      return self._send(411, 'Content-Length required\n')
+    if not 0 < length <= MAX_BODY_BYTES:
+      return self._send(413, 'Body must be 1 to %d bytes\n' % MAX_BODY_BYTES)
+    body = self.rfile.read(length)
+
+    result = self.server.submit(name, body)
+    if result is None:
+      self.send_response(503)
+      self.send_header('Retry-After', '1')
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    try:
+      (status, out, queued, converting) = result.get(self.server.timeout_secs)
+    except multiprocessing.TimeoutError:
+      # The job still holds its slot until the worker finishes it
+      return self._send(504, 'Timed out\n')
+    content_type = CONVERSIONS[name][0] if status == 200 else 'text/plain'
+    self._send(status, out, content_type,
+               [('queue', queued), ('convert', converting),
+                ('total', time.time() - start)])
+
+  def log_message(self, format, *args):
+    if self.server.verbose:
+      BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class ConversionServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Serves CONVERSIONS on *address*, a (host, port) tuple, with a pool of
+  *workers* processes (default: one per cpu). At most max_queue
+  requests wait for a worker. Jobs that haven't finished reclaim_secs
+  after they were submitted (default: timeout_secs + RECLAIM_GRACE) no
+  longer count against the queue. Call serve_forever(), then close()."""
+  daemon_threads = True
+
+  def __init__(self, address, workers=None, max_queue=MAX_QUEUE,
+               timeout_secs=REQUEST_TIMEOUT, reclaim_secs=None, verbose=False):
+    BaseHTTPServer.HTTPServer.__init__(self, address, _Handler)
+    self.workers = workers or multiprocessing.cpu_count()
+    self.max_queue = max_queue
+    self.timeout_secs = timeout_secs
+    if reclaim_secs is None:
+      reclaim_secs = timeout_secs + RECLAIM_GRACE
+    self.reclaim_secs = reclaim_secs
+    self.verbose = verbose
+    scratch_parent = SCRATCH_DIR if os.path.isdir(SCRATCH_DIR) else None
+    self.scratch_dir = tempfile.mkdtemp(prefix='tiltserve', dir=scratch_parent)
+    self.pool = multiprocessing.Pool(self.workers, _init_worker, [self.scratch_dir])
+    self._lock = threading.Lock()
+    self._jobs = {}   # { job id: submit time } for unfinished jobs
+    self._job_ids = itertools.count()
+    self._served = 0
+    self._rejected = 0
+    self._lost = 0
+
+  def submit(self, name, body):
+    """Queues a conversion. Returns an AsyncResult, or None if the queue
+    is full. The conversion keeps its place in the queue until a worker
+    has finished it, even if nobody waits for the result."""
+    now = time.time()
+    with self._lock:
+      self._reclaim(now)
+      if len(self._jobs) >= self.workers + self.max_queue:
+        self._rejected += 1
+        return None
+      job = next(self._job_ids)
+      self._jobs[job] = now
+    return self.pool.apply_async(_convert, [(name, body, now)],
+                                 callback=lambda _: self._done(job))
+
+  def _done(self, job):
+    # _convert() doesn't raise, so this runs for every job whose worker
+    # survives it
+    with self._lock:
+      self._jobs.pop(job, None)
+      self._served += 1
+
+  def _reclaim(self, now):
+    """Forgets jobs that should have finished long ago. A worker that
+    dies is replaced by the pool, but its job never completes. Call with
+    the lock held."""
+    for (job, submitted) in self._jobs.items():
+      if now - submitted > self.reclaim_secs:
+        del self._jobs[job]
+        self._lost += 1
+
+  def load(self):
+    with self._lock:
+      self._reclaim(time.time())
+      pending = len(self._jobs)
+      return {
+        'workers': self.workers,
+        'running': min(pending, self.workers),
+        'queued': max(pending - self.workers, 0),
+        'max_queue': self.max_queue,
+        'served': self._served,
+        'rejected': self._rejected,
+        'lost': self._lost,
+      }
+
+  def close(self):
+    self.server_close()
+    self.pool.terminate()
+    self.pool.join()
+    shutil.rmtree(self.scratch_dir, True)
+
+
+def serve(host='localhost', port=DEFAULT_PORT, **kwargs):
+  """Runs a ConversionServer until interrupted. kwargs are passed to
+  ConversionServer."""
+  server = ConversionServer((host, port), **kwargs)
+  print >>sys.stderr, "Serving on http://%s:%d/ with %d workers" % (
+    host, server.server_address[1], server.workers)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
@@ -0,0 +1,263 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Splits TiltBrushMesh instances into an octree of .glb tiles, for
+viewers that only want to fetch the part of a sketch that is on screen.
+Requires numpy.
+
+Meshes are streamed: triangles are spilled to per-tile temporary files
+as they arrive, and a tile is split into its 8 children when it holds
+too many triangles. Only one tile's worth of geometry is in memory at
+a time. Each triangle belongs to the tile that contains its centroid,
+so tile contents may poke slightly out of their cells.
+See:
+  tile_export()
+  tile_meshes()
+  Tiler"""
+
+import copy
+import cPickle as pickle
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from tiltbrush.export import iter_meshes, TiltBrushMesh
+from tiltbrush.gltf import GENERATOR, write_glb
+
+__all__ = ('Tiler', 'mesh_bounds', 'tile_export', 'tile_meshes')
+
+MANIFEST_NAME = 'tiles.json'
+MANIFEST_VERSION = 1
+# Defaults for Tiler
+MAX_TILE_TRIS = 1 << 16
+MAX_DEPTH = 8
+
+
+def mesh_bounds(meshes):
+  """Returns ((min x, y, z), (max x, y, z)) of the verts of all meshes,
+  or None if there are none. Only one mesh is looked at at a time."""
+  lo = hi = None
+  for mesh in meshes:
+    if len(mesh.v) == 0:
+      continue
+    v = np.asarray(mesh.v, dtype=np.float64)
+    if lo is None:
+      (lo, hi) = (v.min(axis=0), v.max(axis=0))
+    else:
+      (lo, hi) = (np.minimum(lo, v.min(axis=0)), np.maximum(hi, v.max(axis=0)))
+  if lo is None:
+    return None
+  return (tuple(lo.tolist()), tuple(hi.tolist()))
+
+
+def _submesh(mesh, tri):
+  """Returns a copy of the array-backed *mesh* with only the triangles
+  *tri* (an (M,3) array of indices into mesh) and the verts they use."""
+  part = TiltBrushMesh()
+  (part.name, part.brush_name, part.brush_guid) = \
+      (mesh.name, mesh.brush_name, mesh.brush_guid)
+  new_index_to_old_index = np.unique(tri)
+  for attr_name, _, _ in TiltBrushMesh.VERTEX_ATTRIBUTES:
+    arr = getattr(mesh, attr_name)
+    setattr(part, attr_name,
+            None if arr is None else arr[new_index_to_old_index])
+  part.tri = np.searchsorted(new_index_to_old_index, tri) \
+               .astype(TiltBrushMesh.ARRAY_DTYPES['I'])
+  return part
+
+
+class _Node(object):
+  """An octree cell. Leaves spill their triangles to a file; split
+  nodes have 8 children, some of which may be None."""
+  def __init__(self, tile_id, lo, size, depth):
+    self.tile_id = tile_id
+    self.lo = lo
+    self.size = size
+    self.depth = depth
+    self.children = None
+    self.num_tris = 0
+
+  @property
+  def center(self):
+    return self.lo + 0.5 * self.size
+
+  def child(self, octant):
+    if self.children[octant] is None:
+      offset = np.array([(octant >> axis) & 1 for axis in range(3)])
+      self.children[octant] = _Node(self.tile_id + str(octant),
+                                    self.lo + offset * 0.5 * self.size,
+                                    0.5 * self.size, self.depth + 1)
+    return self.children[octant]
+
+
+class Tiler(object):
+  """Builds an octree of tiles over the cube that encloses *bounds*, as
+  returned by mesh_bounds(). Call add() with each mesh, then finish().
+  max_tris   A tile with more triangles than this is split, unless it
+             is already max_depth levels deep.
+  weld_eps   If not None, verts in each tile closer than this are
+             welded; otherwise only identical verts are."""
+  def __init__(self, bounds, out_dir, max_tris=MAX_TILE_TRIS,
+               max_depth=MAX_DEPTH, weld_eps=None):
+    (lo, hi) = (np.array(bounds[0], dtype=np.float64),
+                np.array(bounds[1], dtype=np.float64))
+    size = max((hi - lo).max(), 1e-6)
+    # Pad slightly so that verts on the far faces land inside the cube
+    self.root = _Node('r', lo - 1e-4 * size, size * (1 + 2e-4), 0)
+    self.out_dir = out_dir
+    self.max_tris = max_tris
+    self.max_depth = max_depth
+    self.weld_eps = weld_eps
+    self.spill_dir = tempfile.mkdtemp(prefix='tiles')
+
+  def _spill_name(self, node):
+    return os.path.join(self.spill_dir, node.tile_id)
+
+  def add(self, mesh):
+    """Adds the triangles of a TiltBrushMesh to the tiles."""
+    if not mesh.uses_arrays:
+      mesh = copy.copy(mesh).to_arrays()
+    if len(mesh.tri):
+      self._add(self.root, mesh)
+
+  def _add(self, node, mesh):
+    if node.children is not None:
+      for (octant, part) in self._partition(node, mesh):
+        self._add(node.child(octant), part)
+      return
+    with file(self._spill_name(node), 'ab') as outf:
+      pickle.dump(mesh, outf, pickle.HIGHEST_PROTOCOL)
+    node.num_tris += len(mesh.tri)
+    if node.num_tris > self.max_tris and node.depth < self.max_depth:
+      parts = list(self._iter_spill(node))
+      os.unlink(self._spill_name(node))
+      node.children = [None] * 8
+      node.num_tris = 0
+      for part in parts:
+        self._add(node, part)
+
+  def _iter_spill(self, node):
+    with file(self._spill_name(node), 'rb') as inf:
+      while True:
+        try:
+          yield pickle.load(inf)
+        except EOFError:
+          return
+
+  @staticmethod
+  def _partition(node, mesh):
+    """Yields (octant, submesh) for each octant with triangles in it."""
+    tri = mesh.tri.astype(np.intp)
+    centroids = mesh.v[tri].astype(np.float64).mean(axis=1)
+    octants = ((centroids >= node.center) * [1, 2, 4]).sum(axis=1)
+    for octant in np.unique(octants):
+      yield (int(octant), _submesh(mesh, tri[octants == octant]))
+
+  def _write_tile(self, node):
+    """Merges and welds a leaf's spilled meshes per brush, writes them
+    as a .glb, and returns its manifest content entry."""
+    by_guid = {}
+    order = []
+    for mesh in self._iter_spill(node):
+      if mesh.brush_guid not in by_guid:
+        by_guid[mesh.brush_guid] = []
+        order.append(mesh.brush_guid)
+      by_guid[mesh.brush_guid].append(mesh)
+    meshes = []
+    for guid in order:
+      group = by_guid.pop(guid)
+      mesh = TiltBrushMesh.from_meshes(group, name=group[0].brush_name)
+      if self.weld_eps:
+        mesh.weld(self.weld_eps, match=('uv0', 'uv1', 'c'))
+      else:
+        mesh.collapse_verts()
+        mesh.remove_degenerate()
+      meshes.append(mesh)
+    os.unlink(self._spill_name(node))
+
+    uri = 'tile_%s.glb' % node.tile_id
+    write_glb(meshes, os.path.join(self.out_dir, uri))
+    (lo, hi) = mesh_bounds(meshes)
+    return {
+      'uri': uri,
+      'bounds': { 'min': list(lo), 'max': list(hi) },
+      'triangles': sum(len(m.tri) for m in meshes),
+      'vertices': sum(len(m.v) for m in meshes),
+    }
+
+  def _finish_node(self, node):
+    """Returns the manifest entry for node, or None if it is empty."""
+    entry = {
+      'id': node.tile_id,
+      'bounds': { 'min': node.lo.tolist(),
+                  'max': (node.lo + node.size).tolist() },
+    }
+    if node.children is not None:
+      children = [self._finish_node(c) for c in node.children if c is not None]
+      entry['children'] = [c for c in children if c is not None]
+      if not entry['children']:
+        return None
+      # Leaving this tile unrefined loses everything in it
+      entry['error'] = float(np.sqrt(3) * node.size)
+    elif node.num_tris:
+      entry['content'] = self._write_tile(node)
+      entry['error'] = float(self.weld_eps or 0.0)
+    else:
+      return None
+    return entry
+
+  def finish(self):
+    """Writes the tiles and the manifest, and returns the manifest."""
+    try:
+      manifest = {
+        'version': MANIFEST_VERSION,
+        'generator': GENERATOR,
+        'root': self._finish_node(self.root),
+      }
+      with file(os.path.join(self.out_dir, MANIFEST_NAME), 'wb') as outf:
+        json.dump(manifest, outf, indent=2, sort_keys=True)
+      return manifest
+    finally:
+      self.close()
+
+  def close(self):
+    """Removes the temporary files. Called by finish()."""
+    shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+def tile_meshes(meshes, bounds, out_dir, **kwargs):
+  """Tiles TiltBrushMesh instances into out_dir; see Tiler. Returns the
+  manifest. *meshes* is only iterated once."""
+  tiler = Tiler(bounds, out_dir, **kwargs)
+  try:
+    for mesh in meshes:
+      tiler.add(mesh)
+  except:
+    tiler.close()
+    raise
+  return tiler.finish()
+
+
+def tile_export(filename, out_dir, **kwargs):
+  """Tiles a Tilt Brush .json export into out_dir; see Tiler. The export
+  is read twice, to find its bounds and then to tile it. Returns the
+  manifest, or None if the export has no geometry."""
+  bounds = mesh_bounds(iter_meshes(filename, arrays=True))
+  if bounds is None:
+    return None
+  return tile_meshes(iter_meshes(filename, arrays=True), bounds, out_dir,
+                     **kwargs)
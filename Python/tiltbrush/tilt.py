@@ -21,8 +21,11 @@ import uuid
 import struct
 import contextlib
 from collections import defaultdict
+from cStringIO import StringIO
 from io import BytesIO
 
+from tiltbrush import instrument
+
 __all__ = ('Tilt', 'Sketch', 'Stroke', 'ControlPoint',
            'BadTilt', 'BadMetadata', 'MissingKey')
 
@@ -157,6 +160,7 @@ class Tilt(object):
   """Class representing a .tilt file. Attributes:
     .sketch     A tilt.Sketch instance. NOTE: this is read lazily.
     .metadata   A dictionary of data.
+    .filename   None if loaded with from_bytes() or from_fileobj()
 
   To modify the sketch, see XXX.
   To modify the metadata, see mutable_metadata()."""
@@ -187,23 +191,84 @@ class Tilt(object):
   def __init__(self, filename, from_json=False):
     self.from_json = from_json
     self.filename = filename
+    self._data = None            # packed .tilt, if held in memory
     self._sketch = None          # lazily-loaded
     if from_json:
-      with open('metadata.json', 'r') as metadata_json_file:
+      metadata_name = os.path.join(os.path.dirname(filename), 'metadata.json')
+      with open(metadata_name, 'r') as metadata_json_file:
         mjd = metadata_json_file.read() 
         self.metadata = json.loads(mjd) # XXX: Clean this up
         self._sketch = Sketch(filename, from_json) # self, source, from_json
     else: 
-      with self.subfile_reader('metadata.json') as inf:
-        self.metadata = json.load(inf)
-        try:
-          validate_metadata(self.metadata)
-        except BadMetadata as e:
-          print('WARNING: %s' % e)
+      self._load_metadata()
+
+  @classmethod
+  def from_bytes(cls, data):
+    """Returns a Tilt for the packed .tilt held in *data*: a str, or
+    anything that supports the buffer protocol (eg memoryview,
+    bytearray). data is used in place, not copied, and must not be
+    modified while the Tilt is in use. .filename is None.
+    Raises BadTilt if the header is bad."""
+    import tiltbrush.unpack as unpack
+    if isinstance(data, bytearray):
+      data = memoryview(data)
+    try:
+      unpack._read_and_check_header(StringIO(data))
+    except unpack.ConversionError as e:
+      raise BadTilt(str(e))
+    inst = cls.__new__(cls)
+    inst.from_json = False
+    inst.filename = None
+    inst._data = data
+    inst._sketch = None
+    inst._load_metadata()
+    return inst
+
+  @classmethod
+  def from_fileobj(cls, inf):
+    """Returns a Tilt for the packed .tilt read from the file-like *inf*.
+    See from_bytes()."""
+    return cls.from_bytes(inf.read())
+
+  def to_bytes(self):
+    """Returns the packed .tilt as a str. Unpacked .tilts are packed,
+    uncompressed."""
+    if self._data is not None:
+      if isinstance(self._data, str):
+        return self._data
+      return StringIO(self._data).getvalue()
+    if not os.path.isdir(self.filename):
+      with file(self.filename, 'rb') as inf:
+        return inf.read()
+    import shutil, tempfile
+    import tiltbrush.unpack as unpack
+    tmpdir = tempfile.mkdtemp()
+    try:
+      packed = os.path.join(tmpdir, 'packed.tilt')
+      unpack.convert_dir_to_zip(self.filename, False, packed)
+      with file(packed, 'rb') as inf:
+        return inf.read()
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def _load_metadata(self):
+    with self.subfile_reader('metadata.json') as inf:
+      with instrument.phase('member_read') as phase:
+        data = inf.read()
+        phase.nbytes = len(data)
+    with instrument.phase('metadata_parse', len(data)):
+      self.metadata = json.loads(data)
+    try:
+      with instrument.phase('metadata_validate'):
+        validate_metadata(self.metadata)
+    except BadMetadata as e:
+      print('WARNING: %s' % e)
 
   def pack_sketch(self):
-    tmpf = StringIO()
-    packed_data = self._sketch.binwrite(binfile(tmpf))
+    with instrument.phase('sketch_encode') as phase:
+      tmpf = BytesIO()
+      self._sketch.binwrite(binfile(tmpf))
+      phase.nbytes = tmpf.tell()
     return tmpf.getvalue()
   
   def write_sketch(self):
@@ -225,19 +290,32 @@ class Tilt(object):
 
   @contextlib.contextmanager
   def subfile_reader(self, subfile):
-    if os.path.isdir(self.filename):
+    if self._data is not None:
+      from zipfile import ZipFile
+      with instrument.phase('zip_open'):
+        inzip = ZipFile(StringIO(self._data), 'r')
+      with inzip:
+        with inzip.open(subfile) as inf:
+          yield inf
+    elif os.path.isdir(self.filename):
       with file(os.path.join(self.filename, subfile), 'rb') as inf:
         yield inf
     else:
       from zipfile import ZipFile
-      with ZipFile(self.filename, 'r') as inzip:
+      with instrument.phase('zip_open'):
+        inzip = ZipFile(self.filename, 'r')
+      with inzip:
         with inzip.open(subfile) as inf:
           yield inf
 
   @contextlib.contextmanager
   def subfile_writer(self, subfile):
     # Kind of a large hammer, but it works
-    if os.path.isdir(self.filename):
+    if self._data is not None:
+      outf = BytesIO()
+      yield outf
+      self._replace_member(subfile, outf.getvalue())
+    elif os.path.isdir(self.filename):
       with file(os.path.join(self.filename, subfile), 'wb') as outf:
         yield outf
     else:
@@ -245,6 +323,32 @@ class Tilt(object):
         with tilt2.subfile_writer(subfile) as outf:
           yield outf
 
+  def _replace_member(self, subfile, data):
+    """Rebuilds the in-memory zip with new contents for *subfile*. Other
+    members are copied without recompressing them."""
+    import time
+    from zipfile import ZipFile, ZipInfo
+    import tiltbrush.unpack as unpack
+    source = StringIO(self._data)
+    outf = BytesIO()
+    outf.write(unpack._read_and_check_header(source))
+    with ZipFile(source, 'r') as inzip, \
+         ZipFile(outf, 'w', allowZip64=False) as outzip:
+      for info in inzip.infolist():
+        zinfo = ZipInfo(info.filename, info.date_time)
+        zinfo.external_attr = info.external_attr
+        zinfo.compress_type = info.compress_type
+        if info.filename == subfile:
+          outzip.writestr(zinfo, data)
+        else:
+          (zinfo.file_size, zinfo.CRC) = (info.file_size, info.CRC)
+          unpack._write_raw(outzip, zinfo, unpack._read_raw(source, info))
+      if subfile not in inzip.NameToInfo:
+        zinfo = ZipInfo(subfile, time.localtime()[0:6])
+        zinfo.external_attr = 0o644 << 16
+        outzip.writestr(zinfo, data)
+    self._data = outf.getvalue()
+
   @contextlib.contextmanager
   def mutable_metadata(self):
     """Return a mutable copy of the metadata.
@@ -314,13 +418,20 @@ def _make_ext_reader(ext_bits, ext_mask):
           values[i] = f.read(nbytes)
         else:
           values[i], = struct.unpack(fmt, f.read(4))
+      return values
+    def writer(f, values, fmts=fmts):
+      for fmt, value in zip(fmts, values):
+        if fmt == '<@':
+          f.write(struct.pack('<I', len(value)))
+          f.write(value)
+        else:
+          f.write(struct.pack(fmt, value))
   else:
     def reader(f, fmt=fmt, nbytes=len(infos)*4):
       values = list(struct.unpack(fmt, f.read(nbytes)))
       return values
-
-  def writer(f, values, fmt=fmt):
-    return f.write(struct.pack(fmt, *values))
+    def writer(f, values, fmt=fmt):
+      return f.write(struct.pack(fmt, *values))
 
   lookup = dict( (name,i) for (i,name) in enumerate(names) )
 
@@ -342,6 +453,16 @@ def _make_cp_ext_reader(ext_mask, memo={}):
   return ret
 
 
+def _read_sketch_header(b):
+  """Reads the start of a data.sketch from binfile *b*. Returns
+  (header, additional header, number of strokes); the strokes follow."""
+  header = list(b.unpack("<3I"))
+  additional_header = b.read_length_prefixed()
+  (num_strokes, ) = b.unpack("<i")
+  assert 0 <= num_strokes < 300000, num_strokes
+  return (header, additional_header, num_strokes)
+
+
 class Sketch(object):
   """Stroke data from a .tilt file. Attributes:
     .strokes    List of tilt.Stroke instances
@@ -357,7 +478,10 @@ class Sketch(object):
     elif isinstance(source, Tilt):
       with source.subfile_reader('data.sketch') as inf:
         self.filename = None
-        self._parse(binfile(inf))
+        with instrument.phase('member_read') as phase:
+          data = inf.read()
+          phase.nbytes = len(data)
+      self._parse(binfile(BytesIO(data)))
     elif hasattr(source, 'read'):
       self.filename = None
       self._parse(binfile(source))
@@ -366,11 +490,13 @@ class Sketch(object):
       with file(source, 'rb') as inf:
         self._parse(binfile(inf))
 
-  def write(self):
+  def write(self, destination):
     """destination is either a file name, a file-like instance, or a Tilt instance."""
-    tmpf = StringIO()
-    self.binwrite(binfile(tmpf))
-    data = tmpf.getvalue()
+    with instrument.phase('sketch_encode', objects=len(self.strokes)) as phase:
+      tmpf = BytesIO()
+      self.binwrite(binfile(tmpf))
+      data = tmpf.getvalue()
+      phase.nbytes = len(data)
 
     if isinstance(destination, Tilt):
       with destination.subfile_writer('data.sketch') as outf:
@@ -398,11 +524,9 @@ class Sketch(object):
   def _parse(self, b):
     # b is a binfile instance
     # mutates self
-    self.header = list(b.unpack("<3I"))
-    self.additional_header = b.read_length_prefixed()
-    (num_strokes, ) = b.unpack("<i")
-    assert 0 <= num_strokes < 300000, num_strokes
-    self.strokes = [Stroke.from_file(b) for i in xrange(num_strokes)]
+    (self.header, self.additional_header, num_strokes) = _read_sketch_header(b)
+    with instrument.phase('stroke_headers', objects=num_strokes):
+      self.strokes = [Stroke.from_file(b) for i in xrange(num_strokes)]
 
   def binwrite(self, b):
     # b is a binfile instance.
@@ -412,6 +536,47 @@ class Sketch(object):
     for stroke in self.strokes:
       stroke._write(b) # _write on the stroke object
 
+  def memory_report(self):
+    """Returns an estimate of the memory held by the sketch, as a dict:
+      strokes, controlpoints  Counts
+      decoded_strokes         Strokes whose .controlpoints have been created
+      bytes                   Breakdown of the total:
+        header                Sketch attributes other than strokes
+        strokes               Stroke instances and their brush data
+        stroke_extension      Stroke extension values
+        controlpoints         ControlPoint instances and their lists
+        raw_controlpoints     Control point data not yet decoded
+      total, bytes_per_stroke, bytes_per_controlpoint
+    Objects shared between strokes are counted once.
+    See instrument.deep_sizeof()."""
+    seen = set()
+    sizes = dict.fromkeys(('header', 'strokes', 'stroke_extension',
+                           'controlpoints', 'raw_controlpoints'), 0)
+    num_cp = decoded = 0
+    for stroke in self.strokes:
+      attrs = stroke.__dict__
+      if 'controlpoints' in attrs:
+        decoded += 1
+        num_cp += len(attrs['controlpoints'])
+        sizes['controlpoints'] += instrument.deep_sizeof(attrs['controlpoints'], seen)
+      else:
+        num_cp += attrs['_controlpoints'][1]
+        sizes['raw_controlpoints'] += instrument.deep_sizeof(attrs['_controlpoints'], seen)
+      sizes['stroke_extension'] += instrument.deep_sizeof(attrs.get('extension'), seen)
+      sizes['strokes'] += instrument.deep_sizeof(stroke, seen)
+    sizes['strokes'] += instrument.deep_sizeof(self.strokes, seen)
+    sizes['header'] = instrument.deep_sizeof(self, seen)
+    total = sum(sizes.values())
+    return {
+      'strokes': len(self.strokes),
+      'controlpoints': num_cp,
+      'decoded_strokes': decoded,
+      'bytes': sizes,
+      'total': total,
+      'bytes_per_stroke': float(total) / max(len(self.strokes), 1),
+      'bytes_per_controlpoint': float(total) / max(num_cp, 1),
+    }
+
 class Stroke(object):
   """Data for a single stroke from a .tilt file. Attributes:
     .brush_idx      Index into Tilt.metadata['BrushIndex']; tells you the brush GUID
@@ -540,8 +705,9 @@ class Stroke(object):
   @memoized_property
   def controlpoints(self):
     (cp_ext_reader, num_cp, raw_data) = self.__dict__.pop('_controlpoints')
-    b = binfile(BytesIO(raw_data))
-    return [ControlPoint.from_file(b, cp_ext_reader) for i in xrange(num_cp)]
+    with instrument.phase('cp_decode', len(raw_data), num_cp):
+      b = binfile(BytesIO(raw_data))
+      return [ControlPoint.from_file(b, cp_ext_reader) for i in xrange(num_cp)]
 
   def has_stroke_extension(self, name):
     """Returns true if this stroke has the requested extension data.
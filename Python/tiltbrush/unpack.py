@@ -13,13 +13,24 @@
 # limitations under the License.
 
 """Converts a .tilt file from packed format to unpacked format,
-and vice versa. Applies sanity checks when packing."""
+and vice versa. Applies sanity checks when packing.
+
+Members are streamed between the zip and the directory. Compressing
+and decompressing happens in a pool of threads, one member per thread;
+zlib releases the GIL while it works."""
 
 from cStringIO import StringIO
+from itertools import imap, izip
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
 import sys
 import struct
+import time
 import zipfile
+import zlib
+
+from tiltbrush import instrument
 
 __all__ = ('ConversionError', 'convert_zip_to_dir', 'convert_dir_to_zip')
 
@@ -35,6 +46,9 @@ STANDARD_FILE_ORDER = [
 ]
 STANDARD_FILE_ORDER = dict( (n,i) for (i,n) in enumerate(STANDARD_FILE_ORDER) )
 
+# zlib level used when compressing, unless told otherwise
+DEFAULT_COMPRESSLEVEL = zlib.Z_DEFAULT_COMPRESSION
+
 class ConversionError(Exception):
   """An error occurred in the zip <-> directory conversion process"""
   pass
@@ -88,40 +102,140 @@ def _read_and_check_header(inf):
   return base_bytes + more_bytes
 
 
-def convert_zip_to_dir(in_name):
-  """Returns True if compression was used"""
+def _thread_map(func, items, threads):
+  """Like imap(func, items), but runs up to *threads* calls at once.
+  If threads is None, uses one thread per cpu."""
+  items = list(items)
+  if threads is None:
+    threads = multiprocessing.cpu_count()
+  threads = min(threads, len(items))
+  if threads <= 1:
+    for result in imap(func, items):
+      yield result
+    return
+  pool = ThreadPool(threads)
+  try:
+    for result in pool.imap(func, items):
+      yield result
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+
+
+def _extract_member(args):
+  """Copies one member out of the zip. Each call opens the zip itself,
+  since ZipFile instances can't be shared between threads."""
+  (in_name, member_name, out_dir) = args
+  with zipfile.ZipFile(in_name) as zf:
+    return zf.extract(member_name, out_dir)
+
+
+def convert_zip_to_dir(in_name, out_name=None, threads=None):
+  """Unpacks the .tilt *in_name* into a directory. If out_name is None,
+  the directory replaces in_name; otherwise it is written straight to
+  out_name, which must not exist. Members are extracted by up to
+  *threads* threads. Returns True if compression was used"""
   with file(in_name, 'rb') as inf:
     header_bytes = _read_and_check_header(inf)
 
-  compression = False
-  out_name = in_name + '._part'
+  in_place = out_name is None
+  if in_place:
+    out_name = in_name + '._part'
   if os.path.exists(out_name):
     raise ConversionError("Remove %s first" % out_name)
 
   try:
     os.makedirs(out_name)
 
-    with zipfile.ZipFile(in_name) as zf:
-      for member in zf.infolist():
-        if member.compress_size != member.file_size:
-          compression = True
-        zf.extract(member, out_name)
+    with instrument.phase('zip_extract') as phase:
+      with zipfile.ZipFile(in_name) as zf:
+        members = zf.infolist()
+      compression = any(member.compress_size != member.file_size
+                        for member in members)
+      for _ in _thread_map(_extract_member,
+                           [(in_name, member.filename, out_name)
+                            for member in members], threads):
+        pass
+      phase.nbytes = sum(member.file_size for member in members)
     with file(os.path.join(out_name, 'header.bin'), 'wb') as outf:
       outf.write(header_bytes)
 
-    tmp = in_name + '._prev'
-    os.rename(in_name, tmp)
-    os.rename(out_name, in_name)
-    _destroy(tmp)
+    if in_place:
+      tmp = in_name + '._prev'
+      os.rename(in_name, tmp)
+      os.rename(out_name, in_name)
+      _destroy(tmp)
+    else:
+      out_name = None
 
     return compression
   finally:
-    _destroy(out_name)
-
-
-def convert_dir_to_zip(in_name, compress):
+    if out_name is not None:
+      _destroy(out_name)
+
+
+def _deflate_file(args):
+  """Returns (size, crc, compressed data) of a file."""
+  (filename, compresslevel) = args
+  with file(filename, 'rb') as inf:
+    data = inf.read()
+  co = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+  compressed = co.compress(data) + co.flush()
+  return (len(data), zlib.crc32(data) & 0xffffffff, compressed)
+
+
+def _write_raw(zf, zinfo, raw_data):
+  """Adds a member to *zf* whose data has already been compressed with
+  zinfo.compress_type. zinfo.file_size and zinfo.CRC must be set."""
+  zinfo.compress_size = len(raw_data)
+  zinfo.header_offset = zf.fp.tell()
+  zf._writecheck(zinfo)
+  zf._didModify = True
+  zf.fp.write(zinfo.FileHeader(False))
+  zf.fp.write(raw_data)
+  zf.filelist.append(zinfo)
+  zf.NameToInfo[zinfo.filename] = zinfo
+
+
+def _write_deflated(zf, filename, arcname, size, crc, compressed):
+  """Adds already-deflated data to *zf*, as ZipFile.write() would have
+  added the file *filename*."""
+  st = os.stat(filename)
+  zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+  zinfo.external_attr = (st.st_mode & 0xFFFF) << 16L
+  zinfo.compress_type = zipfile.ZIP_DEFLATED
+  zinfo.file_size = size
+  zinfo.CRC = crc
+  _write_raw(zf, zinfo, compressed)
+
+
+def _read_raw(fp, zinfo):
+  """Returns the still-compressed data of the member *zinfo* of the
+  zip open as *fp*."""
+  fp.seek(zinfo.header_offset)
+  header = fp.read(zipfile.sizeFileHeader)
+  if len(header) != zipfile.sizeFileHeader or header[0:4] != zipfile.stringFileHeader:
+    raise zipfile.BadZipfile("Bad local header for %s" % zinfo.filename)
+  fields = struct.unpack(zipfile.structFileHeader, header)
+  fp.seek(fields[zipfile._FH_FILENAME_LENGTH] +
+          fields[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+  raw_data = fp.read(zinfo.compress_size)
+  if len(raw_data) != zinfo.compress_size:
+    raise zipfile.BadZipfile("Truncated data for %s" % zinfo.filename)
+  return raw_data
+
+
+def convert_dir_to_zip(in_name, compress, out_name=None,
+                       compresslevel=DEFAULT_COMPRESSLEVEL, threads=None):
+  """Packs the unpacked .tilt *in_name* into a zip. If out_name is None,
+  the zip replaces in_name; otherwise it is written straight to out_name,
+  which must not exist. With *compress*, members are deflated at
+  zlib level *compresslevel* by up to *threads* threads."""
   in_name = os.path.normpath(in_name)  # remove trailing '/' if any
-  out_name = in_name + '.part'
+  in_place = out_name is None
+  if in_place:
+    out_name = in_name + '.part'
   if os.path.exists(out_name):
     raise ConversionError("Remove %s first" % out_name)
   
@@ -146,37 +260,49 @@ def convert_dir_to_zip(in_name, compress):
   except ValueError as e:
     raise ConversionError("metadata.json is not valid json: %s" % e)
 
+  header_bytes = None
+  members = []  # (filename, arcname)
+  for (r, ds, fs) in os.walk(in_name):
+    fs.sort(key=by_standard_order)
+    for f in fs:
+      fullf = os.path.join(r, f)
+      if f == 'header.bin':
+        header_bytes = file(fullf).read()
+        continue
+      members.append((fullf, fullf[len(in_name)+1:]))
+
+  if header_bytes is None:
+    print("Missing header; using default")
+    header_bytes = struct.pack(HEADER_V1_FMT, 'tilT', struct.calcsize(HEADER_V1_FMT), 1, 0, 0)
+
+  if not _read_and_check_header(StringIO(header_bytes)):
+    raise ConversionError("Invalid header.bin")
+
   compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
   try:
-    header_bytes = None
-
-    zipf = StringIO()
-    with zipfile.ZipFile(zipf, 'a', compression, False) as zf:
-      for (r, ds, fs) in os.walk(in_name):
-        fs.sort(key=by_standard_order)
-        for f in fs:
-          fullf = os.path.join(r, f)
-          if f == 'header.bin':
-            header_bytes = file(fullf).read()
-            continue
-          arcname = fullf[len(in_name)+1:]
-          zf.write(fullf, arcname, compression)
-
-    if header_bytes is None:
-      print("Missing header; using default")
-      header_bytes = struct.pack(HEADER_V1_FMT, 'tilT', struct.calcsize(HEADER_V1_FMT), 1, 0, 0)
-
-    if not _read_and_check_header(StringIO(header_bytes)):
-      raise ConversionError("Invalid header.bin")
-
-    with file(out_name, 'wb') as outf:
+    with instrument.phase('zip_write') as phase, \
+         file(out_name, 'wb') as outf:
       outf.write(header_bytes)
-      outf.write(zipf.getvalue())
-
-    tmp = in_name + '._prev'
-    os.rename(in_name, tmp)
-    os.rename(out_name, in_name)
-    _destroy(tmp)
+      with zipfile.ZipFile(outf, 'w', compression, False) as zf:
+        if compress:
+          results = _thread_map(_deflate_file,
+                                [(fullf, compresslevel) for (fullf, _) in members],
+                                threads)
+          for ((fullf, arcname), result) in izip(members, results):
+            _write_deflated(zf, fullf, arcname, *result)
+        else:
+          for (fullf, arcname) in members:
+            zf.write(fullf, arcname)
+      phase.nbytes = outf.tell()
+
+    if in_place:
+      tmp = in_name + '._prev'
+      os.rename(in_name, tmp)
+      os.rename(out_name, in_name)
+      _destroy(tmp)
+    else:
+      out_name = None
 
   finally:
-    _destroy(out_name)
+    if out_name is not None:
+      _destroy(out_name)
@@ -0,0 +1,29 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks for the tiltbrush package. Run them with:
+  python -m benchmarks.run --help
+from the top of the repository. Requires numpy.
+See:
+  benchmarks.synthetic  Deterministic synthetic .tilt files and .json exports
+  benchmarks.run        Timings, baselines and regression checks"""
+
+import os
+import sys
+
+# Make the tiltbrush package importable, as the bin/ scripts do
+_PYTHON_DIR = os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), 'Python')
+if _PYTHON_DIR not in sys.path:
+  sys.path.append(_PYTHON_DIR)
@@ -0,0 +1,223 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the memory used by each in-memory representation of the
+same synthetic sketch. For example:
+  python -m benchmarks.memory --size medium --save memory.json
+
+For each representation this reports the live bytes it holds (see
+instrument.deep_sizeof()), per stroke and per item (control point or
+vertex), and the peak growth in resident set size while building it.
+Each representation is built in a fresh child process, so peaks do not
+hide each other. Unix only.
+See:
+  run_memory_benchmarks()"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from benchmarks import synthetic
+from benchmarks.run import SIZES, _Env
+from tiltbrush import instrument
+from tiltbrush.export import iter_meshes
+from tiltbrush.tilt import Tilt
+
+__all__ = ('REPRESENTATIONS', 'run_memory_benchmarks')
+
+# (name, build function), in run order. build(env) returns
+# (objects to measure, number of strokes, number of items, item name).
+REPRESENTATIONS = []
+
+
+def representation(build):
+  REPRESENTATIONS.append((build.__name__, build))
+  return build
+
+
+def _sketch(env, decode):
+  sketch = Tilt(env.tilt_name).sketch
+  if decode:
+    for stroke in sketch.strokes:
+      stroke.controlpoints
+  return sketch
+
+
+@representation
+def tilt_objects(env):
+  """Stroke and ControlPoint instances"""
+  sketch = _sketch(env, True)
+  report = sketch.memory_report()
+  return (sketch, report['strokes'], report['controlpoints'], 'cp')
+
+@representation
+def tilt_lazy(env):
+  """Strokes with undecoded control point data"""
+  sketch = _sketch(env, False)
+  report = sketch.memory_report()
+  return (sketch, report['strokes'], report['controlpoints'], 'cp')
+
+@representation
+def tilt_columnar(env):
+  """Stroke headers, plus one structured array of control points per
+  control point layout, with per-stroke offsets"""
+  sketch = _sketch(env, False)
+  chunks = {}
+  for stroke in sketch.strokes:
+    (_, num_cp, raw_data) = stroke.__dict__.pop('_controlpoints')
+    chunks.setdefault(stroke.cp_mask, []).append((stroke, num_cp, raw_data))
+  columns = {}
+  for (cp_mask, group) in chunks.items():
+    num_ext = len(group[0][0].cp_ext_lookup)
+    dtype = np.dtype([('position', '<f4', 3), ('orientation', '<f4', 4),
+                      ('extension', '<u4', num_ext)])
+    offsets = np.cumsum([0] + [num_cp for (_, num_cp, _) in group])
+    columns[cp_mask] = (
+      np.concatenate([np.frombuffer(raw_data, dtype=dtype)
+                      for (_, _, raw_data) in group]),
+      offsets)
+  del chunks
+  return ((sketch, columns), len(sketch.strokes),
+          sum(len(arr) for (arr, _) in columns.values()), 'cp')
+
+def _meshes(env, arrays):
+  meshes = list(iter_meshes(env.json_name, arrays=arrays))
+  return (meshes, len(meshes), sum(len(m.v) for m in meshes), 'vert')
+
+@representation
+def export_lists(env):
+  """TiltBrushMesh instances with lists of tuples"""
+  return _meshes(env, False)
+
+@representation
+def export_arrays(env):
+  """Array-backed TiltBrushMesh instances"""
+  return _meshes(env, True)
+
+
+def _current_rss():
+  """Returns the resident set size in bytes, or None if unknown."""
+  try:
+    with file('/proc/self/statm') as inf:
+      return int(inf.read().split()[1]) * resource.getpagesize()
+  except (IOError, OSError):
+    return None
+
+
+def _peak_rss():
+  """Returns the peak resident set size in bytes."""
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Bytes on OS X, kilobytes elsewhere
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _measure(conn, env, build):
+  """Runs in a child process. Sends the measurements of one representation
+  back through *conn*."""
+  gc.collect()
+  start = _current_rss()
+  if start is None:
+    start = _peak_rss()
+  (objects, num_strokes, num_items, item) = build(env)
+  peak = _peak_rss() - start
+  live = instrument.deep_sizeof(objects)
+  conn.send({
+    'live_bytes': live,
+    'peak_rss_bytes': max(peak, 0),
+    'strokes': num_strokes,
+    'items': num_items,
+    'item': item,
+    'bytes_per_stroke': float(live) / max(num_strokes, 1),
+    'bytes_per_item': float(live) / max(num_items, 1),
+  })
+  conn.close()
+
+
+def run_memory_benchmarks(params, only=None, log=None):
+  """Measures REPRESENTATIONS of synthetic data of the size given by
+  *params* (see benchmarks.run.SIZES). If *only*, measures just those
+  with these names. Returns { name: { 'live_bytes', 'peak_rss_bytes',
+  'strokes', 'items', 'item', 'bytes_per_stroke', 'bytes_per_item' } }."""
+  results = {}
+  tmpdir = tempfile.mkdtemp(prefix='tiltmem')
+  try:
+    env = _Env(tmpdir, params)
+    for (name, build) in REPRESENTATIONS:
+      if only and name not in only:
+        continue
+      (recv_conn, send_conn) = multiprocessing.Pipe(False)
+      proc = multiprocessing.Process(target=_measure,
+                                     args=(send_conn, env, build))
+      proc.start()
+      send_conn.close()
+      try:
+        result = recv_conn.recv()
+      except EOFError:
+        raise RuntimeError("Measuring %s failed" % name)
+      finally:
+        proc.join()
+      results[name] = result
+      if log is not None:
+        log('%-16s %12d %10.1f %8.1f/%-4s %12d' % (
+          name, result['live_bytes'], result['bytes_per_stroke'],
+          result['bytes_per_item'], result['item'], result['peak_rss_bytes']))
+  finally:
+    shutil.rmtree(tmpdir)
+  return results
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Measures the memory used by each representation of a synthetic sketch.")
+  parser.add_argument('--size', choices=sorted(SIZES), default='small',
+                      help="Size of the synthetic data (default %(default)s)")
+  parser.add_argument('--cp-mask', type=lambda s: int(s, 0),
+                      default=synthetic.CP_MASK, metavar='MASK',
+                      help="Control point extension mask of the synthetic .tilt (default %(default)#x)")
+  parser.add_argument('--only', action='append', metavar='NAME',
+                      choices=[name for (name, _) in REPRESENTATIONS],
+                      help="Only measure this representation. May be repeated.")
+  parser.add_argument('--save', metavar='FILE',
+                      help="Save the results as json")
+  args = parser.parse_args(argv)
+
+  params = dict(SIZES[args.size], cp_mask=args.cp_mask)
+
+  def log(line):
+    print line
+  print '%-16s %12s %10s %13s %12s' % (
+    '', 'live bytes', 'per stroke', 'per item', 'peak rss')
+  results = run_memory_benchmarks(params, args.only, log)
+
+  if args.save:
+    with file(args.save, 'wb') as outf:
+      json.dump({
+        'params': params,
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'results': results,
+      }, outf, indent=2, sort_keys=True)
+    print "Wrote", args.save
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
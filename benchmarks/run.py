@@ -0,0 +1,289 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Times the tiltbrush package on synthetic data, and compares the
+timings against a saved baseline. For example:
+  python -m benchmarks.run --save baseline.json
+  (make changes)
+  python -m benchmarks.run --compare baseline.json
+The comparison exits with status 1 if anything got slower by more
+than --threshold.
+See:
+  run_benchmarks()
+  compare()"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+from benchmarks import synthetic
+from tiltbrush import unpack
+from tiltbrush.export import iter_meshes, TiltBrushMesh
+from tiltbrush.obj import write_obj
+from tiltbrush.tilt import Tilt
+
+__all__ = ('BENCHMARKS', 'SIZES', 'compare', 'run_benchmarks')
+
+BASELINE_VERSION = 1
+# Changes smaller than this many seconds are never flagged, however
+# large they are relative to the baseline
+MIN_DIFFERENCE = 0.002
+
+# Synthetic data sizes.
+# strokes, points   Strokes and control points per stroke in the .tilt
+# quads             Quads per stroke in the .json export, which has the
+#                   same number of strokes
+SIZES = {
+  'small':  { 'strokes': 200,  'points': 100, 'quads': 50 },
+  'medium': { 'strokes': 2000, 'points': 200, 'quads': 100 },
+  'large':  { 'strokes': 8000, 'points': 500, 'quads': 250 },
+}
+
+# (name, setup function), in run order. setup(env) does any untimed
+# preparation and returns the function to time.
+BENCHMARKS = []
+
+
+def benchmark(setup):
+  BENCHMARKS.append((setup.__name__, setup))
+  return setup
+
+
+class _Env(object):
+  """Synthetic input files, shared by all benchmarks."""
+  def __init__(self, tmpdir, params):
+    self.tmpdir = tmpdir
+    self.params = params
+    self.tilt_name = os.path.join(tmpdir, 'sketch.tilt')
+    synthetic.write_tilt(self.tilt_name, params['strokes'], params['points'],
+                         stroke_mask=params.get('stroke_mask', synthetic.STROKE_MASK),
+                         cp_mask=params.get('cp_mask', synthetic.CP_MASK),
+                         blob_size=params.get('blob_size', 0))
+    # An unpacked copy
+    self.tilt_dir = os.path.join(tmpdir, 'unpacked.tilt')
+    shutil.copy(self.tilt_name, self.tilt_dir)
+    unpack.convert_zip_to_dir(self.tilt_dir)
+    self.json_name = os.path.join(tmpdir, 'export.json')
+    with file(self.json_name, 'wb') as outf:
+      outf.write(synthetic.make_json_export(params['strokes'], params['quads']))
+    self.scratch_dir = None
+
+  def scratch(self, name):
+    """Returns a path in a directory that is emptied after each run."""
+    if self.scratch_dir is None:
+      self.scratch_dir = tempfile.mkdtemp(dir=self.tmpdir)
+    return os.path.join(self.scratch_dir, name)
+
+  def clean_scratch(self):
+    if self.scratch_dir is not None:
+      shutil.rmtree(self.scratch_dir)
+      self.scratch_dir = None
+
+
+@benchmark
+def tilt_open(env):
+  return lambda: Tilt(env.tilt_name)
+
+@benchmark
+def sketch_parse(env):
+  tilt = Tilt(env.tilt_name)
+  return lambda: tilt.sketch
+
+@benchmark
+def controlpoints(env):
+  strokes = Tilt(env.tilt_name).sketch.strokes
+  def run():
+    for stroke in strokes:
+      stroke.controlpoints
+  return run
+
+@benchmark
+def write_sketch(env):
+  filename = env.scratch('sketch.tilt')
+  shutil.copytree(env.tilt_dir, filename)
+  tilt = Tilt(filename)
+  for stroke in tilt.sketch.strokes:
+    stroke.controlpoints
+  return tilt.write_sketch
+
+@benchmark
+def unpack_tilt(env):
+  filename = env.scratch('sketch.tilt')
+  shutil.copy(env.tilt_name, filename)
+  return lambda: unpack.convert_zip_to_dir(filename)
+
+@benchmark
+def pack_tilt(env):
+  filename = env.scratch('sketch.tilt')
+  shutil.copytree(env.tilt_dir, filename)
+  return lambda: unpack.convert_dir_to_zip(filename, True)
+
+@benchmark
+def iter_meshes_lists(env):
+  return lambda: list(iter_meshes(env.json_name))
+
+@benchmark
+def iter_meshes_arrays(env):
+  return lambda: list(iter_meshes(env.json_name, arrays=True))
+
+@benchmark
+def collapse_verts(env):
+  mesh = TiltBrushMesh.from_meshes(iter_meshes(env.json_name, arrays=True))
+  return mesh.collapse_verts
+
+@benchmark
+def write_obj_file(env):
+  meshes = list(iter_meshes(env.json_name, arrays=True))
+  filename = env.scratch('out.obj')
+  return lambda: write_obj(meshes, filename)
+
+
+def _time_once(env, setup):
+  """Returns the time taken by one run, excluding setup. Like timeit,
+  the garbage collector is off while timing."""
+  try:
+    run = setup(env)
+    gc.collect()
+    gc.disable()
+    try:
+      start = timeit.default_timer()
+      run()
+      return timeit.default_timer() - start
+    finally:
+      gc.enable()
+  finally:
+    env.clean_scratch()
+
+
+def run_benchmarks(params, repeat=5, only=None, log=None):
+  """Runs BENCHMARKS on synthetic data of the size given by *params*
+  (see SIZES), each *repeat* times. If *only*, runs just the benchmarks
+  with those names. Returns { name: { 'best', 'median', 'times' } },
+  in seconds."""
+  results = {}
+  tmpdir = tempfile.mkdtemp(prefix='tiltbench')
+  try:
+    env = _Env(tmpdir, params)
+    for (name, setup) in BENCHMARKS:
+      if only and name not in only:
+        continue
+      times = sorted(_time_once(env, setup) for _ in xrange(repeat))
+      results[name] = {
+        'best': times[0],
+        'median': times[len(times) // 2],
+        'times': times,
+      }
+      if log is not None:
+        log('%-20s %10.4f s' % (name, times[0]))
+  finally:
+    shutil.rmtree(tmpdir)
+  return results
+
+
+def compare(baseline, results, threshold):
+  """Compares best times in *results* to those in *baseline*, both as
+  returned by run_benchmarks(). Returns a list of
+  (name, baseline seconds, seconds, ratio, status), where status is
+  'regression' if the ratio is above 1 + threshold, 'faster' if it is
+  below 1 / (1 + threshold), and 'ok' otherwise (or if the times differ
+  by less than MIN_DIFFERENCE)."""
+  rows = []
+  for (name, _) in BENCHMARKS:
+    if name not in baseline or name not in results:
+      continue
+    (old, new) = (baseline[name]['best'], results[name]['best'])
+    ratio = new / old if old > 0 else float('inf')
+    if abs(new - old) < MIN_DIFFERENCE:
+      status = 'ok'
+    elif ratio > 1 + threshold:
+      status = 'regression'
+    elif ratio < 1 / (1 + threshold):
+      status = 'faster'
+    else:
+      status = 'ok'
+    rows.append((name, old, new, ratio, status))
+  return rows
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Times the tiltbrush package on synthetic data.")
+  parser.add_argument('--size', choices=sorted(SIZES), default='small',
+                      help="Size of the synthetic data (default %(default)s)")
+  parser.add_argument('--stroke-mask', type=lambda s: int(s, 0),
+                      default=synthetic.STROKE_MASK, metavar='MASK',
+                      help="Stroke extension mask of the synthetic .tilt (default %(default)#x)")
+  parser.add_argument('--cp-mask', type=lambda s: int(s, 0),
+                      default=synthetic.CP_MASK, metavar='MASK',
+                      help="Control point extension mask of the synthetic .tilt (default %(default)#x)")
+  parser.add_argument('--blob-size', type=int, default=0, metavar='BYTES',
+                      help="Add a blob stroke extension of this size")
+  parser.add_argument('--repeat', type=int, default=5, metavar='N',
+                      help="Time each benchmark N times, and keep the best (default %(default)s)")
+  parser.add_argument('--only', action='append', metavar='NAME',
+                      choices=[name for (name, _) in BENCHMARKS],
+                      help="Only run this benchmark. May be repeated.")
+  parser.add_argument('--save', metavar='FILE',
+                      help="Save the results as a baseline")
+  parser.add_argument('--compare', metavar='FILE',
+                      help="Compare the results to a saved baseline")
+  parser.add_argument('--threshold', type=float, default=0.1,
+                      help="With --compare, the slowdown that counts as a regression (default %(default)s)")
+  args = parser.parse_args(argv)
+
+  params = dict(SIZES[args.size], stroke_mask=args.stroke_mask,
+                cp_mask=args.cp_mask, blob_size=args.blob_size)
+  baseline = None
+  if args.compare:
+    with file(args.compare, 'rb') as inf:
+      baseline = json.load(inf)
+    if baseline.get('params') != params:
+      print >>sys.stderr, "WARNING: %s was made with different data: %s" % (
+        args.compare, baseline.get('params'))
+
+  def log(line):
+    print line
+  results = run_benchmarks(params, args.repeat, args.only, log)
+
+  if args.save:
+    with file(args.save, 'wb') as outf:
+      json.dump({
+        'version': BASELINE_VERSION,
+        'params': params,
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'results': results,
+      }, outf, indent=2, sort_keys=True)
+    print "Wrote", args.save
+
+  status = 0
+  if baseline is not None:
+    print
+    print '%-20s %10s %10s %8s' % ('', 'baseline', 'current', 'ratio')
+    for (name, old, new, ratio, verdict) in compare(
+        baseline['results'], results, args.threshold):
+      print '%-20s %10.4f %10.4f %7.2fx %s' % (
+        name, old, new, ratio, '' if verdict == 'ok' else verdict.upper())
+      if verdict == 'regression':
+        status = 1
+  return status
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,155 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deterministic synthetic sketches, for benchmarks and stress tests.
+The same arguments always produce the same bytes. Requires numpy.
+See:
+  make_sketch()
+  write_tilt()
+  make_json_export()"""
+
+import base64
+import json
+import struct
+import zipfile
+
+import numpy as np
+
+from tiltbrush.unpack import HEADER_V1_FMT
+
+__all__ = ('make_sketch', 'write_tilt', 'make_json_export')
+
+# data.sketch header values, as written by Tilt Brush
+SKETCH_COOKIE = 0xc576a5cd
+SKETCH_VERSION = 5
+
+BRUSH_INDEX = [
+  "d90c6ad8-af0f-4b54-b422-e0f92abe1b3c",  # CelVinyl
+  "4391385a-cf83-4396-9e33-31e4e4930b27",  # Wire
+  "2241cd32-8ba2-48a5-9ee7-2caef7e9ed62",  # Light
+  "f5c336cf-5108-4b40-ade9-c687504385ab",  # Ink
+]
+ENVIRONMENT_PRESET = "580b4529-ac50-4fe9-b8d2-635765a14893"
+
+# Defaults: flags and scale per stroke; pressure and timestamp per point
+STROKE_MASK = 0x3
+CP_MASK = 0x3
+# A stroke extension bit with no low bits set holds a length-prefixed blob
+BLOB_EXTENSION_BIT = 0x10000
+
+
+def _mask_bits(mask):
+  """Returns the set bits of mask, lowest first."""
+  return [1 << i for i in range(32) if mask & (1 << i)]
+
+
+def make_sketch(num_strokes, num_points, stroke_mask=STROKE_MASK,
+                cp_mask=CP_MASK, blob_size=0, seed=0):
+  """Returns the contents of a data.sketch file with *num_strokes*
+  strokes of *num_points* control points each, using brushes from
+  BRUSH_INDEX in turn. Stroke extension data follows *stroke_mask*
+  (with BLOB_EXTENSION_BIT added if blob_size > 0) and control point
+  extension data follows *cp_mask*."""
+  rand = np.random.RandomState(seed)
+  if blob_size:
+    stroke_mask |= BLOB_EXTENSION_BIT
+  stroke_bits = _mask_bits(stroke_mask)
+  num_cp_ext = len(_mask_bits(cp_mask))
+  chunks = [struct.pack('<3I', SKETCH_COOKIE, SKETCH_VERSION, 0),
+            struct.pack('<I', 0),  # additional header
+            struct.pack('<i', num_strokes)]
+  for i in xrange(num_strokes):
+    color = rand.uniform(0, 1, 4).astype('<f4')
+    color[3] = 1
+    chunks.append(struct.pack('<i', i % len(BRUSH_INDEX)))
+    chunks.append(color.tobytes())
+    chunks.append(struct.pack('<fII', rand.uniform(0.01, 0.5),
+                              stroke_mask, cp_mask))
+    for bit in stroke_bits:
+      if bit == 0x2:  # scale
+        chunks.append(struct.pack('<f', 1.0))
+      elif bit & 0xffff:
+        chunks.append(struct.pack('<I', i))
+      else:
+        chunks.append(struct.pack('<I', blob_size) + rand.bytes(blob_size))
+
+    # A random walk, with random unit quaternions
+    words = np.empty((num_points, 7 + num_cp_ext), dtype='<f4')
+    start = rand.uniform(-10, 10, 3)
+    words[:, :3] = start + np.cumsum(rand.normal(0, 0.01, (num_points, 3)), axis=0)
+    quat = rand.normal(0, 1, (num_points, 4))
+    words[:, 3:7] = quat / np.sqrt((quat ** 2).sum(axis=1))[:, None]
+    for (j, bit) in enumerate(_mask_bits(cp_mask)):
+      if bit == 0x1:  # pressure
+        words[:, 7 + j] = rand.uniform(0, 1, num_points)
+      else:           # timestamp, or unknown; both are uint32
+        words[:, 7 + j] = (1000 * i + np.arange(num_points)).astype('<u4').view('<f4')
+    chunks.append(struct.pack('<i', num_points))
+    chunks.append(words.tobytes())
+  return ''.join(chunks)
+
+
+def write_tilt(filename, num_strokes, num_points, compress=False, **kwargs):
+  """Writes a packed .tilt file; see make_sketch() for the other
+  arguments."""
+  metadata = {
+    'BrushIndex': BRUSH_INDEX,
+    'EnvironmentPreset': ENVIRONMENT_PRESET,
+  }
+  compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+  with file(filename, 'wb') as outf:
+    outf.write(struct.pack(HEADER_V1_FMT, 'tilT',
+                           struct.calcsize(HEADER_V1_FMT), 1, 0, 0))
+    with zipfile.ZipFile(outf, 'w', compression) as zf:
+      # Fixed timestamps, so that the output is deterministic
+      for (name, data) in [
+          ('metadata.json', json.dumps(metadata, indent=2, sort_keys=True)),
+          ('data.sketch', make_sketch(num_strokes, num_points, **kwargs))]:
+        info = zipfile.ZipInfo(name, (2016, 1, 1, 0, 0, 0))
+        info.compress_type = compression
+        zf.writestr(info, data)
+
+
+def _b64(arr, dtype):
+  return base64.b64encode(np.ascontiguousarray(arr, dtype=dtype).tobytes())
+
+
+def make_json_export(num_strokes, num_quads, seed=0):
+  """Returns the contents of a geometry .json export with *num_strokes*
+  ribbon strokes of *num_quads* quads each, using brushes from
+  BRUSH_INDEX in turn. Each quad adds about 170 bytes."""
+  rand = np.random.RandomState(seed)
+  brushes = [{ 'name': 'Brush%d' % i, 'guid': guid }
+             for (i, guid) in enumerate(BRUSH_INDEX)]
+  num_verts = 2 * (num_quads + 1)
+  a = 2 * np.arange(num_quads)
+  tri = np.column_stack([a, a + 1, a + 2, a + 1, a + 3, a + 2])
+  strokes = []
+  for i in xrange(num_strokes):
+    spine = rand.uniform(-10, 10, 3) + \
+            np.cumsum(rand.normal(0, 0.01, (num_quads + 1, 3)), axis=0)
+    v = np.repeat(spine, 2, axis=0)
+    v[1::2, 1] += 0.05
+    n = np.tile([0, 0, 1], (num_verts, 1))
+    uv0 = np.column_stack([np.repeat(np.linspace(0, 1, num_quads + 1), 2),
+                           np.tile([0, 1], num_quads + 1)])
+    c = np.empty(num_verts, dtype='<u4')
+    c[:] = rand.randint(0, 1 << 24) | 0xff000000
+    t = np.tile([1, 0, 0, 1], (num_verts, 1))
+    strokes.append({
+      'brush': i % len(brushes),
+      'v': _b64(v, '<f4'), 'n': _b64(n, '<f4'), 'uv0': _b64(uv0, '<f4'),
+      'c': _b64(c, '<u4'), 't': _b64(t, '<f4'), 'tri': _b64(tri, '<u4'),
+    })
+  return json.dumps({ 'brushes': brushes, 'strokes': strokes })
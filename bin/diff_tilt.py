@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Shows which strokes were added, removed, moved or modified between two
+# .tilt files, and which metadata changed. Like diff(1), exits with 0 if
+# the sketches are the same and 1 if they differ.
+
+import argparse
+import json
+import os
+import sys
+import zipfile
+
+try:
+  sys.path.append(os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'Python'))
+  from tiltbrush.diff import diff_sketches
+  from tiltbrush.tilt import BadTilt
+except ImportError:
+  print >>sys.stderr, "Please put the 'Python' directory in your PYTHONPATH"
+  sys.exit(1)
+
+
+def print_diff(diff):
+  for j in diff['added']:
+    print "+ stroke %d" % j
+  for i in diff['removed']:
+    print "- stroke %d" % i
+  for (i, j) in diff['moved']:
+    print "> stroke %d -> %d" % (i, j)
+  for m in diff['modified']:
+    print "~ stroke %d -> %d (%s)" % (m['a'], m['b'], ', '.join(m['changed']))
+  for (kind, keys) in sorted(diff['metadata'].items()):
+    for key in keys:
+      print "metadata %s: %s" % (kind, key)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compares the strokes and metadata of two .tilt files.")
+  parser.add_argument('old', help=".tilt file")
+  parser.add_argument('new', help=".tilt file")
+  parser.add_argument('--quiet', '-q', action='store_true',
+                      help="Only print the summary")
+  parser.add_argument('--json', metavar='FILE',
+                      help="Also write the diff here")
+  args = parser.parse_args()
+
+  try:
+    diff = diff_sketches(args.old, args.new)
+  except (BadTilt, EnvironmentError, zipfile.BadZipfile) as e:
+    print >>sys.stderr, "ERROR: %s" % e
+    return 2
+  if not args.quiet:
+    print_diff(diff)
+  if args.json:
+    with file(args.json, 'wb') as outf:
+      json.dump(diff, outf, indent=2, sort_keys=True)
+  print "%d -> %d strokes: %d unchanged (%d moved), %d modified, %d added, %d removed" % (
+    diff['strokes'][0], diff['strokes'][1], diff['unchanged'], len(diff['moved']),
+    len(diff['modified']), len(diff['added']), len(diff['removed']))
+  return 0 if diff['identical'] else 1
+
+
+if __name__ == '__main__':
+  sys.exit(main())
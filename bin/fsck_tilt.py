@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Checks .tilt files (packed or unpacked) for corruption without fully
+# loading them, and writes a json report. Exits with status 1 if any
+# file has problems.
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+try:
+  sys.path.append(os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'Python'))
+  from tiltbrush import fsck
+except ImportError:
+  print >>sys.stderr, "Please put the 'Python' directory in your PYTHONPATH"
+  sys.exit(1)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Checks .tilt files for corruption.")
+  parser.add_argument('paths', nargs='+',
+                      help=".tilt files, or directories to search for them")
+  parser.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count(),
+                      help="Number of files to check in parallel (default %(default)s)")
+  parser.add_argument('-o', dest='output', metavar='FILE',
+                      help="Write the json report here rather than to stdout")
+  parser.add_argument('--quiet', '-q', action='store_true',
+                      help="Don't list bad files on stderr")
+  args = parser.parse_args()
+
+  reports = []
+  for report in fsck.check_tilts(list(fsck.find_tilts(args.paths)), args.jobs):
+    reports.append(report)
+    if not report['ok'] and not args.quiet:
+      for problem in report['problems']:
+        print >>sys.stderr, "%s: %s: %s" % (
+          report['path'], problem['check'], problem['message'])
+
+  num_bad = sum(1 for r in reports if not r['ok'])
+  summary = {
+    'checked': len(reports),
+    'bad': num_bad,
+    'files': reports,
+  }
+  if args.output:
+    with file(args.output, 'wb') as outf:
+      json.dump(summary, outf, indent=2, sort_keys=True)
+  else:
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    print
+  if not args.quiet:
+    print >>sys.stderr, "Checked %d files, %d bad" % (len(reports), num_bad)
+  return 1 if num_bad else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -16,6 +16,9 @@
 
 # Historical sample code that converts Tilt Brush '.json' exports to .fbx.
 # This script is superseded by Tilt Brush native .fbx exports.
+#
+# It uses the Autodesk FBX Python SDK if it is installed, and otherwise
+# falls back to the tiltbrush.fbx writer, which requires numpy.
 # 
 # There are command-line options to fine-tune the fbx creation.
 # The defaults are:
@@ -25,6 +28,7 @@
 # - Don't create backface geometry for single-sided brushes"""
 
 import argparse
+from functools import partial
 from itertools import groupby
 import os
 import platform
@@ -33,14 +37,14 @@ import sys
 try:
   sys.path.append(os.path.join(os.path.dirname(os.path.dirname(
     os.path.abspath(__file__))), 'Python'))
-  from tiltbrush.export import iter_meshes, TiltBrushMesh, SINGLE_SIDED_FLAT_BRUSH
+  from tiltbrush.export import iter_meshes, map_brush_groups, TiltBrushMesh, SINGLE_SIDED_FLAT_BRUSH
 except ImportError:
   print >>sys.stderr, "Please put the 'Python' directory in your PYTHONPATH"
   sys.exit(1)
 
 arch = 'x64' if '64' in platform.architecture()[0] else 'x86'
 dir = 'c:/Program Files/Autodesk/FBX/FBX Python SDK'
-versions = sorted(os.listdir(dir), reverse=True)
+versions = sorted(os.listdir(dir), reverse=True) if os.path.isdir(dir) else []
 found = False
 for version in versions:
   path = '{0}/{1}/lib/Python27_{2}'.format(dir, version, arch)
@@ -53,8 +57,6 @@ for version in versions:
       print >>sys.stderr, "Failed trying to import fbx from {0}".format(path)
       sys.exit(1)
     break
-if not found:
-  print >>sys.stderr, "Please install the Python FBX SDK: http://www.autodesk.com/products/fbx/"
 
 # ----------------------------------------------------------------------
 # Utils
@@ -232,6 +234,40 @@ def add_mesh_to_scene(sdk, scene, mesh):
   root.AddChild(node)
 
 
+# ----------------------------------------------------------------------
+# Processing
+# ----------------------------------------------------------------------
+
+def clean(mesh, args):
+  mesh.remove_degenerate()
+  if args.add_backface and mesh.brush_guid in SINGLE_SIDED_FLAT_BRUSH:
+    mesh.add_backfaces()
+
+
+def cook(mesh, args):
+  if args.weld_verts:
+    # We don't write out tangents, so it's safe to ignore them when welding
+    if args.weld_eps:
+      mesh.weld(args.weld_eps, match=('uv0', 'uv1', 'c'))
+    else:
+      mesh.collapse_verts(ignore=('t',))
+      mesh.remove_degenerate()
+
+
+def process_brush_group(meshes, args):
+  """Cleans, merges and cooks the strokes of one brush; used with --jobs.
+  With --merge-stroke, the merged mesh is cooked later."""
+  for mesh in meshes:
+    clean(mesh, args)
+  if args.merge_stroke:
+    return [ TiltBrushMesh.from_meshes(meshes) ]
+  if args.merge_brush:
+    meshes = [ TiltBrushMesh.from_meshes(meshes, name='All %s' % (meshes[0].brush_name, )) ]
+  for mesh in meshes:
+    cook(mesh, args)
+  return meshes
+
+
 # ----------------------------------------------------------------------
 # main
 # ----------------------------------------------------------------------
@@ -253,10 +289,21 @@ def main():
                    help="(default) Weld vertices")
   grp.add_argument('--no-weld-verts', action='store_false', dest='weld_verts',
                    help="Turn off --weld-verts")
+  grp.add_argument('--weld-eps', type=float, metavar='DIST',
+                   help="Also weld verts closer than DIST (needs numpy)")
+
+  grp.add_argument('--lod', type=float, action='append', default=[], metavar='RATIO',
+                   help="Also emit a decimated copy of each mesh with RATIO of its triangles, named <name>_LOD<n> for Unity's LODGroup import. May be repeated (needs numpy)")
 
   parser.add_argument('--add-backface', action='store_true',
                    help="Add backfaces to strokes that don't have them")
 
+  parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                      help="Number of processes used to process brushes (needs numpy). Without --merge-brush, meshes end up ordered by brush.")
+
+  parser.add_argument('--native', action='store_true',
+                      help="Use the built-in .fbx writer even if the FBX SDK is installed (needs numpy)")
+
   parser.add_argument('-o', dest='output_filename', metavar='FILE',
                       help="Name of output file; defaults to <filename>.fbx")
   parser.set_defaults(merge_brush=True, weld_verts=True)
@@ -265,26 +312,48 @@ def main():
   if args.output_filename is None:
     args.output_filename = os.path.splitext(args.filename)[0] + '.fbx'
 
-  meshes = list(iter_meshes(args.filename))
-  for mesh in meshes:
-    mesh.remove_degenerate()
-    if args.add_backface and mesh.brush_guid in SINGLE_SIDED_FLAT_BRUSH:
-      mesh.add_backface()
+  native = args.native or not found
+  if native:
+    try:
+      from tiltbrush.fbx import write_fbx
+    except ImportError:
+      print >>sys.stderr, "Please install the Python FBX SDK: http://www.autodesk.com/products/fbx/"
+      print >>sys.stderr, "or numpy, to use the built-in .fbx writer"
+      sys.exit(1)
 
-  if args.merge_stroke:
-    meshes = [ TiltBrushMesh.from_meshes(meshes, name='strokes') ]
-  elif args.merge_brush:
-    def by_guid(m): return (m.brush_guid, m.brush_name)
-    meshes = [ TiltBrushMesh.from_meshes(list(group), name='All %s' % (key[1], ))
-               for (key, group) in groupby(sorted(meshes, key=by_guid), key=by_guid) ]
+  def by_guid(m): return (m.brush_guid, m.brush_name)
+  if args.jobs > 1:
+    meshes = map_brush_groups(args.filename,
+                              partial(process_brush_group, args=args),
+                              args.jobs)
+    if not native:
+      meshes = [ mesh.to_lists() for mesh in meshes ]
+    if args.merge_stroke:
+      meshes = [ TiltBrushMesh.from_meshes(meshes, name='strokes') ]
+      cook(meshes[0], args)
+    elif args.merge_brush:
+      meshes.sort(key=by_guid)
+  else:
+    meshes = list(iter_meshes(args.filename, arrays=native))
+    for mesh in meshes:
+      clean(mesh, args)
+
+    if args.merge_stroke:
+      meshes = [ TiltBrushMesh.from_meshes(meshes, name='strokes') ]
+    elif args.merge_brush:
+      meshes = [ TiltBrushMesh.from_meshes(list(group), name='All %s' % (key[1], ))
+                 for (key, group) in groupby(sorted(meshes, key=by_guid), key=by_guid) ]
 
-  if args.weld_verts:
     for mesh in meshes:
-      # We don't write out tangents, so it's safe to ignore them when welding
-      mesh.collapse_verts(ignore=('t',))
-      mesh.remove_degenerate()
+      cook(mesh, args)
+
+  if args.lod:
+    meshes = [ lod for mesh in meshes for lod in mesh.build_lods([1] + args.lod) ]
 
-  write_fbx_meshes(meshes, args.output_filename)
+  if native:
+    write_fbx(meshes, args.output_filename)
+  else:
+    write_fbx_meshes(meshes, args.output_filename)
   print "Wrote", args.output_filename
 
 
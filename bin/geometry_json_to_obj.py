@@ -24,76 +24,55 @@
 # - Should backfaces be kept or removed?
 # - Should vertices be welded? How aggressively?
 # 
-# This sample keeps backfaces, merges all strokes into a single mesh,
-# and does no vertex welding. It can also be easily customized to do any
-# of the above.
+# This sample keeps backfaces, merges all strokes into a single mesh
+# (or one group per brush, with --merge-brush), and does no vertex
+# welding. It can also be easily customized to do any of the above.
+# With --lod, each mesh is followed by decimated <name>_LOD<n> copies.
 
 import argparse
+from functools import partial
+from itertools import groupby
 import os
 import sys
 
 try:
   sys.path.append(os.path.join(os.path.dirname(os.path.dirname(
     os.path.abspath(__file__))), 'Python'))
-  from tiltbrush.export import iter_meshes, TiltBrushMesh, SINGLE_SIDED_FLAT_BRUSH
+  from tiltbrush.export import iter_meshes, map_brush_groups, TiltBrushMesh, SINGLE_SIDED_FLAT_BRUSH
 except ImportError:
   print >>sys.stderr, "Please put the 'Python' directory in your PYTHONPATH"
   sys.exit(1)
 
+try:
+  from tiltbrush.obj import write_obj
+except ImportError:
+  print >>sys.stderr, "Please install numpy"
+  sys.exit(1)
 
-def write_obj(mesh, outf_name, use_color):
-  """Emits a TiltBrushMesh as a .obj file.
-  If use_color, emit vertex color as a non-standard .obj extension."""
-  from cStringIO import StringIO
-  tmpf = StringIO()
 
-  if use_color:
-    for v, c32 in zip(mesh.v, mesh.c):
-      r = ( (c32 >> 0) & 0xff ) / 255.0
-      g = ( (c32 >> 8) & 0xff ) / 255.0
-      b = ( (c32 >>16) & 0xff ) / 255.0
-      tmpf.write("v %f %f %f %f %f %f\n" % (v[0], v[1], v[2], r, g, b))
-      tmpf.write("vc %f %f %f\n" % (r, g, b))
-  else:
-    for v in mesh.v:
-      tmpf.write("v %f %f %f\n" % v)
-
-  has_uv = any(uv is not None for uv in mesh.uv0)
-  if has_uv:
-    has_uv = True
-    for uv in mesh.uv0:
-      if uv is not None:
-        tmpf.write("vt %f %f\n" % (uv[0], uv[1]))
-      else:
-        tmpf.write("vt 0 0\n")
-
-  has_n = any(n is not None for n in mesh.n)
-  if has_n:
-    for n in mesh.n:
-      if n is not None:
-        tmpf.write("vn %f %f %f\n" % n)
-      else:
-        tmpf.write("vn 0 0 0\n")
-
-  if has_n and has_uv:
-    for (t1, t2, t3) in mesh.tri:
-      t1 += 1; t2 += 1; t3 += 1
-      tmpf.write("f %d/%d/%d %d/%d/%d %d/%d/%d\n" % (t1,t1,t1, t2,t2,t2, t3,t3,t3))
-  elif has_n:
-    for (t1, t2, t3) in mesh.tri:
-      t1 += 1; t2 += 1; t3 += 1
-      tmpf.write("f %d//%d %d//%d %d//%d\n" % (t1,t1, t2,t2, t3,t3))
-  elif has_uv:
-    for (t1, t2, t3) in mesh.tri:
-      t1 += 1; t2 += 1; t3 += 1
-      tmpf.write("f %d/%d %d/%d %d/%d\n" % (t1,t1, t2,t2, t3,t3))
-  else:
-    for (t1, t2, t3) in mesh.tri:
-      t1 += 1; t2 += 1; t3 += 1
-      tmpf.write("f %d %d %d\n" % (t1, t2, t3))
+def clean(mesh, args):
+  mesh.remove_degenerate()
+  if args.cooked and mesh.brush_guid in SINGLE_SIDED_FLAT_BRUSH:
+    mesh.add_backfaces()
+
+
+def cook(mesh, args):
+  if args.cooked:
+    if args.weld_eps:
+      mesh.weld(args.weld_eps)
+    else:
+      mesh.collapse_verts(ignore=('uv0', 'uv1', 'c', 't'))
+      mesh.remove_degenerate()
 
-  with file(outf_name, 'wb') as outf:
-    outf.write(tmpf.getvalue())
+
+def process_brush_group(meshes, args):
+  """Cleans and merges the strokes of one brush; used with --jobs."""
+  for mesh in meshes:
+    clean(mesh, args)
+  mesh = TiltBrushMesh.from_meshes(meshes, name='All %s' % (meshes[0].brush_name, ))
+  if args.merge_brush:
+    cook(mesh, args)
+  return [mesh]
 
 
 def main():
@@ -106,27 +85,46 @@ def main():
                       help="Add vertex color to 'v' and 'vc' elements. WARNING: May produce incompatible .obj files.")
   parser.add_argument('--raw', action='store_false', dest='cooked',
                       help="Emit geometry just as it comes from Tilt Brush. Depending on the brush, triangles may not have backfaces, adjacent triangles will mostly not share verts.")
+  parser.add_argument('--weld-eps', type=float, metavar='DIST',
+                      help="With --cooked, weld verts closer than DIST, rather than only identical verts")
+  parser.add_argument('--merge-brush', action='store_true',
+                      help="Emit one group per brush, with a .mtl file, instead of a single mesh")
+  parser.add_argument('--lod', type=float, action='append', default=[], metavar='RATIO',
+                      help="Also emit a decimated copy of each mesh with RATIO of its triangles, as a <name>_LOD<n> group. May be repeated.")
+  parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                      help="Number of processes used to process brushes and format the .obj. Without --merge-brush, vertices end up ordered by brush.")
   parser.add_argument('-o', dest='output_filename', metavar='FILE',
                       help="Name of output file; defaults to <filename>.obj")
   args = parser.parse_args()
   if args.output_filename is None:
     args.output_filename = os.path.splitext(args.filename)[0] + '.obj'
 
-  meshes = list(iter_meshes(args.filename))
-  for mesh in meshes:
-    mesh.remove_degenerate()
-
-  if args.cooked:
-    for mesh in meshes:
-      if mesh.brush_guid in SINGLE_SIDED_FLAT_BRUSH:
-        mesh.add_backfaces()
-    mesh = TiltBrushMesh.from_meshes(meshes)
-    mesh.collapse_verts(ignore=('uv0', 'uv1', 'c', 't'))
-    mesh.remove_degenerate()
+  def by_guid(m): return (m.brush_guid, m.brush_name)
+  if args.jobs > 1:
+    # One merged mesh per brush, already cooked if --merge-brush
+    meshes = sorted(map_brush_groups(args.filename,
+                                     partial(process_brush_group, args=args),
+                                     args.jobs),
+                    key=by_guid)
   else:
-    mesh = TiltBrushMesh.from_meshes(meshes)
-
-  write_obj(mesh, args.output_filename, args.color)
+    meshes = list(iter_meshes(args.filename, arrays=True))
+    for mesh in meshes:
+      clean(mesh, args)
+    if args.merge_brush:
+      meshes = [ TiltBrushMesh.from_meshes(list(group), name='All %s' % (key[1], ))
+                 for (key, group) in groupby(sorted(meshes, key=by_guid), key=by_guid) ]
+      for mesh in meshes:
+        cook(mesh, args)
+
+  if not args.merge_brush:
+    meshes = [ TiltBrushMesh.from_meshes(meshes) ]
+    cook(meshes[0], args)
+
+  if args.lod:
+    meshes = [ lod for mesh in meshes for lod in mesh.build_lods([1] + args.lod) ]
+
+  write_obj(meshes, args.output_filename, args.color,
+            groups=(args.merge_brush or bool(args.lod)), jobs=args.jobs)
   print "Wrote", args.output_filename
 
 
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Google Inc. All Rights Reserved.
+# 
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# 
+#     http://www.apache.org/licenses/LICENSE-2.0
+# 
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Splits a Tilt Brush '.json' export into an octree of .glb tiles, plus
+# a tiles.json manifest with each tile's bounds and error, so that a
+# viewer can fetch only the tiles it needs. The export is streamed; the
+# whole sketch is never held in memory.
+
+import argparse
+import os
+import sys
+
+try:
+  sys.path.append(os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'Python'))
+  import tiltbrush.export
+except ImportError:
+  print >>sys.stderr, "Please put the 'Python' directory in your PYTHONPATH"
+  sys.exit(1)
+
+try:
+  from tiltbrush import tiling
+except ImportError:
+  print >>sys.stderr, "Please install numpy"
+  sys.exit(1)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Converts Tilt Brush '.json' exports to a directory of .glb tiles.")
+  parser.add_argument('filename', help="Exported .json file to convert")
+  parser.add_argument('--max-tris', type=int, default=tiling.MAX_TILE_TRIS, metavar='N',
+                      help="Split tiles with more than N triangles (default %(default)s)")
+  parser.add_argument('--max-depth', type=int, default=tiling.MAX_DEPTH, metavar='N',
+                      help="Never split tiles more than N levels deep (default %(default)s)")
+  parser.add_argument('--weld-eps', type=float, metavar='DIST',
+                      help="Weld verts in each tile closer than DIST, rather than only identical verts")
+  parser.add_argument('-o', dest='output_dir', metavar='DIR',
+                      help="Name of output directory; defaults to <filename>_tiles")
+  args = parser.parse_args()
+  if args.output_dir is None:
+    args.output_dir = os.path.splitext(args.filename)[0] + '_tiles'
+  if not os.path.isdir(args.output_dir):
+    os.makedirs(args.output_dir)
+
+  manifest = tiling.tile_export(args.filename, args.output_dir,
+                                max_tris=args.max_tris,
+                                max_depth=args.max_depth,
+                                weld_eps=args.weld_eps)
+  if manifest is None:
+    print "No geometry in", args.filename
+  else:
+    print "Wrote", os.path.join(args.output_dir, tiling.MANIFEST_NAME)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Recompresses packed .tilt files in place, choosing stored or deflate
+# per member according to a policy, and reports the savings.
+
+import argparse
+import json
+import os
+import sys
+
+try:
+  sys.path.append(os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'Python'))
+  from tiltbrush import fsck, repack
+except ImportError:
+  print >>sys.stderr, "Please put the 'Python' directory in your PYTHONPATH"
+  sys.exit(1)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Recompresses packed .tilt files, choosing the encoding of each member separately.")
+  parser.add_argument('paths', nargs='+',
+                      help=".tilt files, or directories to search for them")
+  parser.add_argument('--policy', choices=repack.POLICIES, default='balanced',
+                      help="hot: store everything; balanced: deflate members that shrink by at least --min-saving; cold: smallest possible. Decode speed is approximated by stored vs deflate, not measured (default %(default)s)")
+  parser.add_argument('--min-saving', type=float, default=repack.MIN_SAVING, metavar='FRACTION',
+                      help="With --policy balanced, the fraction of a member's size that deflate must save (default %(default)s)")
+  parser.add_argument('--jobs', '-j', type=int, default=1,
+                      help="Number of files to repack at once (default %(default)s)")
+  parser.add_argument('--dry-run', '-n', action='store_true',
+                      help="Report the savings without rewriting anything")
+  parser.add_argument('--json', metavar='FILE',
+                      help="Also write the per-file reports here")
+  args = parser.parse_args()
+
+  filenames = [f for f in fsck.find_tilts(args.paths) if not os.path.isdir(f)]
+  reports = []
+  (before, after, num_errors) = (0, 0, 0)
+  for report in repack.repack_tilts(filenames, args.jobs, policy=args.policy,
+                                    min_saving=args.min_saving,
+                                    dry_run=args.dry_run):
+    reports.append(report)
+    if 'error' in report:
+      num_errors += 1
+      print "ERROR: %s" % report['error']
+      continue
+    before += report['before']
+    after += report['after']
+    if report['after'] != report['before']:
+      print "%s: %d -> %d bytes (%s)" % (
+        report['path'], report['before'], report['after'],
+        ', '.join('%s %s' % (m['name'], m['new'])
+                  for m in report['members'] if not m['copied']))
+
+  if args.json:
+    with file(args.json, 'wb') as outf:
+      json.dump(reports, outf, indent=2, sort_keys=True)
+  saved = before - after
+  print "%s%d files: %d -> %d bytes, saved %d (%.1f%%)" % (
+    "(dry run) " if args.dry_run else "", len(reports) - num_errors,
+    before, after, saved, 100.0 * saved / max(before, 1))
+  return 1 if num_errors else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
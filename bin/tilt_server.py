@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs a local HTTP service that converts .tilt files and geometry .json
+# exports, using a pool of warm worker processes. For example:
+#   tilt_server.py --port 8000 &
+#   curl --data-binary @sketch.tilt http://localhost:8000/tilt/glb > sketch.glb
+
+import argparse
+import os
+import sys
+
+try:
+  sys.path.append(os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'Python'))
+  from tiltbrush import server
+except ImportError:
+  print >>sys.stderr, "Please put the 'Python' directory in your PYTHONPATH"
+  sys.exit(1)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Serves .tilt and .json export conversions over HTTP.")
+  parser.add_argument('--host', default='localhost',
+                      help="Address to listen on (default %(default)s)")
+  parser.add_argument('--port', type=int, default=server.DEFAULT_PORT,
+                      help="Port to listen on (default %(default)s)")
+  parser.add_argument('--workers', type=int, default=None,
+                      help="Number of worker processes (default: one per cpu)")
+  parser.add_argument('--max-queue', type=int, default=server.MAX_QUEUE, metavar='N',
+                      help="Requests that may wait for a worker before the rest get 503 (default %(default)s)")
+  parser.add_argument('--timeout', type=float, default=server.REQUEST_TIMEOUT, metavar='SECS',
+                      help="Give up on a request after this long (default %(default)s)")
+  parser.add_argument('--verbose', '-v', action='store_true',
+                      help="Log each request")
+  args = parser.parse_args()
+  server.serve(args.host, args.port, workers=args.workers,
+               max_queue=args.max_queue, timeout_secs=args.timeout,
+               verbose=args.verbose)
+
+
+if __name__ == '__main__':
+  main()
@@ -26,17 +26,27 @@ except ImportError:
   sys.exit(1)
 
 
-def convert(in_name, compress):
+def convert(in_name, compress, compresslevel=tiltbrush.unpack.DEFAULT_COMPRESSLEVEL,
+            threads=None):
   if os.path.isdir(in_name):
-    tiltbrush.unpack.convert_dir_to_zip(in_name, compress)
-    print "Converted %s to zip format" % in_name
+    tiltbrush.unpack.convert_dir_to_zip(in_name, compress, compresslevel=compresslevel,
+                                        threads=threads)
+    return "Converted %s to zip format" % in_name
   elif os.path.isfile(in_name):
-    tiltbrush.unpack.convert_zip_to_dir(in_name)
-    print "Converted %s to directory format" % in_name
+    tiltbrush.unpack.convert_zip_to_dir(in_name, threads=threads)
+    return "Converted %s to directory format" % in_name
   else:
     raise tiltbrush.unpack.ConversionError("%s doesn't exist" % in_name)
 
 
+def convert_job((in_name, compress, compresslevel, threads)):
+  """Runs convert() in a worker process. Returns a line to print."""
+  try:
+    return convert(in_name, compress, compresslevel, threads)
+  except tiltbrush.unpack.ConversionError as e:
+    return "ERROR: %s" % e
+
+
 def main():
   import argparse
   parser = argparse.ArgumentParser(description="Converts .tilt files from packed format (zip) to unpacked format (directory), optionally applying compression.")
@@ -44,12 +54,30 @@ def main():
                       help="Files to convert to the other format")
   parser.add_argument('--compress', action='store_true',
                       help="Use compression (default: off)")
+  parser.add_argument('--compress-level', type=int, choices=range(10),
+                      default=tiltbrush.unpack.DEFAULT_COMPRESSLEVEL, metavar='N',
+                      help="zlib compression level, 0-9 (default: zlib's default)")
+  parser.add_argument('--jobs', '-j', type=int, default=1,
+                      help="Number of files to convert at once (default %(default)s)")
   args = parser.parse_args()
-  for arg in args.files:
-    try:
-      convert(arg, args.compress)
-    except tiltbrush.unpack.ConversionError as e:
-      print "ERROR: %s" % e
+  if args.jobs <= 1:
+    for arg in args.files:
+      print convert_job((arg, args.compress, args.compress_level, None))
+    return
+
+  import multiprocessing
+  # Leave the cpus to the processes, rather than to threads within them
+  threads = max(1, multiprocessing.cpu_count() // args.jobs)
+  pool = multiprocessing.Pool(args.jobs)
+  try:
+    for line in pool.imap_unordered(
+        convert_job,
+        [(arg, args.compress, args.compress_level, threads) for arg in args.files]):
+      print line
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,106 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks import memory, run, synthetic
+from tiltbrush.export import iter_meshes
+from tiltbrush.tilt import Tilt
+
+
+class TestSynthetic(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_deterministic(self):
+    self.assertEqual(synthetic.make_sketch(5, 10, blob_size=8),
+                     synthetic.make_sketch(5, 10, blob_size=8))
+    self.assertNotEqual(synthetic.make_sketch(5, 10),
+                        synthetic.make_sketch(5, 10, seed=1))
+    self.assertEqual(synthetic.make_json_export(3, 4),
+                     synthetic.make_json_export(3, 4))
+
+  def test_tilt_round_trip(self):
+    filename = os.path.join(self.tmpdir, 'sketch.tilt')
+    synthetic.write_tilt(filename, 6, 20, stroke_mask=0xf, blob_size=8)
+    tilt = Tilt(filename)
+    strokes = tilt.sketch.strokes
+    self.assertEqual(len(strokes), 6)
+    self.assertEqual(strokes[3].brush_idx, 3)
+    self.assertEqual(strokes[3].scale, 1.0)
+    self.assertEqual(len(strokes[3].extension[-1]), 8)
+    self.assertEqual(len(strokes[3].controlpoints), 20)
+    self.assertEqual(strokes[3].controlpoints[5].extension[1], 3005)
+    # Blob extensions survive a write
+    data = synthetic.make_sketch(6, 20, stroke_mask=0xf, blob_size=8)
+    with tilt.subfile_reader('data.sketch') as inf:
+      self.assertEqual(inf.read(), data)
+    tilt.write_sketch()
+    with tilt.subfile_reader('data.sketch') as inf:
+      self.assertEqual(inf.read(), data)
+
+  def test_json_export(self):
+    filename = os.path.join(self.tmpdir, 'export.json')
+    with open(filename, 'wb') as outf:
+      outf.write(synthetic.make_json_export(5, 10))
+    meshes = list(iter_meshes(filename, arrays=True))
+    self.assertEqual(len(meshes), 5)
+    self.assertEqual(meshes[4].brush_guid, meshes[0].brush_guid)
+    self.assertEqual(meshes[0].v.shape, (22, 3))
+    self.assertEqual(meshes[0].tri.shape, (20, 3))
+
+
+class TestRun(unittest.TestCase):
+  def test_compare(self):
+    baseline = { 'tilt_open': { 'best': 1.0 }, 'sketch_parse': { 'best': 1.0 },
+                 'controlpoints': { 'best': 1.0 }, 'pack_tilt': { 'best': 0.001 } }
+    results = { 'tilt_open': { 'best': 1.2 }, 'sketch_parse': { 'best': 0.8 },
+                'controlpoints': { 'best': 1.05 }, 'pack_tilt': { 'best': 0.002 },
+                'unpack_tilt': { 'best': 1.0 } }
+    rows = run.compare(baseline, results, 0.1)
+    self.assertEqual([(r[0], r[4]) for r in rows],
+                     [('tilt_open', 'regression'), ('sketch_parse', 'faster'),
+                      ('controlpoints', 'ok'), ('pack_tilt', 'ok')])
+
+  def test_run(self):
+    results = run.run_benchmarks({ 'strokes': 4, 'points': 5, 'quads': 3 },
+                                 repeat=2, only=['write_sketch', 'write_obj_file'])
+    self.assertEqual(sorted(results), ['write_obj_file', 'write_sketch'])
+    self.assertEqual(len(results['write_sketch']['times']), 2)
+
+
+class TestMemory(unittest.TestCase):
+  def test_run(self):
+    results = memory.run_memory_benchmarks(
+      { 'strokes': 8, 'points': 50, 'quads': 20 })
+    self.assertEqual(sorted(results), sorted(n for (n, _) in memory.REPRESENTATIONS))
+    self.assertEqual(results['tilt_objects']['items'], 400)
+    self.assertEqual(results['tilt_columnar']['items'], 400)
+    self.assertEqual(results['export_arrays']['items'], 8 * 42)
+    self.assertGreater(results['tilt_objects']['bytes_per_item'],
+                       results['tilt_lazy']['bytes_per_item'])
+    self.assertGreater(results['export_lists']['bytes_per_item'],
+                       results['export_arrays']['bytes_per_item'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,89 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+
+from tiltbrush import diff
+from tiltbrush.tilt import Tilt
+
+SKETCH1 = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'data', 'sketch1.tilt')
+
+
+def load():
+  with open(SKETCH1, 'rb') as inf:
+    return Tilt.from_bytes(inf.read())
+
+
+def edited(edit):
+  tilt = load()
+  edit(tilt)
+  tilt.write_sketch()
+  return Tilt.from_bytes(tilt.to_bytes())
+
+
+class TestDiff(unittest.TestCase):
+  def test_identical(self):
+    result = diff.diff_sketches(SKETCH1, load())
+    self.assertTrue(result['identical'])
+    self.assertEqual(result['unchanged'], 5)
+
+  def test_digest_doesnt_need_decode(self):
+    (lazy, decoded) = (load(), load())
+    for stroke in decoded.sketch.strokes:
+      stroke.controlpoints
+    self.assertEqual(
+      [diff.stroke_digest(s) for s in lazy.sketch.strokes],
+      [diff.stroke_digest(s) for s in decoded.sketch.strokes])
+    self.assertTrue(all('controlpoints' not in s.__dict__ for s in lazy.sketch.strokes))
+
+  def test_strokes(self):
+    def edit(tilt):
+      strokes = tilt.sketch.strokes
+      strokes[1].brush_color = (1, 0, 0, 1)
+      strokes[2].controlpoints[0].position = [0, 0, 0]
+      added = strokes[0].clone()
+      added.controlpoints = added.controlpoints[:2]
+      added.brush_color = (0, 1, 0, 1)
+      # Was 0 1 2 3 4
+      tilt.sketch.strokes = [strokes[1], strokes[2], strokes[3], strokes[0], added]
+    result = diff.diff_sketches(SKETCH1, edited(edit))
+    self.assertFalse(result['identical'])
+    self.assertEqual(result['strokes'], [5, 5])
+    self.assertEqual(result['unchanged'], 2)
+    self.assertEqual(result['moved'], [[0, 3]])
+    self.assertEqual(result['modified'], [
+      { 'a': 1, 'b': 0, 'changed': ['color'] },
+      { 'a': 2, 'b': 1, 'changed': ['controlpoints'] }])
+    self.assertEqual(result['added'], [4])
+    self.assertEqual(result['removed'], [4])
+
+  def test_metadata(self):
+    tilt = load()
+    with tilt.mutable_metadata() as dct:
+      dct['SchemaVersion'] = 1
+      dct['Guides'].append(dct['Guides'][0] if dct['Guides'] else {})
+      del dct['Models']
+    tilt = Tilt.from_bytes(tilt.to_bytes())
+    result = diff.diff_sketches(SKETCH1, tilt)
+    self.assertEqual(result['metadata'], { 'added': ['SchemaVersion'],
+                                           'removed': ['Models'],
+                                           'changed': ['Guides'] })
+    self.assertEqual(result['unchanged'], 5)
+    self.assertFalse(result['identical'])
+
+
+if __name__ == '__main__':
+  unittest.main()
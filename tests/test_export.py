@@ -0,0 +1,414 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import contextlib
+import copy
+import json
+import math
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from tiltbrush import export
+from tiltbrush.export import iter_meshes, TiltBrushMesh
+
+BRUSHES = [
+  { 'name': 'Light', 'guid': '2241cd32-8ba2-48a5-9ee7-2caef7e9ed62' },
+  { 'name': 'Ink',   'guid': 'f5c336cf-5108-4b40-ade9-c687504385ab' },
+]
+
+
+def _b64(fmt, values):
+  return base64.b64encode(struct.pack('<%d%s' % (len(values), fmt), *values))
+
+
+def make_json_stroke(brush, num_quads, offset=0.0):
+  """Returns the json dict for a strip of *num_quads* quads."""
+  v, n, uv0, c, tri = [], [], [], [], []
+  for i in range(num_quads + 1):
+    for j in range(2):
+      v += [offset + i, float(j), 0.0]
+      n += [0.0, 0.0, 1.0]
+      uv0 += [i / float(num_quads), float(j)]
+      c.append(0xff000000 | (i * 16 + j))
+  for i in range(num_quads):
+    a = 2 * i
+    tri += [a, a + 1, a + 2,  a + 1, a + 3, a + 2]
+  return { 'brush': brush,
+           'v': _b64('f', v), 'n': _b64('f', n), 'uv0': _b64('f', uv0),
+           'c': _b64('I', c), 'tri': _b64('I', tri) }
+
+
+def make_json_export(num_strokes=6, num_quads=4, brushes_first=True):
+  strokes = [make_json_stroke(i % len(BRUSHES), num_quads, offset=10.0 * i)
+             for i in range(num_strokes)]
+  items = [('brushes', BRUSHES), ('strokes', strokes)]
+  if not brushes_first:
+    items.reverse()
+  # Build by hand to control key order
+  return '{%s}' % ', '.join('%s: %s' % (json.dumps(k), json.dumps(v, indent=1))
+                            for (k, v) in items)
+
+
+@contextlib.contextmanager
+def json_export_file(contents):
+  tmpdir = tempfile.mkdtemp()
+  try:
+    filename = os.path.join(tmpdir, 'export.json')
+    with open(filename, 'wb') as outf:
+      outf.write(contents)
+    yield filename
+  finally:
+    shutil.rmtree(tmpdir)
+
+
+def load_meshes_eagerly(filename):
+  """The non-streaming equivalent of iter_meshes()."""
+  from uuid import UUID
+  obj = json.load(open(filename, 'rb'))
+  lookup = obj['brushes']
+  for dct in lookup:
+    dct['guid'] = UUID(dct['guid'])
+  return [TiltBrushMesh._from_json(s, lookup) for s in obj['strokes']]
+
+
+class TestIterMeshes(unittest.TestCase):
+  def assertSameMeshes(self, meshes, expected):
+    self.assertEqual(len(meshes), len(expected))
+    for (m, e) in zip(meshes, expected):
+      self.assertEqual(m.brush_guid, e.brush_guid)
+      for attr in ('v', 'n', 'uv0', 'uv1', 'c', 't', 'tri'):
+        self.assertEqual(getattr(m, attr), getattr(e, attr))
+
+  def test_matches_json_load(self):
+    with json_export_file(make_json_export()) as filename:
+      self.assertSameMeshes(list(iter_meshes(filename)),
+                            load_meshes_eagerly(filename))
+
+  def test_small_chunks(self):
+    # Force values to straddle buffer boundaries
+    old_size = export._JsonStream.CHUNK_SIZE
+    export._JsonStream.CHUNK_SIZE = 7
+    try:
+      with json_export_file(make_json_export()) as filename:
+        self.assertSameMeshes(list(iter_meshes(filename)),
+                              load_meshes_eagerly(filename))
+    finally:
+      export._JsonStream.CHUNK_SIZE = old_size
+
+  def test_strokes_before_brushes(self):
+    with json_export_file(make_json_export(brushes_first=False)) as filename:
+      self.assertSameMeshes(list(iter_meshes(filename)),
+                            load_meshes_eagerly(filename))
+
+  def test_truncated(self):
+    with json_export_file(make_json_export()[:-100]) as filename:
+      self.assertRaises(ValueError, lambda: list(iter_meshes(filename)))
+
+
+class TestArrayMeshes(unittest.TestCase):
+  def setUp(self):
+    self.tmp = json_export_file(make_json_export())
+    self.filename = self.tmp.__enter__()
+
+  def tearDown(self):
+    self.tmp.__exit__(None, None, None)
+
+  def assertSameLists(self, mesh, expected):
+    self.assertFalse(mesh.uses_arrays)
+    for attr in ('v', 'n', 'uv0', 'uv1', 'c', 't', 'tri'):
+      self.assertEqual(getattr(mesh, attr), getattr(expected, attr))
+
+  def test_array_attributes(self):
+    import numpy as np
+    mesh = next(iter_meshes(self.filename, arrays=True))
+    self.assertTrue(mesh.uses_arrays)
+    self.assertEqual(mesh.v.shape, (10, 3))
+    self.assertEqual(mesh.v.dtype, np.float32)
+    self.assertEqual(mesh.uv0.shape, (10, 2))
+    self.assertEqual(mesh.c.shape, (10,))
+    self.assertEqual(mesh.c.dtype, np.uint32)
+    self.assertEqual(mesh.tri.shape, (8, 3))
+    self.assertIsNone(mesh.uv1)
+    self.assertIsNone(mesh.t)
+
+  def test_to_lists(self):
+    expected = list(iter_meshes(self.filename))
+    actual = [m.to_lists() for m in iter_meshes(self.filename, arrays=True)]
+    for (m, e) in zip(actual, expected):
+      self.assertSameLists(m, e)
+
+  def test_round_trip(self):
+    for mesh in iter_meshes(self.filename):
+      expected = copy.deepcopy(mesh)
+      self.assertTrue(mesh.to_arrays().uses_arrays)
+      self.assertSameLists(mesh.to_lists(), expected)
+
+  def test_merge_and_collapse(self):
+    # Array-backed meshes give the same results as list-backed ones
+    meshes = list(iter_meshes(self.filename, arrays=True))
+    merged = TiltBrushMesh.from_meshes(meshes)
+    self.assertTrue(merged.uses_arrays)
+    merged.collapse_verts(ignore=('uv0', 'c'))
+    self.assertTrue(merged.uses_arrays)
+    expected = TiltBrushMesh.from_meshes(iter_meshes(self.filename))
+    expected.collapse_verts(ignore=('uv0', 'c'))
+    self.assertSameLists(merged.to_lists(), expected)
+
+  def test_merge_mixed_attributes(self):
+    import numpy as np
+    meshes = list(iter_meshes(self.filename, arrays=True))[:3]
+    meshes[1].uv0 = None
+    meshes[2].uv0 = np.ones((10, 3), dtype=np.float32)
+    merged = TiltBrushMesh.from_meshes(meshes)
+    self.assertEqual(merged.uv0.shape, (30, 3))
+    self.assertEqual(merged.uv0[:10, :2].tolist(), meshes[0].uv0.tolist())
+    self.assertEqual(merged.uv0[:20, 2].tolist(), [0] * 20)
+    self.assertEqual(merged.uv0[10:20, :2].tolist(), [[0, 0]] * 10)
+    self.assertEqual(merged.uv0[20:].tolist(), [[1, 1, 1]] * 10)
+    self.assertEqual(merged.tri[-1].tolist(), (meshes[2].tri[-1] + 20).tolist())
+
+  def test_merge_other_index_types(self):
+    import numpy as np
+    meshes = list(iter_meshes(self.filename, arrays=True))[:2]
+    meshes[1].tri = meshes[1].tri.astype(np.int64)
+    merged = TiltBrushMesh.from_meshes(meshes)
+    self.assertEqual(merged.tri.dtype, np.uint32)
+    self.assertEqual(merged.tri[8:].tolist(), (meshes[1].tri + 10).tolist())
+
+  def test_collapse_duplicates(self):
+    # Backfaces duplicate every vert; welding without normals merges them
+    def collapsed(mesh):
+      mesh = TiltBrushMesh.from_meshes([mesh])
+      mesh.add_backfaces()
+      mesh.collapse_verts(ignore=('n',))
+      return mesh
+    for (m, e) in zip(iter_meshes(self.filename, arrays=True),
+                      iter_meshes(self.filename)):
+      m, e = collapsed(m), collapsed(e)
+      self.assertEqual(len(m.v), 10)
+      self.assertSameLists(m.to_lists(), e)
+
+  def test_triangle_passes(self):
+    def cleaned(mesh):
+      mesh = TiltBrushMesh.from_meshes([mesh, mesh])
+      mesh.remove_degenerate()
+      mesh.add_backfaces()
+      mesh.collapse_verts(ignore=('n',))
+      mesh.remove_backfaces()
+      return mesh
+    for (m, e) in zip(iter_meshes(self.filename, arrays=True),
+                      iter_meshes(self.filename)):
+      m.tri = m.tri.copy()
+      m.tri[3] = (1, 1, 2)
+      e.tri[3] = (1, 1, 2)
+      e, m = cleaned(e), cleaned(m)
+      self.assertEqual(len(m.tri), 7)
+      self.assertSameLists(m.to_lists(), e)
+
+  def test_add_backfaces_if_necessary(self):
+    for mesh in iter_meshes(self.filename, arrays=True):
+      self.assertTrue(mesh.add_backfaces_if_necessary())
+      self.assertEqual(len(mesh.tri), 16)
+      self.assertFalse(mesh.add_backfaces_if_necessary())
+      self.assertEqual(len(mesh.tri), 16)
+
+  def test_collapse_negative_zero(self):
+    mesh = TiltBrushMesh()
+    mesh.v = [(0.0, 1.0, 2.0), (-0.0, 1.0, 2.0), (3.0, 1.0, 2.0)]
+    mesh.n = mesh.uv0 = mesh.uv1 = mesh.c = mesh.t = [None] * 3
+    mesh.tri = [(2, 1, 0), (1, 0, 2)]
+    expected = copy.deepcopy(mesh)
+    expected.collapse_verts()
+    mesh.to_arrays().collapse_verts()
+    self.assertEqual(len(mesh.v), 2)
+    self.assertSameLists(mesh.to_lists(), expected)
+
+  def test_collapse_empty_stroke(self):
+    empty = dict((attr, '') for attr in ('v', 'n', 'uv0', 'c', 'tri'))
+    empty['brush'] = 0
+    contents = json.dumps({ 'brushes': BRUSHES, 'strokes': [empty] })
+    with json_export_file(contents) as filename:
+      (mesh,) = iter_meshes(filename, arrays=True)
+      (expected,) = iter_meshes(filename)
+    self.assertEqual(mesh.v.shape, (0, 3))
+    mesh.collapse_verts()
+    expected.collapse_verts()
+    self.assertSameLists(mesh.to_lists(), expected)
+
+class TestWeld(unittest.TestCase):
+  def make_mesh(self):
+    mesh = TiltBrushMesh()
+    mesh.v = [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0),
+              (1e-5, 0.0, 0.0), (0.0, 1.0, 1e-5), (1.0, 1.0, 0.0)]
+    mesh.n = [(0.0, 0.0, 1.0)] * 5 + [(0.0, 1.0, 0.0)]
+    mesh.c = [1, 1, 1, 1, 2, 1]
+    mesh.uv0 = mesh.uv1 = mesh.t = [None] * 6
+    mesh.tri = [(0, 1, 2), (3, 5, 4), (0, 3, 1)]
+    return mesh
+
+  def test_weld(self):
+    mesh = self.make_mesh()
+    mesh.weld(1e-4)
+    self.assertEqual(len(mesh.v), 4)
+    self.assertEqual(mesh.v[3], (1.0, 1.0, 0.0))
+    # (0, 3, 1) collapses to a degenerate triangle and is removed
+    self.assertEqual(mesh.tri, [(0, 1, 2), (0, 3, 2)])
+
+  def test_weld_tolerances(self):
+    mesh = self.make_mesh()
+    mesh.weld(1e-6)
+    self.assertEqual(len(mesh.v), 6)
+    mesh = self.make_mesh()
+    mesh.weld(1e-4, match=('c',))
+    self.assertEqual(len(mesh.v), 5)
+
+  def test_weld_normals(self):
+    mesh = self.make_mesh()
+    mesh.v[5] = (1e-5, 1e-5, 0.0)
+    mesh.weld(1e-4, normal_angle_eps=0.1)
+    self.assertEqual(len(mesh.v), 4)
+    self.assertEqual(mesh.n[3], (0.0, 1.0, 0.0))
+
+  def test_weld_cell_boundary(self):
+    mesh = self.make_mesh()
+    mesh.v = [(0.0999, 0.0, 0.0), (0.1001, 0.0, 0.0), (0.5, 0.0, 0.0)] * 2
+    mesh.weld(0.1)
+    self.assertEqual(len(mesh.v), 2)
+    self.assertEqual(mesh.tri, [])
+
+  def test_weld_empty(self):
+    import numpy as np
+    mesh = TiltBrushMesh()
+    mesh.v = np.zeros((0, 3), dtype=np.float32)
+    mesh.c = np.zeros(0, dtype=np.uint32)
+    mesh.tri = np.zeros((0, 3), dtype=np.uint32)
+    mesh.weld(1e-4, normal_angle_eps=0.1, match=('c',))
+    self.assertEqual((mesh.v.shape, mesh.c.shape, mesh.tri.shape),
+                     ((0, 3), (0,), (0, 3)))
+
+
+def merge_group(meshes):
+  """Top-level so that it can be run in a process pool."""
+  return [TiltBrushMesh.from_meshes(meshes, name=meshes[0].brush_name)]
+
+
+class TestMapBrushGroups(unittest.TestCase):
+  def test_groups(self):
+    with json_export_file(make_json_export(brushes_first=False)) as filename:
+      meshes = export.map_brush_groups(filename, merge_group)
+      self.assertEqual([m.name for m in meshes], ['Light', 'Ink'])
+      expected = TiltBrushMesh.from_meshes(
+        [m for m in iter_meshes(filename, arrays=True) if m.brush_name == 'Ink'])
+      self.assertEqual(meshes[1].to_lists().v, expected.to_lists().v)
+
+  def test_jobs(self):
+    old_size = export.HANDOFF_MIN_BYTES
+    export.HANDOFF_MIN_BYTES = 64
+    try:
+      with json_export_file(make_json_export(num_strokes=12)) as filename:
+        expected = export.map_brush_groups(filename, merge_group)
+        actual = export.map_brush_groups(filename, merge_group, jobs=2)
+    finally:
+      export.HANDOFF_MIN_BYTES = old_size
+    self.assertEqual(len(actual), len(expected))
+    for (m, e) in zip(actual, expected):
+      self.assertEqual((m.name, m.brush_guid), (e.name, e.brush_guid))
+      self.assertFalse(m.v.flags.writeable)
+      self.assertEqual(m.to_lists().v, e.to_lists().v)
+      self.assertEqual(m.tri, e.to_lists().tri)
+
+
+def make_grid_mesh(size, height=lambda x, y: 0.0):
+  """Returns a list-backed size x size grid of quads in the xy plane."""
+  mesh = TiltBrushMesh()
+  n = size + 1
+  mesh.v = [(float(x), float(y), height(x, y)) for y in range(n) for x in range(n)]
+  mesh.n = [(0.0, 0.0, 1.0)] * len(mesh.v)
+  mesh.c = [1] * len(mesh.v)
+  mesh.uv0 = mesh.uv1 = mesh.t = [None] * len(mesh.v)
+  mesh.tri = []
+  for y in range(size):
+    for x in range(size):
+      i = y * n + x
+      mesh.tri += [(i, i + 1, i + n), (i + 1, i + n + 1, i + n)]
+  return mesh
+
+
+class TestDecimate(unittest.TestCase):
+  def test_target_ratio(self):
+    mesh = make_grid_mesh(8)
+    error = mesh.decimate(0.25)
+    self.assertFalse(mesh.uses_arrays)
+    self.assertLessEqual(len(mesh.tri), 32)
+    self.assertLess(error, 1e-9)
+    # Boundary corners survive, and every vert is used
+    for corner in [(0, 0, 0), (8, 0, 0), (0, 8, 0), (8, 8, 0)]:
+      self.assertIn(corner, mesh.v)
+    self.assertEqual(sorted(set(i for t in mesh.tri for i in t)),
+                     range(len(mesh.v)))
+
+  def test_curved(self):
+    import numpy as np
+    # Takes many rounds of collapses
+    mesh = make_grid_mesh(30, lambda x, y: math.sin(x * 0.3) * math.cos(y * 0.2))
+    mesh.to_arrays()
+    error = mesh.decimate(0.1)
+    self.assertLessEqual(len(mesh.tri), 180)
+    self.assertGreater(len(mesh.tri), 170)
+    self.assertLess(error, 1.0)
+    # Nothing is flipped over
+    (p0, p1, p2) = (mesh.v[mesh.tri[:, i]] for i in range(3))
+    self.assertTrue((np.cross(p1 - p0, p2 - p0)[:, 2] > 0).all())
+
+  def test_max_error(self):
+    def bumpy(x, y): return 0.5 if (x, y) == (4, 4) else 0.0
+    mesh = make_grid_mesh(8, bumpy)
+    mesh.decimate(max_error=1e-3)
+    # The flat part is simplified, but the bump is kept
+    self.assertLess(len(mesh.tri), 128)
+    self.assertIn((4.0, 4.0, 0.5), mesh.v)
+    self.assertRaises(ValueError, mesh.decimate)
+
+  def test_seams(self):
+    # Two grids with different colors, meeting along x == 4; verts on
+    # the seam are split
+    mesh = make_grid_mesh(4)
+    other = make_grid_mesh(4)
+    other.v = [(x + 4, y, z) for (x, y, z) in other.v]
+    other.c = [2] * len(other.v)
+    mesh = TiltBrushMesh.from_meshes([mesh, other])
+    mesh.decimate(0.25)
+    self.assertLessEqual(len(mesh.tri), 16)
+    for y in range(5):
+      self.assertEqual(mesh.v.count((4.0, float(y), 0.0)), 2)
+
+  def test_build_lods(self):
+    mesh = make_grid_mesh(8)
+    mesh.name = 'grid'
+    lods = mesh.build_lods([1, 0.5, 0.25])
+    self.assertEqual([lod.name for lod in lods],
+                     ['grid_LOD0', 'grid_LOD1', 'grid_LOD2'])
+    self.assertEqual([len(lod.tri) <= n for (lod, n) in zip(lods, (128, 64, 32))],
+                     [True] * 3)
+    self.assertEqual(len(lods[0].tri), 128)
+    # The original is untouched
+    self.assertEqual((mesh.name, len(mesh.tri)), ('grid', 128))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,189 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import zlib
+
+import numpy as np
+
+from tiltbrush import fbx
+from tiltbrush.export import iter_meshes
+
+from test_export import json_export_file, make_json_export
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), 'UnitySDK', 'Assets', 'Editor', 'Tests')
+
+SCALARS = { 'C': '<B', 'Y': '<h', 'I': '<i', 'F': '<f', 'D': '<d', 'L': '<q' }
+ARRAYS = { 'f': '<f4', 'd': '<f8', 'i': '<i4', 'l': '<i8', 'b': '<b1' }
+
+
+def read_fbx_nodes(data, pos, end):
+  """Returns a list of (name, props, children) for the nodes in data[pos:end]."""
+  nodes = []
+  while pos < end:
+    (node_end, num_props, _, name_len) = struct.unpack_from('<IIIB', data, pos)
+    if node_end == 0:
+      break
+    pos += 13
+    name = data[pos : pos + name_len]
+    pos += name_len
+    props = []
+    for _ in range(num_props):
+      code = data[pos]
+      pos += 1
+      if code in SCALARS:
+        props.append(struct.unpack_from(SCALARS[code], data, pos)[0])
+        pos += struct.calcsize(SCALARS[code])
+      elif code in ARRAYS:
+        (_, encoding, length) = struct.unpack_from('<III', data, pos)
+        raw = data[pos + 12 : pos + 12 + length]
+        if encoding == 1:
+          raw = zlib.decompress(raw)
+        props.append(np.frombuffer(raw, dtype=ARRAYS[code]))
+        pos += 12 + length
+      else:
+        (length,) = struct.unpack_from('<I', data, pos)
+        props.append(data[pos + 4 : pos + 4 + length])
+        pos += 4 + length
+    nodes.append((name, props, read_fbx_nodes(data, pos, node_end)))
+    pos = node_end
+  return nodes
+
+
+def find(nodes, name):
+  return [n for n in nodes if n[0] == name]
+
+
+class TestWriteFbx(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.fbx_name = os.path.join(self.tmpdir, 'out.fbx')
+    self.export = json_export_file(make_json_export())
+    self.json_name = self.export.__enter__()
+
+  def tearDown(self):
+    self.export.__exit__(None, None, None)
+    shutil.rmtree(self.tmpdir)
+
+  def test_layout(self):
+    meshes = list(iter_meshes(self.json_name, arrays=True))
+    fbx.write_fbx(meshes, self.fbx_name)
+    data = open(self.fbx_name, 'rb').read()
+    self.assertEqual(data[:23], fbx.FBX_MAGIC)
+    self.assertEqual(struct.unpack_from('<I', data, 23)[0], 7400)
+    self.assertTrue(data.endswith(fbx.FOOTER_MAGIC))
+    self.assertEqual(len(data) % 16, 0)
+
+    nodes = read_fbx_nodes(data, 27, len(data))
+    self.assertEqual([n[0] for n in nodes][-4:],
+                     ['Definitions', 'Objects', 'Connections', 'Takes'])
+    objects = find(nodes, 'Objects')[0][2]
+    geometries = find(objects, 'Geometry')
+    self.assertEqual(len(geometries), 6)
+    self.assertEqual(len(find(objects, 'Material')), 2)
+    self.assertEqual(len(find(find(nodes, 'Connections')[0][2], 'C')), 18)
+
+    (geometry_id, name, _) = geometries[1][1]
+    self.assertEqual(name, 'Tilt Brush\x00\x01Geometry')
+    children = geometries[1][2]
+    verts = find(children, 'Vertices')[0][1][0].reshape(-1, 3)
+    self.assertEqual(verts.tolist(), (meshes[1].v * 100).tolist())
+    index = find(children, 'PolygonVertexIndex')[0][1][0].reshape(-1, 3)
+    self.assertEqual(index[:, :2].tolist(), meshes[1].tri[:, :2].tolist())
+    self.assertEqual((~index[:, 2]).tolist(), meshes[1].tri[:, 2].tolist())
+    colors = find(find(children, 'LayerElementColor')[0][2], 'Colors')[0][1][0]
+    self.assertEqual(colors[:4].tolist(), [0, 0, 0, 1])
+    layer = find(children, 'Layer')[0][2]
+    self.assertEqual([find(e[2], 'Type')[0][1][0] for e in layer[1:]],
+                     ['LayerElementNormal', 'LayerElementMaterial',
+                      'LayerElementColor', 'LayerElementUV'])
+
+  def test_list_meshes(self):
+    fbx.write_fbx(iter_meshes(self.json_name), self.fbx_name)
+    expected = os.path.join(self.tmpdir, 'expected.fbx')
+    fbx.write_fbx(iter_meshes(self.json_name, arrays=True), expected)
+    self.assertEqual(open(self.fbx_name, 'rb').read(),
+                     open(expected, 'rb').read())
+
+  def test_round_trip(self):
+    meshes = list(iter_meshes(self.json_name, arrays=True))
+    fbx.write_fbx(meshes, self.fbx_name)
+    actual = fbx.read_fbx(self.fbx_name)
+    self.assertEqual(len(actual), len(meshes))
+    for (m, e) in zip(actual, meshes):
+      self.assertEqual(m.brush_name, e.brush_name)
+      self.assertEqual(m.brush_guid, e.brush_guid)
+      for attr in ('v', 'n', 'uv0', 'c', 'tri'):
+        self.assertTrue(np.allclose(getattr(m, attr), getattr(e, attr)), attr)
+      self.assertIsNone(m.t)
+
+  def test_materials_without_guid(self):
+    meshes = list(iter_meshes(self.json_name, arrays=True))[:3]
+    for (mesh, name) in zip(meshes, ['Light', 'Ink', 'Light']):
+      mesh.brush_name = name
+      mesh.brush_guid = None
+    fbx.write_fbx(meshes, self.fbx_name)
+    actual = fbx.read_fbx(self.fbx_name)
+    self.assertEqual([m.brush_name for m in actual], ['Light', 'Ink', 'Light'])
+    self.assertEqual([m.brush_guid for m in actual], [None] * 3)
+
+
+class TestReadFbx(unittest.TestCase):
+  def test_unity_fixture(self):
+    (mesh,) = fbx.read_fbx(os.path.join(FIXTURE_DIR, 'v10-bin-fbx.bytes'))
+    self.assertEqual(mesh.name, 'Light_geo')
+    self.assertEqual(mesh.brush_name, 'Light')
+    self.assertEqual(mesh.v.shape, (42, 3))
+    self.assertEqual(mesh.tri.tolist()[:2], [[0, 2, 1], [3, 5, 4]])
+    for attr in ('n', 'c', 'uv0', 't'):
+      self.assertEqual(len(getattr(mesh, attr)), 42)
+    self.assertEqual(mesh.t.shape, (42, 4))
+    # Unity SDK text fixture has the same data
+    self.assertTrue(np.allclose(mesh.v[0], [-1.25784909725189,
+                                            1.32738041877747,
+                                            0.172027766704559]))
+
+  def test_lazy_arrays(self):
+    filename = os.path.join(FIXTURE_DIR, 'v10-bin-fbx.bytes')
+    with fbx.FbxReader(filename) as reader:
+      self.assertEqual(reader.version, 7400)
+      objects = [n for n in reader.iter_nodes() if n.name == 'Objects'][0]
+      geometry = objects.find('Geometry')
+      verts = geometry.find('Vertices')
+      self.assertIsInstance(verts._props[0], fbx._ArrayProperty)
+      self.assertEqual(verts.props[0].shape, (126,))
+      # Compressed arrays decompress too
+      colors = geometry.find('LayerElementColor').find('Colors')
+      self.assertEqual(colors.props[0].shape, (168,))
+
+  def test_not_binary(self):
+    self.assertRaises(ValueError, fbx.read_fbx,
+                      os.path.join(FIXTURE_DIR, 'v10-text-fbx.bytes'))
+
+  def test_triangulate(self):
+    # A triangle, a quad and a pentagon
+    index = np.array([0, 1, ~2, 3, 4, 5, ~6, 7, 8, 9, 10, ~11])
+    (corners, tri) = fbx._triangulate(index)
+    self.assertEqual(corners.tolist(), range(12))
+    self.assertEqual(tri.tolist(), [[0, 1, 2], [3, 4, 5], [3, 5, 6],
+                                    [7, 8, 9], [7, 9, 10], [7, 10, 11]])
+
+
+if __name__ == '__main__':
+  unittest.main()
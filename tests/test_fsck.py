@@ -0,0 +1,112 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from tiltbrush import fsck, unpack
+
+SKETCH1 = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'data', 'sketch1.tilt')
+
+
+class TestFsck(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def copy(self, name, unpacked=False):
+    filename = os.path.join(self.tmpdir, name)
+    shutil.copy(SKETCH1, filename)
+    if unpacked:
+      unpack.convert_zip_to_dir(filename)
+    return filename
+
+  def patch(self, filename, offset, data):
+    with open(filename, 'r+b') as f:
+      f.seek(offset)
+      f.write(data)
+
+  def checks(self, filename):
+    report = fsck.check_tilt(filename)
+    self.assertEqual(report['ok'], not report['problems'])
+    return [p['check'] for p in report['problems']]
+
+  def test_good(self):
+    for unpacked in (False, True):
+      report = fsck.check_tilt(self.copy('good.tilt', unpacked))
+      self.assertEqual(report['problems'], [])
+      self.assertEqual((report['strokes'], report['controlpoints']), (5, 912))
+      self.assertEqual(report['format'], 'dir' if unpacked else 'zip')
+      shutil.rmtree(self.tmpdir)
+      os.mkdir(self.tmpdir)
+
+  def test_bad_header(self):
+    filename = self.copy('bad.tilt')
+    self.patch(filename, 0, 'xxxx')
+    self.assertEqual(self.checks(filename), ['header'])
+
+  def test_bad_crc(self):
+    filename = self.copy('bad.tilt')
+    with open(filename, 'rb') as inf:
+      data = inf.read()
+    start = data.find(struct.pack('<I', fsck.SKETCH_COOKIE))
+    self.patch(filename, start + 1000, chr(ord(data[start + 1000]) ^ 0xff))
+    self.assertEqual(self.checks(filename), ['zip'])
+
+  def test_truncated_sketch(self):
+    filename = self.copy('bad.tilt', unpacked=True)
+    sketch = os.path.join(filename, 'data.sketch')
+    with open(sketch, 'r+b') as f:
+      f.truncate(os.path.getsize(sketch) - 10)
+    self.assertEqual(self.checks(filename), ['sketch'])
+    with open(sketch, 'r+b') as f:
+      f.truncate(0)
+    self.assertEqual(self.checks(filename), ['sketch'])
+
+  def test_bad_brush_index(self):
+    filename = self.copy('bad.tilt', unpacked=True)
+    sketch = os.path.join(filename, 'data.sketch')
+    with open(sketch, 'rb') as inf:
+      (additional,) = struct.unpack('<I', inf.read(16)[12:])
+    self.patch(sketch, 16 + additional + 4, struct.pack('<i', 7))
+    self.assertEqual(self.checks(filename), ['brush_index'])
+
+  def test_bad_metadata(self):
+    filename = self.copy('bad.tilt', unpacked=True)
+    with open(os.path.join(filename, 'metadata.json'), 'wb') as outf:
+      outf.write('{ "BrushIndex": ')
+    self.assertEqual(self.checks(filename), ['metadata'])
+
+  def test_find_and_check_parallel(self):
+    good = self.copy('a.tilt')
+    unpacked = self.copy('b.tilt', unpacked=True)
+    os.mkdir(os.path.join(self.tmpdir, 'sub'))
+    bad = self.copy(os.path.join('sub', 'c.tilt'))
+    self.patch(bad, 0, 'xxxx')
+    filenames = list(fsck.find_tilts([self.tmpdir]))
+    self.assertEqual(sorted(filenames), sorted([good, unpacked, bad]))
+    reports = list(fsck.check_tilts(filenames, jobs=2))
+    self.assertEqual([r['path'] for r in reports], filenames)
+    self.assertEqual(dict((r['path'], r['ok']) for r in reports),
+                     { good: True, unpacked: True, bad: False })
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,120 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from tiltbrush import geometry
+
+from test_tilt import copy_of_tilt
+
+
+def straight_stroke(num_cp=5):
+  positions = np.zeros((num_cp, 3))
+  positions[:, 0] = np.arange(num_cp)
+  orientations = np.tile([0.0, 0.0, 0.0, 1.0], (num_cp, 1))
+  return (positions, orientations)
+
+
+def face_normals(mesh):
+  v = mesh.v[mesh.tri.astype(np.int64)]
+  return np.cross(v[:, 1] - v[:, 0], v[:, 2] - v[:, 0])
+
+
+class TestStrokeToMesh(unittest.TestCase):
+  def test_ribbon(self):
+    mesh = geometry.stroke_to_mesh(*straight_stroke(), size=0.5,
+                                   color=(1, 0, 0, 1))
+    self.assertEqual(mesh.v.shape, (10, 3))
+    self.assertEqual(mesh.tri.shape, (8, 3))
+    widths = np.linalg.norm(mesh.v[1::2] - mesh.v[0::2], axis=1)
+    self.assertTrue(np.allclose(widths, 0.5))
+    self.assertEqual(mesh.uv0[[0, -1]].tolist(), [[0, 0], [1, 1]])
+    self.assertEqual(mesh.c.tolist(), [0xff0000ff] * 10)
+    # Triangles wind counter-clockwise around the vertex normals
+    dots = (face_normals(mesh) * mesh.n[mesh.tri[:, 0]]).sum(axis=1)
+    self.assertTrue((dots > 0).all())
+
+  def test_pressure(self):
+    pressure = np.linspace(0, 1, 5)
+    mesh = geometry.stroke_to_mesh(*straight_stroke(), size=1.0,
+                                   pressure=pressure)
+    widths = np.linalg.norm(mesh.v[1::2] - mesh.v[0::2], axis=1)
+    self.assertTrue(np.allclose(widths, 0.1 + 0.9 * pressure))
+
+  def test_tube(self):
+    mesh = geometry.stroke_to_mesh(*straight_stroke(), size=0.5, tube=True,
+                                   tube_sides=6)
+    self.assertEqual(mesh.v.shape, (5 * 7, 3))
+    self.assertEqual(mesh.tri.shape, (4 * 6 * 2, 3))
+    self.assertTrue(np.allclose(np.linalg.norm(mesh.v[:, 1:], axis=1), 0.25))
+    # Triangles face outward
+    centroids = mesh.v[mesh.tri.astype(np.int64)].mean(axis=1)
+    centroids[:, 0] = 0
+    self.assertTrue(((face_normals(mesh) * centroids).sum(axis=1) > 0).all())
+
+  def test_degenerate(self):
+    (positions, orientations) = straight_stroke(3)
+    positions[1] = positions[0]
+    mesh = geometry.stroke_to_mesh(positions, orientations, size=1.0)
+    self.assertEqual(len(mesh.v), 4)
+    self.assertIsNone(
+      geometry.stroke_to_mesh(positions[:2], orientations[:2], size=1.0))
+
+
+class TestIterMeshes(unittest.TestCase):
+  def test_sketch(self):
+    with copy_of_tilt() as tilt:
+      meshes = list(geometry.iter_meshes(tilt))
+      self.assertEqual(len(meshes), len(tilt.sketch.strokes))
+      brushes = set(tilt.metadata['BrushIndex'])
+      for mesh in meshes:
+        self.assertIn(str(mesh.brush_guid), brushes)
+        self.assertTrue(mesh.uses_arrays)
+
+      # Parsed control points give the same geometry as raw ones
+      for stroke in tilt.sketch.strokes:
+        stroke.controlpoints
+      for (m, e) in zip(geometry.iter_meshes(tilt), meshes):
+        self.assertEqual(m.v.tolist(), e.v.tolist())
+
+  def test_jobs(self):
+    with copy_of_tilt() as tilt:
+      expected = list(geometry.iter_meshes(tilt))
+    with copy_of_tilt() as tilt:
+      meshes = list(geometry.iter_meshes(tilt, jobs=2))
+    self.assertEqual(len(meshes), len(expected))
+    for (m, e) in zip(meshes, expected):
+      self.assertEqual(m.brush_guid, e.brush_guid)
+      self.assertEqual(m.v.tolist(), e.v.tolist())
+
+  def test_empty_stroke(self):
+    with copy_of_tilt() as tilt:
+      strokes = tilt.sketch.strokes
+      (reader, _, _) = strokes[0].__dict__['_controlpoints']
+      strokes[0].__dict__['_controlpoints'] = (reader, 0, '')
+      strokes[1].controlpoints = []
+      meshes = list(geometry.iter_meshes(tilt))
+      self.assertEqual(len(meshes), len(strokes) - 2)
+
+  def test_jobs_stopped_early(self):
+    with copy_of_tilt() as tilt:
+      meshes = geometry.iter_meshes(tilt, jobs=2)
+      self.assertTrue(next(meshes).uses_arrays)
+      meshes.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
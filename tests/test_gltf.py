@@ -0,0 +1,147 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from uuid import UUID
+
+from tiltbrush import gltf
+from tiltbrush.export import iter_meshes
+
+from test_export import json_export_file, make_json_export
+
+
+def read_glb_chunks(filename):
+  data = open(filename, 'rb').read()
+  magic, version, length = struct.unpack_from('<4sII', data, 0)
+  assert (magic, version, length) == ('glTF', 2, len(data))
+  chunks = []
+  pos = 12
+  while pos < len(data):
+    chunk_length, chunk_type = struct.unpack_from('<II', data, pos)
+    chunks.append((chunk_type, data[pos + 8 : pos + 8 + chunk_length]))
+    pos += 8 + chunk_length
+  return chunks
+
+
+class TestWriteGlb(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.glb_name = os.path.join(self.tmpdir, 'out.glb')
+    self.export = json_export_file(make_json_export())
+    self.json_name = self.export.__enter__()
+
+  def tearDown(self):
+    self.export.__exit__(None, None, None)
+    shutil.rmtree(self.tmpdir)
+
+  def test_layout(self):
+    gltf.write_glb(iter_meshes(self.json_name), self.glb_name)
+    chunks = read_glb_chunks(self.glb_name)
+    self.assertEqual([c[0] for c in chunks], [gltf.CHUNK_JSON, gltf.CHUNK_BIN])
+    root = json.loads(chunks[0][1])
+    self.assertEqual(root['buffers'][0]['byteLength'] + 3 & ~3, len(chunks[1][1]))
+    for view in root['bufferViews']:
+      self.assertEqual(view['byteOffset'] % 4, 0)
+
+    primitives = root['meshes'][0]['primitives']
+    self.assertEqual(len(primitives), 2)
+    material = root['materials'][primitives[0]['material']]
+    self.assertEqual(material['name'],
+                     'material_Light-2241cd32-8ba2-48a5-9ee7-2caef7e9ed62')
+    self.assertEqual(material['extras']['brush_guid'],
+                     '2241cd32-8ba2-48a5-9ee7-2caef7e9ed62')
+
+    attributes = primitives[0]['attributes']
+    self.assertEqual(sorted(attributes),
+                     ['COLOR_0', 'NORMAL', 'POSITION', 'TEXCOORD_0'])
+    position = root['accessors'][attributes['POSITION']]
+    self.assertEqual(position['count'], 30)
+    self.assertEqual(position['min'], [0, 0, 0])
+    self.assertEqual(position['max'], [44, 1, 0])
+    indices = root['accessors'][primitives[0]['indices']]
+    self.assertEqual(indices['count'], 3 * 24)
+    self.assertEqual(indices['componentType'], gltf.UNSIGNED_INT)
+
+    # Check the raw data of the first color
+    color = root['accessors'][attributes['COLOR_0']]
+    self.assertTrue(color['normalized'])
+    offset = root['bufferViews'][color['bufferView']]['byteOffset']
+    self.assertEqual(chunks[1][1][offset : offset + 4], '\x00\x00\x00\xff')
+
+
+class TestReadGlb(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.glb_name = os.path.join(self.tmpdir, 'out.glb')
+    self.export = json_export_file(make_json_export())
+    self.json_name = self.export.__enter__()
+
+  def tearDown(self):
+    self.export.__exit__(None, None, None)
+    shutil.rmtree(self.tmpdir)
+
+  def test_round_trip(self):
+    import numpy as np
+    expected = list(iter_meshes(self.json_name, arrays=True))
+    expected[0].uv0 = np.ones((10, 3), dtype=np.float32)
+    gltf.write_glb(expected, self.glb_name)
+    expected = list(gltf._iter_brush_meshes(expected))
+    meshes = gltf.read_glb(self.glb_name)
+    self.assertEqual(len(meshes), 2)
+    for (m, e) in zip(meshes, expected):
+      self.assertEqual((m.brush_name, m.brush_guid),
+                       (e.brush_name, e.brush_guid))
+      for attr in ('v', 'n', 'uv0', 'c', 'tri'):
+        self.assertEqual(getattr(m, attr).tolist(), getattr(e, attr).tolist())
+      self.assertIsNone(m.t)
+    # Wide texcoords come from the Unity SDK attribute
+    self.assertEqual(meshes[0].uv0.shape, (30, 3))
+
+  def test_zero_copy(self):
+    gltf.write_glb(iter_meshes(self.json_name), self.glb_name)
+    before = open(self.glb_name, 'rb').read()
+    mesh = gltf.read_glb(self.glb_name)[0]
+    for attr in ('v', 'n', 'uv0', 'c', 'tri'):
+      self.assertFalse(getattr(mesh, attr).flags.owndata, attr)
+    # Views are writable, but copy-on-write
+    mesh.v += 1
+    mesh.recenter()
+    self.assertEqual(open(self.glb_name, 'rb').read(), before)
+
+  def test_material_names(self):
+    guid = '2241cd32-8ba2-48a5-9ee7-2caef7e9ed62'
+    self.assertEqual(
+      gltf._brush_from_material({ 'name': 'material_Light-' + guid }),
+      ('Light', UUID(guid)))
+    self.assertEqual(
+      gltf._brush_from_material({
+        'name': 'Smoke',
+        'extensions': { 'GOOGLE_tilt_brush_material': { 'guid': guid } } }),
+      ('Smoke', UUID(guid)))
+    self.assertEqual(gltf._brush_from_material({ 'name': 'pbr' }),
+                     ('pbr', None))
+
+  def test_not_glb(self):
+    with open(self.glb_name, 'wb') as outf:
+      outf.write('{"not": "a glb file"}')
+    self.assertRaises(gltf.GlbError, gltf.read_glb, self.glb_name)
+
+
+if __name__ == '__main__':
+  unittest.main()
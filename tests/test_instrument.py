@@ -0,0 +1,98 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tiltbrush import instrument
+from tiltbrush.export import iter_meshes
+from tiltbrush.tilt import Tilt
+
+from test_export import json_export_file, make_json_export
+from test_tilt import copy_of_tilt
+
+
+class TestInstrument(unittest.TestCase):
+  def test_disabled(self):
+    self.assertIs(instrument.phase('zip_open'), instrument._NULL_PHASE)
+    with instrument.recording():
+      self.assertIsNot(instrument.phase('zip_open'), instrument._NULL_PHASE)
+    self.assertIs(instrument.phase('zip_open'), instrument._NULL_PHASE)
+
+  def test_tilt_phases(self):
+    with copy_of_tilt(as_filename=True) as filename:
+      with instrument.recording() as rec:
+        tilt = Tilt(filename)
+        for stroke in tilt.sketch.strokes:
+          stroke.controlpoints
+      with instrument.recording() as write_rec:
+        tilt.write_sketch()
+    report = rec.report()
+    self.assertEqual(sorted(report), [
+      'cp_decode', 'member_read', 'metadata_parse', 'metadata_validate',
+      'stroke_headers', 'zip_open'])
+    self.assertEqual(report['member_read']['calls'], 2)
+    self.assertEqual(report['stroke_headers']['objects'], 5)
+    self.assertEqual(report['cp_decode']['calls'], 5)
+    self.assertEqual(report['cp_decode']['objects'], 912)
+    self.assertIn('cp_decode 5x', rec.log_line())
+    self.assertEqual(json.loads(rec.to_json()), report)
+
+    report = write_rec.report()
+    self.assertIn('zip_extract', report)
+    self.assertIn('zip_write', report)
+    self.assertEqual(report['sketch_encode']['objects'], 5)
+
+  def test_export_phases(self):
+    with json_export_file(make_json_export()) as filename:
+      with instrument.recording() as rec:
+        list(iter_meshes(filename))
+    report = rec.report()
+    self.assertEqual(report['json_export_parse']['objects'], 6)
+    self.assertEqual(report['mesh_decode']['objects'], 6)
+    self.assertGreater(report['mesh_decode']['bytes'], 0)
+
+  def test_deep_sizeof(self):
+    import numpy as np
+    shared = [1.5] * 10
+    self.assertGreater(instrument.deep_sizeof([shared, shared]),
+                       instrument.deep_sizeof(shared))
+    seen = set()
+    instrument.deep_sizeof(shared, seen)
+    self.assertEqual(instrument.deep_sizeof(shared, seen), 0)
+    arr = np.zeros(1000)
+    self.assertGreater(instrument.deep_sizeof(arr), 8000)
+    self.assertGreater(instrument.deep_sizeof(arr[:10]), 8000)
+    self.assertEqual(instrument.deep_sizeof(TestInstrument), 0)
+
+  def test_report_at_exit(self):
+    rec = instrument.Recorder()
+    rec.add('zip_open', 0.5, 0, 0)
+    rec.add('zip_open', 0.25, 10, 1)
+    tmpdir = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(tmpdir, 'report.json')
+      instrument._report_at_exit(rec, filename)
+      with open(filename) as inf:
+        self.assertEqual(json.load(inf), { 'zip_open': {
+          'calls': 2, 'seconds': 0.75, 'bytes': 10, 'objects': 1 } })
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,93 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from tiltbrush import loading
+from tiltbrush.tilt import Tilt
+
+SKETCH1 = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'data', 'sketch1.tilt')
+
+
+def summarize(strokes):
+  return [(s.brush_idx, [cp.position for cp in s.controlpoints])
+          for s in strokes]
+
+
+class TestLoading(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.loader = loading.Loader(2)
+
+  def tearDown(self):
+    self.loader.close()
+    shutil.rmtree(self.tmpdir)
+
+  def copy(self, name):
+    filename = os.path.join(self.tmpdir, name)
+    shutil.copy(SKETCH1, filename)
+    return filename
+
+  def test_open(self):
+    called = threading.Event()
+    result = self.loader.open(SKETCH1, decode=True,
+                              callback=lambda r: called.set())
+    tilt = result.result(10)
+    self.assertTrue(result.done())
+    self.assertTrue(called.wait(10))
+    self.assertIsNone(result.exception())
+    self.assertEqual(len(tilt.sketch.strokes), 5)
+    self.assertTrue(all('controlpoints' in s.__dict__ for s in tilt.sketch.strokes))
+    # Already done: called at once
+    seen = []
+    result.add_done_callback(seen.append)
+    self.assertEqual(seen, [result])
+
+  def test_open_error(self):
+    result = loading.open_async(os.path.join(self.tmpdir, 'missing.tilt'))
+    self.assertRaises(IOError, result.result, 10)
+    self.assertIsInstance(result.exception(), IOError)
+
+  def test_iter_strokes(self):
+    expected = summarize(Tilt(SKETCH1).sketch.strokes)
+    self.assertEqual(summarize(self.loader.iter_strokes(SKETCH1, prefetch=1)),
+                     expected)
+    # Abandoning iterators frees their threads
+    for i in range(3):
+      strokes = self.loader.iter_strokes(SKETCH1, prefetch=1)
+      next(strokes)
+      strokes.close()
+    self.assertEqual(summarize(loading.iter_strokes(SKETCH1)), expected)
+
+  def test_load_many(self):
+    paths = [self.copy('%d.tilt' % i) for i in range(7)]
+    bad = os.path.join(self.tmpdir, 'bad.tilt')
+    with open(bad, 'wb') as outf:
+      outf.write('junk')
+    results = list(loading.load_many(iter(paths + [bad]), concurrency=2))
+    self.assertEqual(sorted(r.path for r in results), sorted(paths + [bad]))
+    for r in results:
+      if r.path == bad:
+        self.assertIsNotNone(r.exception())
+      else:
+        self.assertEqual(len(r.result().sketch.strokes), 5)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,87 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tiltbrush import obj
+from tiltbrush.export import iter_meshes, TiltBrushMesh
+
+from test_export import json_export_file, make_json_export
+
+
+def reference_obj(mesh, use_color):
+  """The original one-line-at-a-time .obj writer, for comparison."""
+  lines = []
+  if use_color:
+    for v, c32 in zip(mesh.v, mesh.c):
+      r = ( (c32 >> 0) & 0xff ) / 255.0
+      g = ( (c32 >> 8) & 0xff ) / 255.0
+      b = ( (c32 >>16) & 0xff ) / 255.0
+      lines.append("v %f %f %f %f %f %f\n" % (v[0], v[1], v[2], r, g, b))
+      lines.append("vc %f %f %f\n" % (r, g, b))
+  else:
+    for v in mesh.v:
+      lines.append("v %f %f %f\n" % v)
+  for uv in mesh.uv0:
+    lines.append("vt %f %f\n" % (uv[0], uv[1]))
+  for n in mesh.n:
+    lines.append("vn %f %f %f\n" % n)
+  for (t1, t2, t3) in mesh.tri:
+    t1 += 1; t2 += 1; t3 += 1
+    lines.append("f %d/%d/%d %d/%d/%d %d/%d/%d\n" % (t1,t1,t1, t2,t2,t2, t3,t3,t3))
+  return ''.join(lines)
+
+
+class TestWriteObj(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.obj_name = os.path.join(self.tmpdir, 'out.obj')
+    self.export = json_export_file(make_json_export())
+    self.json_name = self.export.__enter__()
+
+  def tearDown(self):
+    self.export.__exit__(None, None, None)
+    shutil.rmtree(self.tmpdir)
+
+  def test_matches_reference(self):
+    old_rows = obj.CHUNK_ROWS
+    obj.CHUNK_ROWS = 7
+    try:
+      for use_color in (False, True):
+        mesh = TiltBrushMesh.from_meshes(iter_meshes(self.json_name))
+        obj.write_obj([mesh], self.obj_name, use_color)
+        self.assertEqual(open(self.obj_name, 'rb').read(),
+                         reference_obj(mesh, use_color))
+    finally:
+      obj.CHUNK_ROWS = old_rows
+
+  def test_groups(self):
+    meshes = list(iter_meshes(self.json_name, arrays=True))[:2]
+    meshes[1].uv0 = None
+    obj.write_obj(meshes, self.obj_name, groups=True, jobs=2)
+    lines = open(self.obj_name, 'rb').read().splitlines()
+    self.assertEqual(lines[0], 'mtllib out.mtl')
+    self.assertEqual(lines[1:3], ['g Light', 'usemtl Light'])
+    self.assertIn('usemtl Ink', lines)
+    self.assertEqual(lines[-1], 'f 18//18 20//20 19//19')
+    mtl = open(os.path.join(self.tmpdir, 'out.mtl'), 'rb').read()
+    self.assertIn('newmtl Light\n', mtl)
+    self.assertIn('newmtl Ink\n', mtl)
+
+
+if __name__ == '__main__':
+  unittest.main()
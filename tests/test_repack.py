@@ -0,0 +1,90 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from tiltbrush import repack
+
+from test_unpack import SKETCH1, read_members
+
+
+class TestChooseEncoding(unittest.TestCase):
+  def test_policies(self):
+    text = 'abcdefgh' * 1000
+    rand = random.Random(0)
+    noise = ''.join(chr(rand.randrange(256)) for _ in xrange(1000))
+    self.assertEqual(repack.choose_encoding(text, 'hot')[:2], (repack.STORED, None))
+    self.assertEqual(repack.choose_encoding(text, 'balanced')[0], repack.DEFLATED)
+    (compress_type, level, raw) = repack.choose_encoding(text, 'cold')
+    self.assertEqual(compress_type, repack.DEFLATED)
+    self.assertLessEqual(len(raw), len(repack.choose_encoding(text, 'balanced')[2]))
+    for policy in repack.POLICIES:
+      self.assertEqual(repack.choose_encoding(noise, policy), (repack.STORED, None, noise))
+    self.assertRaises(ValueError, repack.choose_encoding, text, 'warm')
+
+
+class TestRepack(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.tmpdir, 'sketch.tilt')
+    shutil.copy(SKETCH1, self.filename)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def compress_types(self):
+    with zipfile.ZipFile(self.filename) as zf:
+      return [info.compress_type for info in zf.infolist()]
+
+  def test_dry_run(self):
+    report = repack.repack_tilt(self.filename, 'cold', dry_run=True)
+    self.assertFalse(report['rewritten'])
+    self.assertLess(report['after'], report['before'])
+    self.assertEqual(self.compress_types(), [repack.STORED] * 3)
+
+  def test_round_trip(self):
+    report = repack.repack_tilt(self.filename, 'cold')
+    self.assertTrue(report['rewritten'])
+    self.assertEqual(report['after'], os.path.getsize(self.filename))
+    self.assertLess(report['after'], report['before'])
+    self.assertEqual(self.compress_types(), [repack.DEFLATED] * 3)
+    self.assertEqual(read_members(self.filename), read_members(SKETCH1))
+
+    # Nothing to do the second time
+    report = repack.repack_tilt(self.filename, 'cold')
+    self.assertFalse(report['rewritten'])
+    self.assertTrue(all(m['copied'] for m in report['members']))
+
+    report = repack.repack_tilt(self.filename, 'hot')
+    self.assertEqual(report['after'], os.path.getsize(SKETCH1))
+    self.assertEqual(self.compress_types(), [repack.STORED] * 3)
+    self.assertEqual(read_members(self.filename), read_members(SKETCH1))
+
+  def test_repack_tilts(self):
+    bad = os.path.join(self.tmpdir, 'bad.tilt')
+    with open(bad, 'wb') as outf:
+      outf.write('nope')
+    reports = list(repack.repack_tilts([self.filename, bad], jobs=2,
+                                       policy='balanced'))
+    self.assertTrue(reports[0]['rewritten'])
+    self.assertIn('error', reports[1])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,167 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import httplib
+import json
+import os
+import signal
+import struct
+import threading
+import time
+import unittest
+
+from tiltbrush import server
+from tiltbrush.tilt import Tilt
+
+from test_export import make_json_export
+from test_unpack import SKETCH1
+
+
+class TestServer(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.server = server.ConversionServer(('localhost', 0), workers=1, max_queue=0)
+    cls.thread = threading.Thread(target=cls.server.serve_forever)
+    cls.thread.daemon = True
+    cls.thread.start()
+    with open(SKETCH1, 'rb') as inf:
+      cls.tilt_data = inf.read()
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.server.shutdown()
+    cls.server.close()
+
+  def request(self, method, path, body=None):
+    conn = httplib.HTTPConnection('localhost', self.server.server_address[1])
+    try:
+      conn.request(method, path, body)
+      response = conn.getresponse()
+      return (response.status, dict(response.getheaders()), response.read())
+    finally:
+      conn.close()
+
+  def test_tilt_conversions(self):
+    (status, headers, body) = self.request('POST', '/tilt/stats', self.tilt_data)
+    self.assertEqual(status, 200)
+    stats = json.loads(body)
+    self.assertEqual((stats['strokes'], stats['controlpoints']), (5, 912))
+    timings = headers['server-timing']
+    for name in ('queue;dur=', 'convert;dur=', 'total;dur='):
+      self.assertIn(name, timings)
+
+    (status, headers, body) = self.request('POST', '/tilt/json', self.tilt_data)
+    self.assertEqual(status, 200)
+    self.assertEqual(headers['content-type'], 'application/json')
+    dump = json.loads(body)
+    self.assertEqual(sum(len(s['control_points']) for s in dump['strokes']), 912)
+
+    (status, _, body) = self.request('POST', '/tilt/normalized', self.tilt_data)
+    self.assertEqual(status, 200)
+    self.assertEqual(len(Tilt.from_bytes(body).sketch.strokes), 5)
+
+  def test_json_export(self):
+    (status, _, body) = self.request('POST', '/json/glb', make_json_export())
+    self.assertEqual(status, 200)
+    self.assertEqual(struct.unpack('<4sII', body[:12]), ('glTF', 2, len(body)))
+
+  def test_errors(self):
+    self.assertEqual(self.request('POST', '/tilt/nope', 'x')[0], 404)
+    (status, _, body) = self.request('POST', '/tilt/json', 'not a tilt')
+    self.assertEqual(status, 400)
+    self.assertIn('BadTilt', body)
+    self.assertEqual(json.loads(self.request('GET', '/')[2])['conversions'],
+                     sorted(server.CONVERSIONS))
+
+  def test_queue_full(self):
+    # Pretend the only worker is busy
+    with self.server._lock:
+      self.server._jobs['busy'] = time.time()
+    try:
+      (status, headers, _) = self.request('POST', '/tilt/stats', self.tilt_data)
+      self.assertEqual(status, 503)
+      self.assertEqual(headers['retry-after'], '1')
+      self.assertEqual(json.loads(self.request('GET', '/health')[2])['rejected'], 1)
+    finally:
+      with self.server._lock:
+        del self.server._jobs['busy']
+
+  def test_timeout_keeps_slot_until_done(self):
+    slow = server.ConversionServer(('localhost', 0), workers=1, timeout_secs=0)
+    thread = threading.Thread(target=slow.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+      result = slow.submit('tilt/json', self.tilt_data)
+      self.assertEqual(slow.load()['running'], 1)
+      result.wait(10)
+      self.assertEqual(slow.load()['running'], 0)
+      conn = httplib.HTTPConnection('localhost', slow.server_address[1])
+      conn.request('POST', '/tilt/json', self.tilt_data)
+      self.assertEqual(conn.getresponse().status, 504)
+      conn.close()
+      for i in range(100):
+        if slow.load()['served'] == 2:
+          break
+        time.sleep(0.1)
+      load = slow.load()
+      self.assertEqual((load['running'], load['served']), (0, 2))
+    finally:
+      slow.shutdown()
+      slow.close()
+
+  def test_killed_worker(self):
+    # Workers are forked with this in place
+    server.CONVERSIONS['test/kill'] = ('text/plain', 'json', kill_worker)
+    s = server.ConversionServer(('localhost', 0), workers=1, max_queue=0,
+                                timeout_secs=0.5, reclaim_secs=1)
+    thread = threading.Thread(target=s.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+      def post(name, body):
+        conn = httplib.HTTPConnection('localhost', s.server_address[1])
+        conn.request('POST', name, body)
+        status = conn.getresponse().status
+        conn.close()
+        return status
+      self.assertEqual(post('/test/kill', 'x'), 504)
+      self.assertEqual(post('/tilt/stats', self.tilt_data), 503)
+      time.sleep(1)
+      load = s.load()
+      self.assertEqual((load['running'], load['lost']), (0, 1))
+      # The pool has replaced the worker
+      self.assertEqual(post('/tilt/stats', self.tilt_data), 200)
+    finally:
+      del server.CONVERSIONS['test/kill']
+      s.shutdown()
+      s.close()
+
+
+def kill_worker(body):
+  os.kill(os.getpid(), signal.SIGKILL)
+
+
+class TestServerScratch(unittest.TestCase):
+  def test_close_removes_scratch(self):
+    s = server.ConversionServer(('localhost', 0), workers=2)
+    scratch_dir = s.scratch_dir
+    s.pool.map(server._convert, [('tilt/stats', 'x', 0)] * 2)
+    self.assertTrue(os.listdir(scratch_dir))
+    s.close()
+    self.assertFalse(os.path.exists(scratch_dir))
+
+
+if __name__ == '__main__':
+  unittest.main()
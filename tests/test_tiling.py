@@ -0,0 +1,94 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tiltbrush import tiling
+from tiltbrush.export import iter_meshes
+from tiltbrush.gltf import read_glb
+
+from test_export import json_export_file, make_json_export
+
+
+def iter_tiles(entry):
+  yield entry
+  for child in entry.get('children', []):
+    for tile in iter_tiles(child):
+      yield tile
+
+
+class TestTiling(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.export = json_export_file(make_json_export(num_strokes=8, num_quads=50))
+    self.json_name = self.export.__enter__()
+
+  def tearDown(self):
+    self.export.__exit__(None, None, None)
+    shutil.rmtree(self.tmpdir)
+
+  def test_single_tile(self):
+    manifest = tiling.tile_export(self.json_name, self.tmpdir)
+    root = manifest['root']
+    self.assertNotIn('children', root)
+    self.assertEqual(root['error'], 0.0)
+    self.assertEqual(root['content']['uri'], 'tile_r.glb')
+    meshes = read_glb(os.path.join(self.tmpdir, 'tile_r.glb'))
+    self.assertEqual(sorted(m.brush_name for m in meshes), ['Ink', 'Light'])
+    self.assertEqual(root['content']['triangles'],
+                     sum(len(m.tri) for m in meshes))
+    with open(os.path.join(self.tmpdir, tiling.MANIFEST_NAME)) as inf:
+      self.assertEqual(json.load(inf), manifest)
+
+  def test_split(self):
+    manifest = tiling.tile_export(self.json_name, self.tmpdir, max_tris=100)
+    tiles = list(iter_tiles(manifest['root']))
+    leaves = [t for t in tiles if 'content' in t]
+    self.assertGreater(len(leaves), 1)
+    self.assertEqual(sorted(f for f in os.listdir(self.tmpdir) if f.endswith('.glb')),
+                     sorted(t['content']['uri'] for t in leaves))
+    expected = sum(len(m.tri) for m in iter_meshes(self.json_name, arrays=True))
+    self.assertEqual(sum(t['content']['triangles'] for t in leaves), expected)
+    for tile in tiles:
+      if 'children' in tile:
+        self.assertNotIn('content', tile)
+        self.assertGreater(tile['error'], max(c['error'] for c in tile['children']))
+        for child in tile['children']:
+          self.assertTrue(child['id'].startswith(tile['id']))
+          for axis in range(3):
+            self.assertGreaterEqual(child['bounds']['min'][axis], tile['bounds']['min'][axis])
+            self.assertLessEqual(child['bounds']['max'][axis], tile['bounds']['max'][axis])
+
+  def test_max_depth(self):
+    manifest = tiling.tile_export(self.json_name, self.tmpdir,
+                                  max_tris=1, max_depth=1)
+    tiles = list(iter_tiles(manifest['root']))
+    self.assertEqual(max(len(t['id']) for t in tiles), 2)
+
+  def test_spill_files_removed(self):
+    bounds = tiling.mesh_bounds(iter_meshes(self.json_name))
+    tiler = tiling.Tiler(bounds, self.tmpdir, max_tris=100)
+    for mesh in iter_meshes(self.json_name):
+      tiler.add(mesh)
+    self.assertTrue(os.listdir(tiler.spill_dir))
+    tiler.finish()
+    self.assertFalse(os.path.exists(tiler.spill_dir))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -13,11 +13,12 @@
 # limitations under the License.
 
 import contextlib
+from io import BytesIO
 import os
 import shutil
 import unittest
 
-from tiltbrush.tilt import Tilt
+from tiltbrush.tilt import BadTilt, Tilt
 
 
 @contextlib.contextmanager
@@ -102,6 +103,68 @@ class TestTiltMutations(unittest.TestCase):
       self.assertEqual(stroke2.scale, 1.25)
       self.assertRaises(AttributeError (lambda: stroke2.flags))
 
+  def test_memory_report(self):
+    with copy_of_tilt() as tilt:
+      sketch = tilt.sketch
+      lazy = sketch.memory_report()
+      self.assertEqual((lazy['strokes'], lazy['controlpoints'],
+                        lazy['decoded_strokes']), (5, 912, 0))
+      self.assertEqual(lazy['bytes']['controlpoints'], 0)
+      self.assertGreater(lazy['bytes']['raw_controlpoints'], 912 * 36)
+      self.assertEqual(lazy['total'], sum(lazy['bytes'].values()))
+      sketch.strokes[0].controlpoints
+      partial = sketch.memory_report()
+      self.assertEqual(partial['decoded_strokes'], 1)
+      self.assertEqual(partial['controlpoints'], 912)
+      for stroke in sketch.strokes:
+        stroke.controlpoints
+      decoded = sketch.memory_report()
+      self.assertEqual(decoded['bytes']['raw_controlpoints'], 0)
+      self.assertGreater(decoded['bytes_per_controlpoint'],
+                         lazy['bytes_per_controlpoint'])
+
+
+class TestTiltInMemory(unittest.TestCase):
+  def setUp(self):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'data', 'sketch1.tilt'), 'rb') as inf:
+      self.data = inf.read()
+
+  def test_from_bytes(self):
+    for data in (self.data, bytearray(self.data), memoryview(self.data)):
+      tilt = Tilt.from_bytes(data)
+      self.assertIsNone(tilt.filename)
+      self.assertEqual(len(tilt.metadata['BrushIndex']), 2)
+      self.assertEqual(sum(len(s.controlpoints) for s in tilt.sketch.strokes), 912)
+      self.assertEqual(tilt.to_bytes(), self.data)
+    self.assertRaises(BadTilt, Tilt.from_bytes, 'PK\x03\x04' + self.data[4:])
+
+  def test_from_fileobj(self):
+    tilt = Tilt.from_fileobj(BytesIO(self.data))
+    self.assertEqual(len(tilt.sketch.strokes), 5)
+
+  def test_to_bytes_from_files(self):
+    with copy_of_tilt(as_filename=True) as filename:
+      self.assertEqual(Tilt(filename).to_bytes(), self.data)
+      with Tilt.as_directory(filename) as tilt:
+        self.assertEqual(Tilt.from_bytes(tilt.to_bytes()).metadata,
+                         Tilt(filename).metadata)
+
+  def test_modify(self):
+    tilt = Tilt.from_bytes(self.data)
+    tilt.sketch.strokes[0].controlpoints[0].position = [1.0, 2.0, 3.0]
+    tilt.write_sketch()
+    with tilt.mutable_metadata() as dct:
+      dct['Authors'] = ['someone']
+    tilt2 = Tilt.from_bytes(tilt.to_bytes())
+    self.assertEqual(tilt2.metadata['Authors'], ['someone'])
+    self.assertEqual(tilt2.sketch.strokes[0].controlpoints[0].position,
+                     [1.0, 2.0, 3.0])
+    with tilt2.subfile_reader('thumbnail.png') as inf:
+      thumbnail = inf.read()
+    with Tilt.from_bytes(self.data).subfile_reader('thumbnail.png') as inf:
+      self.assertEqual(thumbnail, inf.read())
+
 
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,83 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from tiltbrush import unpack
+
+SKETCH1 = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       'data', 'sketch1.tilt')
+
+
+def read_members(filename):
+  with zipfile.ZipFile(filename) as zf:
+    assert zf.testzip() is None
+    return [(info.filename, zf.read(info)) for info in zf.infolist()]
+
+
+class TestUnpack(unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def path(self, name):
+    return os.path.join(self.tmpdir, name)
+
+  def test_round_trip_in_place(self):
+    filename = self.path('sketch.tilt')
+    shutil.copy(SKETCH1, filename)
+    self.assertFalse(unpack.convert_zip_to_dir(filename))
+    self.assertTrue(os.path.isdir(filename))
+    unpack.convert_dir_to_zip(filename, True)
+    self.assertEqual(read_members(filename), read_members(SKETCH1))
+    self.assertTrue(unpack.convert_zip_to_dir(filename))
+    self.assertEqual(sorted(os.listdir(self.tmpdir)), ['sketch.tilt'])
+
+  def test_separate_output(self):
+    unpacked = self.path('unpacked.tilt')
+    unpack.convert_zip_to_dir(SKETCH1, unpacked)
+    self.assertEqual(sorted(os.listdir(unpacked)),
+                     ['data.sketch', 'header.bin', 'metadata.json', 'thumbnail.png'])
+    self.assertRaises(unpack.ConversionError,
+                      unpack.convert_zip_to_dir, SKETCH1, unpacked)
+    unpack.convert_dir_to_zip(unpacked, False, self.path('stored.tilt'))
+    self.assertTrue(os.path.isdir(unpacked))
+    with open(self.path('stored.tilt'), 'rb') as inf:
+      unpack._read_and_check_header(inf)
+    self.assertEqual(read_members(self.path('stored.tilt')), read_members(SKETCH1))
+
+  def test_compression(self):
+    unpacked = self.path('unpacked.tilt')
+    unpack.convert_zip_to_dir(SKETCH1, unpacked)
+    outputs = []
+    for (level, threads) in [(1, 1), (9, 1), (9, 3)]:
+      out_name = self.path('level%d_%d.tilt' % (level, threads))
+      unpack.convert_dir_to_zip(unpacked, True, out_name,
+                                compresslevel=level, threads=threads)
+      self.assertEqual(read_members(out_name), read_members(SKETCH1))
+      with open(out_name, 'rb') as inf:
+        outputs.append(inf.read())
+    self.assertLess(len(outputs[1]), len(outputs[0]))
+    # Threads don't change the output
+    self.assertEqual(outputs[1], outputs[2])
+
+
+if __name__ == '__main__':
+  unittest.main()